@@ -36,6 +36,9 @@ st.page_link("pages/4_Transcription_Factor_Overexpression.py", label="Transcript
 st.page_link("pages/5_Kinase_Network.py", label="Kinase Network Viewer")
 st.page_link("pages/6_Transcription_Factor_Network.py", label="Transcription Factor Network")
 st.page_link("pages/7_Mycobrowser.py", label="Mycobrowser Data Viewer")
+st.page_link("pages/8_Overview.py", label="Overview")
+st.page_link("pages/9_Gene_Profile.py", label="Gene Profile")
+st.page_link("pages/10_Gene_Set_Explorer.py", label="Gene Set Explorer")
 
 st.markdown(
     """
@@ -113,6 +116,36 @@ st.markdown(
     """
 )
 
+st.markdown(
+    """
+    ## Overview
+
+    Get quick summary statistics across all of the data sets: how many compendia conditions change the   
+    expression of a gene, how many hits each STPK mutant has, and how large each transcription factor   
+    regulon is, all at a set of standard cutoffs.  
+    """
+)
+
+st.markdown(
+    """
+    ## Gene Profile
+
+    See everything about a single gene on one page: its largest changes in the gene expression compendia,   
+    its phosphosites and differential expression in the STPK mutants, the transcription factors regulating it   
+    (and the genes it regulates), and its Mycobrowser annotations across species.  
+    """
+)
+
+st.markdown(
+    """
+    ## Gene Set Explorer
+
+    Combine the targets of the transcription factors and STPK mutants with intersections, unions and   
+    differences (e.g. genes regulated by both a kinase and a transcription factor), and see how   
+    up to three gene sets overlap.  
+    """
+)
+
 st.markdown(
     """
     ## Sources:
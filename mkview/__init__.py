@@ -1,11 +1,161 @@
-from .volcano_plot_functions import kinase_volcano_plot, tf_volcano_plot
+from .volcano_plot_functions import (
+    kinase_volcano_plot,
+    kinase_comparison_plot,
+    tf_volcano_plot,
+    chart_to_spec,
+)
 from .network_viz import create_kinase_network, create_tf_network
+from .summary_tables import (
+    build_summary_tables,
+    write_summary_tables,
+    COMPENDIA_SUMMARY_TABLE,
+    KINASE_SUMMARY_TABLE,
+    TF_SUMMARY_TABLE,
+    FOLD_CHANGE_THRESHOLDS,
+    PVAL_CUTOFFS,
+)
+from .database import (
+    connect,
+    data_version,
+    refresh_replica,
+    replica_path,
+)
+from .result_cache import (
+    ResultCache,
+    cache_usage,
+    execute_cached,
+    execute_compact,
+    network_html,
+)
+from .compact import compact_table
+from .disk_cache import DiskCache
+from .coexpression import CoexpressionEngine, get_coexpression_engine
+from .compendia_matrix import (
+    CompendiaMatrix,
+    build_compendia_matrix,
+    get_compendia_matrix,
+)
+from .volcano_specs import (
+    kinase_comparison_spec,
+    kinase_dataset_table,
+    kinase_volcano_spec,
+    tf_volcano_spec,
+    MUTANT_SELECTIONS,
+)
+from .cache_warming import start_cache_warmer, warm_caches
+from .search import search_table, string_columns
+from .catalog import Catalog, get_catalog
+from .prerender import prerender_volcano_specs
+from .gene_profile import (
+    fetch_gene_profile,
+    profile_queries,
+    PROFILE_SECTIONS,
+)
+from .enrichment import (
+    TargetSets,
+    get_target_sets,
+    regulator_enrichment,
+    TARGET_SET_SOURCES,
+)
+from .gene_sets import GeneSetStore, get_gene_set_store, parse_expression
+from .venn_diagram import venn_diagram
+from .connection_pool import ConnectionPool, get_pool, pooled_to_pyarrow
+from .filters import AtLeast, AtMost, FilterSpec, IsIn, Outside, execute_filtered
+from .distribution_plots import (
+    fold_change_distribution_plot,
+    fold_change_distribution_query,
+    get_fold_change_distribution,
+    BIN_WIDTHS,
+    DISTRIBUTION_GROUPS,
+)
+from .profiling import PageProfiler, profile_fragment, profile_page_run, slowest_runs
+from .gene_search import GeneSearchIndex, get_gene_search_index
+from .widgets import gene_selector
+from .preview import (
+    ProgressiveResult,
+    estimate_row_count,
+    fetch_progressive,
+    PREVIEW_ROWS,
+)
 
 __author__ = "Braden Griebel"
 __version__ = "0.0.1"
 __all__ = [
     "kinase_volcano_plot",
+    "kinase_comparison_plot",
     "create_kinase_network",
     "create_tf_network",
-    "tf_volcano_plot"
+    "tf_volcano_plot",
+    "build_summary_tables",
+    "write_summary_tables",
+    "COMPENDIA_SUMMARY_TABLE",
+    "KINASE_SUMMARY_TABLE",
+    "TF_SUMMARY_TABLE",
+    "FOLD_CHANGE_THRESHOLDS",
+    "PVAL_CUTOFFS",
+    "connect",
+    "data_version",
+    "refresh_replica",
+    "replica_path",
+    "chart_to_spec",
+    "ResultCache",
+    "execute_cached",
+    "execute_compact",
+    "compact_table",
+    "DiskCache",
+    "CoexpressionEngine",
+    "get_coexpression_engine",
+    "CompendiaMatrix",
+    "build_compendia_matrix",
+    "get_compendia_matrix",
+    "cache_usage",
+    "network_html",
+    "kinase_comparison_spec",
+    "kinase_dataset_table",
+    "kinase_volcano_spec",
+    "tf_volcano_spec",
+    "MUTANT_SELECTIONS",
+    "start_cache_warmer",
+    "warm_caches",
+    "search_table",
+    "string_columns",
+    "Catalog",
+    "get_catalog",
+    "prerender_volcano_specs",
+    "fetch_gene_profile",
+    "profile_queries",
+    "PROFILE_SECTIONS",
+    "TargetSets",
+    "get_target_sets",
+    "regulator_enrichment",
+    "TARGET_SET_SOURCES",
+    "GeneSetStore",
+    "get_gene_set_store",
+    "parse_expression",
+    "venn_diagram",
+    "ConnectionPool",
+    "get_pool",
+    "pooled_to_pyarrow",
+    "AtLeast",
+    "AtMost",
+    "FilterSpec",
+    "IsIn",
+    "Outside",
+    "execute_filtered",
+    "fold_change_distribution_plot",
+    "fold_change_distribution_query",
+    "get_fold_change_distribution",
+    "BIN_WIDTHS",
+    "DISTRIBUTION_GROUPS",
+    "PageProfiler",
+    "profile_fragment",
+    "profile_page_run",
+    "slowest_runs",
+    "GeneSearchIndex",
+    "get_gene_search_index",
+    "gene_selector",
+    "ProgressiveResult",
+    "estimate_row_count",
+    "fetch_progressive",
+    "PREVIEW_ROWS",
 ]
\ No newline at end of file
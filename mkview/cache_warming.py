@@ -0,0 +1,125 @@
+"""
+Module for warming the shared caches in a background thread, so that the
+first visitor after a deploy doesn't pay for the cold queries
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import logging
+import threading
+import time
+from typing import Callable
+
+# External Imports
+import ibis
+
+# Local Imports
+from .catalog import get_catalog
+from .database import data_version, refresh_replica
+from .enrichment import get_target_sets
+from .summary_tables import FOLD_CHANGE_THRESHOLDS, PVAL_CUTOFFS
+from .volcano_specs import (
+    KINASE_VOLCANO_COLUMNS,
+    MUTANT_SELECTIONS,
+    kinase_comparison_spec,
+    kinase_volcano_spec,
+    tf_volcano_spec,
+)
+
+logger = logging.getLogger(__name__)
+
+_warmer_thread: threading.Thread | None = None
+_warmer_lock = threading.Lock()
+
+
+def warm_caches(
+    con: ibis.BaseBackend,
+    tf_list: list[str],
+    stpk_list: list[str],
+) -> int:
+    # Fill the caches with every volcano plot the pages can show (with the
+    # default sizes) and the enrichment target sets, returns the number of
+    # plots warmed
+    n_warmed = 0
+    for dataset in KINASE_VOLCANO_COLUMNS:
+        for stpk in stpk_list:
+            for mutants in MUTANT_SELECTIONS.values():
+                try:
+                    kinase_volcano_spec(con, dataset, stpk, mutants)
+                    n_warmed += 1
+                except Exception:
+                    logger.exception(
+                        f"Failed to warm {dataset} volcano plot for {stpk} {mutants}"
+                    )
+            try:
+                kinase_comparison_spec(con, dataset, stpk)
+                n_warmed += 1
+            except Exception:
+                logger.exception(f"Failed to warm {dataset} comparison plot for {stpk}")
+    for tf in tf_list:
+        try:
+            tf_volcano_spec(con, tf)
+            n_warmed += 1
+        except Exception:
+            logger.exception(f"Failed to warm TF volcano plot for {tf}")
+    # Target sets for enrichment at every standard cutoff the pages offer
+    # (the kinase page doesn't use a fold change threshold)
+    for pval_cutoff in PVAL_CUTOFFS:
+        for threshold in (0.0, *FOLD_CHANGE_THRESHOLDS):
+            try:
+                get_target_sets(con, pval_cutoff, threshold)
+            except Exception:
+                logger.exception(
+                    f"Failed to warm target sets for {pval_cutoff}, {threshold}"
+                )
+    return n_warmed
+
+
+def _run_warmer(connect: Callable[[], ibis.BaseBackend], interval: float):
+    try:
+        con = connect()
+    except Exception:
+        logger.exception("Failed to start the cache warmer")
+        return
+    warmed_version = None
+    while True:
+        # Re-warm whenever the data has been synced since the last run, a
+        # failure (such as a lost connection) is retried on the next run
+        # rather than stopping the warmer
+        try:
+            refresh_replica(con)
+            # The version is read before warming, so a sync landing while
+            # warming is warmed on the next run
+            version = data_version(con)
+            if version != warmed_version:
+                start = time.perf_counter()
+                catalog = get_catalog(con)
+                n_warmed = warm_caches(con, catalog.tf_list, catalog.stpk_list)
+                warmed_version = version
+                logger.info(
+                    f"Warmed {n_warmed} volcano plots in "
+                    f"{time.perf_counter() - start:.1f}s"
+                )
+        except Exception:
+            logger.exception("Failed to warm the caches")
+        time.sleep(interval)
+
+
+def start_cache_warmer(
+    connect: Callable[[], ibis.BaseBackend],
+    interval: float = 600.0,
+) -> threading.Thread:
+    # Start the warmer once per process, it gets its own connection (created
+    # with connect) so it doesn't compete with sessions for theirs
+    global _warmer_thread
+    with _warmer_lock:
+        if _warmer_thread is None or not _warmer_thread.is_alive():
+            _warmer_thread = threading.Thread(
+                target=_run_warmer,
+                args=(connect, interval),
+                name="mkview-cache-warmer",
+                daemon=True,
+            )
+            _warmer_thread.start()
+    return _warmer_thread
@@ -0,0 +1,160 @@
+"""
+Module for the catalog of tables in the database, along with the values
+the pages offer as choices (kinases, mutants, transcription factors, species
+and genes)
+
+The catalog is loaded once per process (per connection), and reloaded when
+the data version changes, so pages don't need any metadata round trips to
+the database when they start.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import dataclasses
+import threading
+
+# External Imports
+import ibis
+
+# Local Imports
+from .connection_pool import pooled_to_pyarrow
+from .database import data_version, root_lock
+from .result_cache import SingleFlight
+
+# Columns whose distinct values are offered as choices, as the tables (and
+# column in each table) they are read from
+DOMAIN_COLUMNS = {
+    "stpk_list": [("all_phosphosites", "STPK"), ("all_kinase_diff_genes", "STPK")],
+    "mutant_list": [
+        ("all_phosphosites", "Mutant"),
+        ("all_kinase_diff_genes", "Mutant"),
+    ],
+    "tf_list": [("tfoe", "TF")],
+    "species_list": [("mycobrowser", "species")],
+    "gene_list": [("gene_expression_compendia_unpivoted", "Gene")],
+    "tf_gene_list": [("tfoe", "Gene")],
+}
+
+
+@dataclasses.dataclass
+class TableInfo:
+    table: ibis.Table
+    schema: ibis.Schema
+    row_count: int
+
+
+@dataclasses.dataclass
+class Catalog:
+    version: str
+    tables: dict[str, TableInfo]
+    stpk_list: list[str]
+    mutant_list: list[str]
+    tf_list: list[str]
+    species_list: list[str]
+    gene_list: list[str]
+    tf_gene_list: list[str]
+    # Expressions built from the tables (e.g. joins), built once per catalog
+    derived_tables: dict[str, ibis.Table] = dataclasses.field(
+        default_factory=dict, repr=False
+    )
+
+    def table(self, name: str) -> ibis.Table:
+        return self.tables[name].table
+
+    def derived_table(self, name: str, build) -> ibis.Table:
+        # Expressions are immutable, so a racing build just replaces an
+        # identical one
+        table = self.derived_tables.get(name)
+        if table is None:
+            table = self.derived_tables[name] = build()
+        return table
+
+    def schema(self, name: str) -> ibis.Schema:
+        return self.tables[name].schema
+
+    def row_count(self, name: str) -> int:
+        return self.tables[name].row_count
+
+
+def _distinct_values(tables: dict[str, TableInfo], sources) -> list[str]:
+    # Distinct values of a column, combined across all of the tables it is in
+    queries = [
+        tables[name].table.select(value=tables[name].table[column])
+        for name, column in sources
+        if name in tables
+    ]
+    if not queries:
+        return []
+    values = (
+        ibis.union(*queries).filter(ibis._.value.notnull()).distinct().order_by("value")
+    )
+    return pooled_to_pyarrow(values)["value"].to_pylist()
+
+
+def load_catalog(con: ibis.BaseBackend) -> Catalog:
+    version = data_version(con)
+    # Listing the tables (and reading their schemas) uses the connection
+    # directly rather than a pooled cursor
+    with root_lock:
+        handles = {name: con.table(name) for name in con.list_tables()}
+    # All of the row counts are found with a single query
+    counts = {}
+    if handles:
+        count_query = ibis.union(
+            *[
+                table.aggregate(name=ibis.literal(name), n=table.count())
+                for name, table in handles.items()
+            ]
+        )
+        counts = dict(
+            pooled_to_pyarrow(count_query, con).to_pandas().itertuples(index=False)
+        )
+    tables = {
+        name: TableInfo(table=table, schema=table.schema(), row_count=int(counts[name]))
+        for name, table in handles.items()
+    }
+    return Catalog(
+        version=version,
+        tables=tables,
+        **{
+            field: _distinct_values(tables, sources)
+            for field, sources in DOMAIN_COLUMNS.items()
+        },
+    )
+
+
+# Catalogs for each connection, replaced when the data version changes. A
+# catalog is loaded outside of the lock (with concurrent loads of the same
+# connection and version coalesced), so loading one doesn't hold up callers
+# whose catalog is already loaded.
+_catalogs: dict[int, Catalog] = {}
+_catalogs_lock = threading.Lock()
+_catalog_loads = SingleFlight()
+
+
+def get_catalog(con: ibis.BaseBackend) -> Catalog:
+    version = data_version(con)
+    catalog = _loaded_catalog(con, version)
+    if catalog is not None:
+        return catalog
+    return _catalog_loads.run(
+        (id(con), version), lambda: _load_and_store_catalog(con, version)
+    )
+
+
+def _loaded_catalog(con: ibis.BaseBackend, version: str) -> Catalog | None:
+    with _catalogs_lock:
+        catalog = _catalogs.get(id(con))
+    if catalog is None or catalog.version != version:
+        return None
+    return catalog
+
+
+def _load_and_store_catalog(con: ibis.BaseBackend, version: str) -> Catalog:
+    catalog = _loaded_catalog(con, version)
+    if catalog is None:
+        catalog = load_catalog(con)
+        with _catalogs_lock:
+            _catalogs[id(con)] = catalog
+    return catalog
@@ -0,0 +1,141 @@
+"""
+Module for finding genes co-expressed with a query gene (or gene set)
+across all of the conditions in the gene expression compendia
+
+Correlations are computed from rows standardized with missing values
+replaced by the mean of the row, so a missing value contributes nothing.
+This is the Pearson correlation when both genes were measured in every
+sample, but unlike a pairwise-complete correlation (over only the samples
+both genes were measured in) it is pulled towards zero for genes sharing
+few samples with the query. Genes measured in too few samples for their
+correlation to mean much are left out of the neighbours.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import threading
+
+# External Imports
+import ibis
+import numpy as np
+import pandas as pd
+
+# Local Imports
+from .compendia_matrix import (
+    COMPENDIA_TABLE,
+    CompendiaMatrix,
+    get_compendia_matrix,
+    pivot_compendia,
+    standardize_rows,
+)
+from .catalog import get_catalog
+from .database import data_version
+from .result_cache import ResultCache, SingleFlight
+
+# Samples a gene has to be measured in to be offered as a neighbour
+MIN_SAMPLES = 10
+
+
+# Correlation vectors for popular queries
+coexpression_correlations = ResultCache("coexpression_correlations", max_entries=256)
+
+
+class CoexpressionEngine:
+    """
+    Computes the Pearson correlation of a query gene (or the mean profile of a
+    gene set) against every gene in the compendia
+    """
+
+    def __init__(self, matrix: CompendiaMatrix, version: str = ""):
+        self.matrix = matrix
+        self.version = version
+        # The standardized rows built along with the matrix are memory-mapped
+        # (and so shared by every process), otherwise they're computed here
+        self.standardized = matrix.standardized
+        if self.standardized is None:
+            self.standardized = standardize_rows(matrix.values)
+        self.sample_counts = np.count_nonzero(~np.isnan(matrix.values), axis=1)
+
+    def correlations(self, query_genes: list[str]) -> np.ndarray:
+        query_genes = tuple(sorted(set(query_genes)))
+        return coexpression_correlations.get_or_compute(
+            (self.version, query_genes),
+            lambda: self._compute_correlations(list(query_genes)),
+        )
+
+    def _compute_correlations(self, query_genes: list[str]) -> np.ndarray:
+        query_rows = self.standardized[self.matrix.gene_index(query_genes)]
+        # For a gene set, the query is the (re-standardized) mean profile
+        profile = query_rows.mean(axis=0)
+        profile_norm = np.linalg.norm(profile)
+        if profile_norm == 0:
+            return np.zeros(len(self.matrix.genes), dtype=np.float32)
+        return self.standardized @ (profile / profile_norm)
+
+    def top_neighbors(
+        self,
+        query_genes: list[str],
+        k: int = 25,
+        exclude_query: bool = True,
+        absolute: bool = False,
+        min_samples: int = MIN_SAMPLES,
+    ) -> pd.DataFrame:
+        # Find the k genes most correlated with the query (by absolute value
+        # if absolute, to include anti-correlated genes), among the genes
+        # with a correlation measured in at least min_samples samples (and
+        # other than the query genes)
+        correlations = self.correlations(query_genes)
+        score = np.abs(correlations) if absolute else correlations
+        candidates = np.isfinite(score) & (self.sample_counts >= min_samples)
+        if exclude_query:
+            candidates[self.matrix.gene_index(list(query_genes))] = False
+        candidates = np.flatnonzero(candidates)
+        k = min(k, len(candidates))
+        if k == 0:
+            top = candidates[:0]
+        else:
+            top = candidates[np.argpartition(-score[candidates], k - 1)[:k]]
+            top = top[np.argsort(-score[top], kind="stable")]
+        return pd.DataFrame(
+            {
+                "Gene": self.matrix.genes[top],
+                "correlation": correlations[top],
+                "n_samples": self.sample_counts[top],
+            }
+        )
+
+
+# One engine per process, rebuilt when the data version changes. The engine
+# is built outside of the lock, so sessions using an engine already built
+# aren't held up by the build of another.
+_engines: dict[str, CoexpressionEngine] = {}
+_engines_lock = threading.Lock()
+_engine_builds = SingleFlight()
+
+
+def get_coexpression_engine(con: ibis.BaseBackend) -> CoexpressionEngine:
+    version = data_version(con)
+    with _engines_lock:
+        engine = _engines.get(version)
+    if engine is not None:
+        return engine
+    return _engine_builds.run(version, lambda: _build_engine(con, version))
+
+
+def _build_engine(con: ibis.BaseBackend, version: str) -> CoexpressionEngine:
+    with _engines_lock:
+        engine = _engines.get(version)
+    if engine is not None:
+        return engine
+    # Use the memory-mapped matrix when one has been built, otherwise pivot
+    # the compendia table
+    matrix = get_compendia_matrix(con)
+    if matrix is None:
+        matrix = pivot_compendia(get_catalog(con).table(COMPENDIA_TABLE))
+    engine = CoexpressionEngine(matrix, version=version)
+    with _engines_lock:
+        for stale in [key for key in _engines if key != version]:
+            del _engines[stale]
+        _engines[version] = engine
+    return engine
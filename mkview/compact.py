@@ -0,0 +1,91 @@
+"""
+Module for converting query results to compact types (dictionary encoded
+strings, float32 and int32) where no information is lost
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+
+# External Imports
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Local Imports
+
+# Only dictionary encode string columns where the number of distinct values
+# is at most this fraction of the number of rows
+MAX_DICTIONARY_RATIO = 0.5
+
+# Largest integer float32 can represent exactly
+_FLOAT32_MAX_EXACT_INT = 2**24
+_FLOAT32_INFO = np.finfo(np.float32)
+
+
+def compact_table(
+    table: pa.Table,
+    max_dictionary_ratio: float = MAX_DICTIONARY_RATIO,
+    narrow_floats: bool = True,
+) -> pa.Table:
+    # narrow_floats=False keeps doubles as they are, for tables which are
+    # filtered again later (where float32 rounding could move a value across
+    # a cutoff)
+    columns = [
+        compact_column(column, max_dictionary_ratio, narrow_floats)
+        for column in table.columns
+    ]
+    return pa.Table.from_arrays(columns, names=table.column_names)
+
+
+def compact_column(
+    column: pa.ChunkedArray,
+    max_dictionary_ratio: float = MAX_DICTIONARY_RATIO,
+    narrow_floats: bool = True,
+) -> pa.ChunkedArray:
+    if len(column) == 0 or column.null_count == len(column):
+        return column
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        n_distinct = pc.count_distinct(column).as_py()
+        if n_distinct <= max_dictionary_ratio * len(column):
+            return column.dictionary_encode()
+        return column
+    if pa.types.is_float64(column.type) and narrow_floats:
+        if _fits_float32(column):
+            return column.cast(pa.float32())
+        return column
+    if pa.types.is_integer(column.type):
+        return _narrowest_integer(column)
+    return column
+
+
+def _fits_float32(column: pa.ChunkedArray) -> bool:
+    # float32 is used as long as no values overflow, non-zero values don't
+    # underflow (as very small p-values would), and integral values (such as
+    # genome positions) are still exact
+    finite = pc.filter(column, pc.is_finite(column))
+    if len(finite) == 0:
+        return True
+    magnitude = pc.abs(finite)
+    if pc.max(magnitude).as_py() > _FLOAT32_INFO.max:
+        return False
+    nonzero = pc.filter(magnitude, pc.greater(magnitude, 0))
+    if len(nonzero) > 0 and pc.min(nonzero).as_py() < _FLOAT32_INFO.tiny:
+        return False
+    if pc.all(pc.equal(pc.floor(finite), finite)).as_py():
+        return pc.max(magnitude).as_py() <= _FLOAT32_MAX_EXACT_INT
+    return True
+
+
+def _narrowest_integer(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    # Integers are narrowed no further than int32, as arithmetic on the
+    # results in pandas (differences, products, cumulative counts) keeps
+    # their type and would silently wrap in int8 or int16
+    if column.type.bit_width <= 32:
+        return column
+    min_max = pc.min_max(column)
+    low, high = min_max["min"].as_py(), min_max["max"].as_py()
+    info = np.iinfo(np.int32)
+    if info.min <= low and high <= info.max:
+        return column.cast(pa.int32())
+    return column
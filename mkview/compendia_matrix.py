@@ -0,0 +1,268 @@
+"""
+Module for the dense gene x sample matrix of the gene expression compendia
+
+The long gene_expression_compendia_unpivoted table is pivoted by an offline
+build step into a float32 .npy file (along with the gene and sample index),
+which is memory-mapped by the app. Every worker process then shares the
+same pages of the file, and looking up a gene is a contiguous row read. The
+rows standardized for the co-expression search (mkview.coexpression) are
+written alongside, so they are mapped in the same way rather than computed
+by every process.
+
+Build with `python -m mkview.compendia_matrix --output <directory>`, the
+sync (mkview.sync) also rebuilds the matrix inside the replica whenever the
+compendia change.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import argparse
+import dataclasses
+import json
+import os
+import pathlib
+import threading
+
+# External Imports
+import ibis
+import numpy as np
+import pandas as pd
+
+# Local Imports
+from .connection_pool import pooled_to_pyarrow
+from .database import attached_replica, table_checksum
+
+COMPENDIA_TABLE = "gene_expression_compendia_unpivoted"
+# Environment variable with the matrix directory (when not using a replica)
+COMPENDIA_MATRIX_ENV_VAR = "MKVIEW_COMPENDIA_MATRIX"
+# Directory inside the replica holding the matrix
+REPLICA_MATRIX_DIR = "compendia_matrix"
+_POINTER_NAME = "current.json"
+# Files of each version of the matrix, as named in the pointer
+_FILE_KEYS = ("values", "standardized", "genes", "samples")
+
+
+def standardize_rows(values: np.ndarray) -> np.ndarray:
+    # Center and scale every row so the correlation between two rows is the
+    # dot product of their standardized versions (missing values are
+    # replaced by the mean of the row, so contribute nothing, and constant
+    # rows are all zero)
+    mean = np.nanmean(values, axis=1, keepdims=True)
+    centered = np.nan_to_num(values - mean, nan=0.0)
+    norm = np.linalg.norm(centered, axis=1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return (centered / norm).astype(np.float32)
+
+
+@dataclasses.dataclass
+class CompendiaMatrix:
+    # Dense gene x sample matrix of log2 fold changes (NaN where missing)
+    genes: np.ndarray
+    samples: np.ndarray
+    values: np.ndarray
+    checksum: str | None = None
+    # Rows of values standardized by standardize_rows, when they were built
+    # along with the matrix
+    standardized: np.ndarray | None = None
+
+    def __post_init__(self):
+        self._gene_lookup = pd.Index(self.genes)
+
+    def gene_index(self, genes: list[str]) -> np.ndarray:
+        lookup = self._gene_lookup.get_indexer(genes)
+        if (lookup < 0).any():
+            missing = [gene for gene, i in zip(genes, lookup) if i < 0]
+            raise KeyError(f"Genes not in the compendia: {missing}")
+        return lookup
+
+    def lookup(
+        self,
+        genes: list[str],
+        pos_bound: float = -np.inf,
+        neg_bound: float = np.inf,
+    ) -> pd.DataFrame:
+        # Find the samples where each of the genes has a fold change at or
+        # above the positive bound, or at or below the negative bound, in the
+        # same long format as the compendia table
+        lookup = self._gene_lookup.get_indexer(genes)
+        genes = [gene for gene, i in zip(genes, lookup) if i >= 0]
+        rows = np.asarray(self.values[lookup[lookup >= 0]])
+        with np.errstate(invalid="ignore"):
+            gene_idx, sample_idx = np.nonzero((rows >= pos_bound) | (rows <= neg_bound))
+        return pd.DataFrame(
+            {
+                "Gene": np.asarray(genes, dtype=object)[gene_idx],
+                "sample": self.samples[sample_idx],
+                "fold_change_log2_tpm": rows[gene_idx, sample_idx],
+            }
+        )
+
+
+def pivot_compendia(
+    expression_table: ibis.Table,
+    gene_col: str = "Gene",
+    sample_col: str = "sample",
+    foldchange_col: str = "fold_change_log2_tpm",
+) -> CompendiaMatrix:
+    # Pivot the long compendia table into a dense float32 matrix with one
+    # row per gene and one column per sample. Rows missing any of the values
+    # are dropped, as factorize codes a missing gene or sample as -1, which
+    # would index the last row or column.
+    long_df = pooled_to_pyarrow(
+        expression_table.select(gene_col, sample_col, foldchange_col).drop_null()
+    ).to_pandas()
+    gene_codes, genes = pd.factorize(long_df[gene_col], sort=True)
+    sample_codes, samples = pd.factorize(long_df[sample_col], sort=True)
+    values = np.full((len(genes), len(samples)), np.nan, dtype=np.float32)
+    values[gene_codes, sample_codes] = long_df[foldchange_col].to_numpy(
+        dtype=np.float32
+    )
+    return CompendiaMatrix(
+        genes=np.asarray(genes, dtype=object),
+        samples=np.asarray(samples, dtype=object),
+        values=values,
+    )
+
+
+def write_compendia_matrix(
+    matrix: CompendiaMatrix, output: str | pathlib.Path, checksum: str
+):
+    # Files are versioned by the checksum of the compendia table, and the
+    # pointer to the current version is swapped in with an atomic rename
+    output = pathlib.Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    files = {
+        "values": f"values-{checksum}.npy",
+        "standardized": f"standardized-{checksum}.npy",
+        "genes": f"genes-{checksum}.json",
+        "samples": f"samples-{checksum}.json",
+    }
+    np.save(output / files["values"], matrix.values)
+    standardized = matrix.standardized
+    if standardized is None:
+        standardized = standardize_rows(matrix.values)
+    np.save(output / files["standardized"], standardized)
+    with open(output / files["genes"], "w") as f:
+        json.dump(list(matrix.genes), f)
+    with open(output / files["samples"], "w") as f:
+        json.dump(list(matrix.samples), f)
+    old_pointer = _read_pointer(output)
+    pointer = {"checksum": checksum, "shape": list(matrix.values.shape), **files}
+    tmp_path = output / (_POINTER_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(pointer, f)
+    os.replace(tmp_path, output / _POINTER_NAME)
+    # Keep the previous version, processes may still have it mapped
+    keep = {_POINTER_NAME, *files.values()}
+    if old_pointer is not None:
+        keep.update(old_pointer[name] for name in _FILE_KEYS if name in old_pointer)
+    for path in output.glob("*-*.*"):
+        if path.name not in keep:
+            path.unlink()
+
+
+def _read_pointer(directory: pathlib.Path) -> dict | None:
+    pointer_path = directory / _POINTER_NAME
+    if not pointer_path.exists():
+        return None
+    with open(pointer_path) as f:
+        return json.load(f)
+
+
+# Memory-mapped matrices, keyed by directory and checksum
+_loaded_matrices: dict[tuple[str, str], CompendiaMatrix] = {}
+_loaded_lock = threading.Lock()
+
+
+def load_compendia_matrix(directory: str | pathlib.Path) -> CompendiaMatrix | None:
+    directory = pathlib.Path(directory)
+    pointer = _read_pointer(directory)
+    if pointer is None:
+        return None
+    key = (directory.resolve().as_posix(), pointer["checksum"])
+    with _loaded_lock:
+        if key not in _loaded_matrices:
+            # Drop older versions from the same directory
+            for old_key in [k for k in _loaded_matrices if k[0] == key[0]]:
+                del _loaded_matrices[old_key]
+            with open(directory / pointer["genes"]) as f:
+                genes = np.asarray(json.load(f), dtype=object)
+            with open(directory / pointer["samples"]) as f:
+                samples = np.asarray(json.load(f), dtype=object)
+            # Matrices built before the standardized rows were written are
+            # loaded without them
+            standardized = None
+            if "standardized" in pointer:
+                standardized = np.load(
+                    directory / pointer["standardized"], mmap_mode="r"
+                )
+            _loaded_matrices[key] = CompendiaMatrix(
+                genes=genes,
+                samples=samples,
+                values=np.load(directory / pointer["values"], mmap_mode="r"),
+                checksum=pointer["checksum"],
+                standardized=standardized,
+            )
+        return _loaded_matrices[key]
+
+
+def get_compendia_matrix(con: ibis.BaseBackend) -> CompendiaMatrix | None:
+    # Find the matrix for a connection, for a replica this is the matrix in the
+    # replica (as long as it matches the replica's compendia table),
+    # otherwise it is the one configured through the environment
+    replica = attached_replica(con)
+    if replica is not None:
+        replica_dir, manifest = replica
+        directory = replica_dir / REPLICA_MATRIX_DIR
+        matrix = load_compendia_matrix(directory)
+        entry = manifest["tables"].get(COMPENDIA_TABLE)
+        if matrix is None or entry is None or matrix.checksum != entry["checksum"]:
+            return None
+        return matrix
+    if os.environ.get(COMPENDIA_MATRIX_ENV_VAR):
+        return load_compendia_matrix(os.environ[COMPENDIA_MATRIX_ENV_VAR])
+    return None
+
+
+def build_compendia_matrix(
+    con: ibis.BaseBackend, output: str | pathlib.Path, checksum: str | None = None
+) -> bool:
+    # Build the matrix from a database, skipping the build when the matrix
+    # is already up to date, returns whether it was (re)built
+    if checksum is None:
+        _, checksum = table_checksum(con, COMPENDIA_TABLE)
+    pointer = _read_pointer(pathlib.Path(output))
+    if (
+        pointer is not None
+        and pointer["checksum"] == checksum
+        and "standardized" in pointer
+    ):
+        return False
+    write_compendia_matrix(pivot_compendia(con.table(COMPENDIA_TABLE)), output, checksum)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the memory-mapped gene x sample compendia matrix"
+    )
+    parser.add_argument(
+        "--database",
+        default="md:mkviewer",
+        help="Database to build the matrix from (a MotherDuck database uses the "
+        "motherduck_token environment variable for authentication)",
+    )
+    parser.add_argument(
+        "--output", required=True, help="Directory to write the matrix to"
+    )
+    args = parser.parse_args()
+    con = ibis.duckdb.connect(args.database)
+    if build_compendia_matrix(con, args.output):
+        print(f"Wrote compendia matrix to {args.output}")
+    else:
+        print("Compendia matrix is already up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Module for the pool of cursors queries are run on, so sessions (which each
+run in their own thread) can query the database in parallel
+
+A single duckdb connection can't run queries from several threads at once,
+so every query checks out a cursor (a connection to the same database, which
+sees the same tables and views) from the pool of its connection and returns
+it when done. Cursors idle for a while are health checked before they are
+handed out, and when a query fails because the connection was lost the
+connection is re-established (re-attaching the replica) and the query is
+retried once.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import contextlib
+import logging
+import os
+import threading
+import time
+
+# External Imports
+import duckdb
+import ibis
+import pyarrow as pa
+
+# Local Imports
+from .database import attached_replica, attach_replica, open_cursor, root_lock
+
+logger = logging.getLogger(__name__)
+
+# Environment variable with the number of cursors per connection (the most
+# queries which run at once, further queries wait for a free cursor)
+POOL_SIZE_ENV_VAR = "MKVIEW_POOL_SIZE"
+DEFAULT_POOL_SIZE = 8
+# Errors meaning the connection (rather than the query) failed
+CONNECTION_ERRORS = (
+    duckdb.ConnectionException,
+    duckdb.FatalException,
+    duckdb.IOException,
+    duckdb.HTTPException,
+)
+
+
+class _PooledCursor:
+    def __init__(self, backend: ibis.BaseBackend, generation: int):
+        self.backend = backend
+        self.generation = generation
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.backend.disconnect()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of cursors on a connection, with health checks and
+    reconnection when the connection fails
+    """
+
+    def __init__(
+        self,
+        con: ibis.BaseBackend,
+        size: int = DEFAULT_POOL_SIZE,
+        health_check_interval: float = 30.0,
+        timeout: float = 120.0,
+    ):
+        self.con = con
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.created = 0
+        self.health_check_failures = 0
+        self.reconnects = 0
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list[_PooledCursor] = []
+        self._lock = threading.Lock()
+        # Bumped on every reconnect, so cursors on the old connection are
+        # closed rather than reused
+        self._generation = 0
+
+    @contextlib.contextmanager
+    def cursor(self):
+        # Check out a cursor for the duration of the block (waiting for one to
+        # be free if all are in use)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(
+                f"No database cursor was free after {self.timeout:.0f}s "
+                f"(pool size {self.size})"
+            )
+        try:
+            pooled = self._checkout()
+            failed = False
+            try:
+                yield pooled.backend
+            except CONNECTION_ERRORS:
+                failed = True
+                pooled.close()
+                self.recover()
+                raise
+            finally:
+                # Cursors are still usable after other errors in a query
+                if not failed:
+                    self._checkin(pooled)
+        finally:
+            self._slots.release()
+
+    def to_pyarrow(self, expr: ibis.Table) -> pa.Table:
+        # Run a query on a pooled cursor, retrying once on a new connection
+        # if the connection failed
+        try:
+            with self.cursor() as backend:
+                return backend.to_pyarrow(expr)
+        except CONNECTION_ERRORS:
+            logger.warning("Database connection failed, retrying the query")
+            with self.cursor() as backend:
+                return backend.to_pyarrow(expr)
+
+    def _checkout(self) -> _PooledCursor:
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+                generation = self._generation
+            if pooled is None:
+                self.created += 1
+                return _PooledCursor(open_cursor(self.con), generation)
+            if pooled.generation != generation:
+                pooled.close()
+                continue
+            if time.monotonic() - pooled.last_used < self.health_check_interval:
+                return pooled
+            if self._healthy(pooled.backend):
+                return pooled
+            self.health_check_failures += 1
+            pooled.close()
+
+    def _checkin(self, pooled: _PooledCursor):
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            if pooled.generation == self._generation:
+                self._idle.append(pooled)
+                return
+        pooled.close()
+
+    @staticmethod
+    def _healthy(backend: ibis.BaseBackend) -> bool:
+        try:
+            backend.con.execute("SELECT 1").fetchall()
+            return True
+        except Exception:
+            return False
+
+    def recover(self):
+        # Called after a connection error, reconnects when a new cursor on the
+        # connection also fails (a failed cursor alone is just dropped)
+        with root_lock:
+            try:
+                probe = open_cursor(self.con)
+                healthy = self._healthy(probe)
+                probe.disconnect()
+            except Exception:
+                healthy = False
+            if healthy:
+                return
+            logger.warning("Database connection lost, reconnecting")
+            replica = attached_replica(self.con)
+            self.con.reconnect()
+            # A replica is read through views in an in-memory database, which
+            # have to be created again on the new connection
+            if replica is not None:
+                attach_replica(self.con, replica[0])
+            with self._lock:
+                self._generation += 1
+                idle, self._idle = self._idle, []
+            self.reconnects += 1
+        for pooled in idle:
+            pooled.close()
+
+    def close(self):
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "created": self.created,
+            "health_check_failures": self.health_check_failures,
+            "reconnects": self.reconnects,
+        }
+
+
+# Pool for each connection (keyed by id)
+_pools: dict[int, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(con: ibis.BaseBackend) -> ConnectionPool:
+    with _pools_lock:
+        pool = _pools.get(id(con))
+        if pool is None or pool.con is not con:
+            pool = ConnectionPool(
+                con,
+                size=int(os.environ.get(POOL_SIZE_ENV_VAR, DEFAULT_POOL_SIZE)),
+            )
+            _pools[id(con)] = pool
+        return pool
+
+
+def pooled_to_pyarrow(
+    expr: ibis.Table, con: ibis.BaseBackend | None = None
+) -> pa.Table:
+    # Run a query through the pool of the connection it was built from
+    if con is None:
+        con = ibis.get_backend(expr)
+    return get_pool(con).to_pyarrow(expr)
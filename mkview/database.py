@@ -0,0 +1,154 @@
+"""
+Module for connecting to the mkviewer database, either on MotherDuck or
+through a local replica created by mkview.sync
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pathlib
+import threading
+
+# External Imports
+import ibis
+
+# Local Imports
+
+# Environment variable with the path to the local replica directory
+REPLICA_ENV_VAR = "MKVIEW_REPLICA"
+MANIFEST_NAME = "manifest.json"
+
+# Replica and manifest attached to each connection (keyed by id)
+_attached_replicas: dict[int, tuple[pathlib.Path, dict]] = {}
+# Held while using a connection directly (rather than through a cursor, see
+# mkview.connection_pool), which isn't safe from several threads at once
+root_lock = threading.RLock()
+
+
+def replica_path() -> pathlib.Path | None:
+    # Find the local replica, if one has been configured and synced
+    replica = os.environ.get(REPLICA_ENV_VAR)
+    if not replica:
+        return None
+    replica = pathlib.Path(replica)
+    if not (replica / MANIFEST_NAME).exists():
+        return None
+    return replica
+
+
+def read_manifest(replica: pathlib.Path) -> dict:
+    manifest_path = replica / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {"version": None, "tables": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def manifest_version(tables: dict[str, dict]) -> str:
+    # The version of the data is a hash of all the table checksums, so it
+    # only changes when the contents of a table change
+    h = hashlib.sha256()
+    for name in sorted(tables):
+        h.update(f"{name}:{tables[name]['checksum']};".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def connect(
+    md_token: str | None = None, replica: str | pathlib.Path | None = None
+) -> ibis.BaseBackend:
+    # Prefer the local replica when one is available, otherwise connect
+    # to MotherDuck
+    if replica is None:
+        replica = replica_path()
+    if replica is not None:
+        con = ibis.duckdb.connect()
+        attach_replica(con, pathlib.Path(replica))
+        return con
+    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+
+
+def attach_replica(con: ibis.BaseBackend, replica: pathlib.Path) -> dict:
+    # Create (or replace) a view for every table in the replica manifest.
+    # The views are replaced in a single transaction, so queries (on this
+    # connection's cursors) see either every table of the old manifest or
+    # every table of the new one, never a mix of the two.
+    manifest = read_manifest(replica)
+    with root_lock:
+        con.raw_sql("BEGIN TRANSACTION")
+        try:
+            for name, entry in manifest["tables"].items():
+                parquet_path = (replica / entry["file"]).resolve().as_posix()
+                quoted_name = name.replace('"', '""')
+                quoted_path = parquet_path.replace("'", "''")
+                con.raw_sql(
+                    f'CREATE OR REPLACE VIEW "{quoted_name}" AS '
+                    f"SELECT * FROM read_parquet('{quoted_path}')"
+                )
+        except BaseException:
+            con.raw_sql("ROLLBACK")
+            raise
+        con.raw_sql("COMMIT")
+        _attached_replicas[id(con)] = (replica, manifest)
+    return manifest
+
+
+def refresh_replica(con: ibis.BaseBackend) -> bool:
+    # Re-attach the replica if it has been synced since the connection was
+    # made, returns whether the views were updated
+    if id(con) not in _attached_replicas:
+        return False
+    replica, manifest = _attached_replicas[id(con)]
+    if read_manifest(replica)["version"] == manifest["version"]:
+        return False
+    attach_replica(con, replica)
+    return True
+
+
+def data_version(con: ibis.BaseBackend) -> str:
+    # Version of the data behind a connection, used to key caches, for
+    # MotherDuck connections (with no manifest) this is constant
+    if id(con) not in _attached_replicas:
+        return "motherduck"
+    return _attached_replicas[id(con)][1]["version"]
+
+
+def attached_replica(con: ibis.BaseBackend) -> tuple[pathlib.Path, dict] | None:
+    # Replica directory and manifest a connection is reading from, if any
+    return _attached_replicas.get(id(con))
+
+
+def open_cursor(con: ibis.BaseBackend) -> ibis.BaseBackend:
+    # Backend on a new cursor of the connection's database, each thread
+    # needs its own cursor to run queries (cursors see the same tables and
+    # views as the connection)
+    with root_lock:
+        return ibis.duckdb.from_connection(con.con.cursor())
+
+
+def table_checksum(con: ibis.BaseBackend, table_name: str) -> tuple[int, str]:
+    # Compute the row count, and an order-insensitive checksum of the
+    # contents and schema of a table
+    quoted_name = table_name.replace('"', '""')
+    n_rows, content_hash = con.raw_sql(
+        f'SELECT count(*), CAST(coalesce(sum(hash(t)), 0) AS VARCHAR) FROM "{quoted_name}" AS t'
+    ).fetchone()
+    schema = con.table(table_name).schema()
+    h = hashlib.sha256()
+    h.update(str(list(schema.items())).encode("utf-8"))
+    h.update(content_hash.encode("utf-8"))
+    return n_rows, h.hexdigest()[:16]
+
+
+def content_version(con: ibis.BaseBackend, table_names: list[str]) -> str:
+    # Version of the contents of some tables (those missing from the database
+    # are skipped), for keying data built from a database without a manifest
+    h = hashlib.sha256()
+    existing = set(con.list_tables())
+    for name in sorted(table_names):
+        if name in existing:
+            n_rows, checksum = table_checksum(con, name)
+            h.update(f"{name}:{n_rows}:{checksum};".encode("utf-8"))
+    return h.hexdigest()[:16]
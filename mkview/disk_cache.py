@@ -0,0 +1,175 @@
+"""
+Module for the on-disk tier of the query result cache, so results survive
+restarts of the app
+
+Results are stored as Parquet files named by a hash of their key (which
+includes the data version). Files are written under a temporary name and
+renamed into place, so several processes can share the cache directory
+without readers seeing partial files. When the directory grows past its
+size limit the least recently used files are removed.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import time
+from typing import Hashable
+
+# External Imports
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Local Imports
+
+logger = logging.getLogger(__name__)
+
+# Environment variables with the cache directory, its size limit (in
+# megabytes, 0 disables the cache) and the maximum age of entries (in hours,
+# MotherDuck connections don't have a data version, so entries have to
+# expire to pick up changes)
+DISK_CACHE_ENV_VAR = "MKVIEW_DISK_CACHE"
+DISK_CACHE_SIZE_ENV_VAR = "MKVIEW_DISK_CACHE_MB"
+DISK_CACHE_AGE_ENV_VAR = "MKVIEW_DISK_CACHE_MAX_AGE_HOURS"
+DEFAULT_DISK_CACHE = "./data/cache"
+DEFAULT_DISK_CACHE_MB = 1024
+DEFAULT_DISK_CACHE_MAX_AGE_HOURS = 24
+
+
+class DiskCache:
+    """
+    Size-bounded cache of Arrow tables stored as Parquet files, safe to share
+    between processes
+    """
+
+    def __init__(
+        self,
+        directory: str | pathlib.Path,
+        max_bytes: int,
+        max_age: float = DEFAULT_DISK_CACHE_MAX_AGE_HOURS * 3600,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls) -> DiskCache:
+        return cls(
+            os.environ.get(DISK_CACHE_ENV_VAR, DEFAULT_DISK_CACHE),
+            max_bytes=int(
+                float(os.environ.get(DISK_CACHE_SIZE_ENV_VAR, DEFAULT_DISK_CACHE_MB))
+                * 2**20
+            ),
+            max_age=float(
+                os.environ.get(DISK_CACHE_AGE_ENV_VAR, DEFAULT_DISK_CACHE_MAX_AGE_HOURS)
+            )
+            * 3600,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, key: Hashable) -> pathlib.Path:
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}.parquet"
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Whether an unexpired entry exists (without reading it)
+        if not self.enabled:
+            return False
+        try:
+            return time.time() - self.path(key).stat().st_mtime <= self.max_age
+        except FileNotFoundError:
+            return False
+
+    def get(self, key: Hashable) -> pa.Table | None:
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                raise FileNotFoundError(path)
+            table = pq.read_table(path, memory_map=True)
+            # Mark the entry as recently used (the modification time is used
+            # rather than the access time, which is often disabled)
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except Exception:
+            # A failing disk cache shouldn't break the page
+            logger.exception(f"Failed to read cached result {path}")
+            self._count("misses")
+            return None
+        self._count("hits")
+        return table
+
+    def put(self, key: Hashable, table: pa.Table):
+        if not self.enabled:
+            return
+        path = self.path(key)
+        tmp_path = path.with_name(
+            f".{path.name}.tmp-{os.getpid()}-{threading.get_ident()}"
+        )
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, path)
+            self._enforce_size()
+        except Exception:
+            logger.exception(f"Failed to write cached result {path}")
+            tmp_path.unlink(missing_ok=True)
+
+    def _enforce_size(self):
+        # Remove the least recently used files until the cache fits, other
+        # processes may be removing files at the same time
+        entries = []
+        for path in self.directory.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            self._count("evictions")
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        for path in self.directory.glob("*.parquet"):
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        n_bytes = 0
+        n_entries = 0
+        for path in self.directory.glob("*.parquet"):
+            try:
+                n_bytes += path.stat().st_size
+                n_entries += 1
+            except FileNotFoundError:
+                continue
+        return {
+            "name": "disk_results",
+            "entries": n_entries,
+            "bytes": n_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
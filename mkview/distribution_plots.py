@@ -0,0 +1,179 @@
+"""
+Module for plotting the distribution of a gene's fold changes across the
+samples of the gene expression compendia
+
+The fold changes are binned (and counted, and accumulated into an ECDF)
+inside DuckDB, so only one row per bin and group is read into Python and
+sent to the browser, however many samples the gene has.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+
+# External Imports
+import altair as alt
+import ibis
+import pandas as pd
+
+# Local Imports
+from .catalog import Catalog, get_catalog
+from .result_cache import execute_cached
+
+# Columns of the compendia metadata the samples can be grouped by, along
+# with their titles
+DISTRIBUTION_GROUPS = {
+    "project": "Project",
+    "condition": "Condition",
+}
+BIN_WIDTHS = (0.1, 0.25, 0.5, 1.0)
+# Groups beyond the largest few are combined into one
+MAX_GROUPS = 10
+OTHER_GROUP = "Other"
+ALL_SAMPLES = "All samples"
+
+
+def fold_change_distribution_query(
+    catalog: Catalog,
+    gene: str,
+    group_by: str | None = None,
+    bin_width: float = 0.25,
+    max_groups: int = MAX_GROUPS,
+) -> ibis.Table:
+    # One row per group and bin, with the number of samples in the bin and
+    # the fraction of the group's samples at or below the end of the bin
+    expression_table = catalog.table("gene_expression_compendia_unpivoted")
+    samples = expression_table.filter(
+        (expression_table["Gene"] == gene)
+        & expression_table["fold_change_log2_tpm"].notnull()
+    )
+    if group_by is None:
+        samples = samples.mutate(group=ibis.literal(ALL_SAMPLES))
+    else:
+        if group_by not in DISTRIBUTION_GROUPS:
+            raise ValueError(f"Invalid distribution grouping: {group_by}")
+        meta_table = catalog.table("gene_expression_metadata")
+        samples = samples.left_join(
+            meta_table, meta_table["sample_id"] == samples["sample"]
+        ).mutate(group=ibis._[group_by].fill_null("Unknown"))
+        # Keep the largest groups (ties broken by name), combining the rest
+        samples = samples.mutate(
+            group_size=ibis._.count().over(group_by="group")
+        ).mutate(
+            group_rank=ibis.dense_rank().over(
+                order_by=[ibis.desc("group_size"), "group"]
+            )
+        )
+        samples = samples.mutate(
+            group=ibis.ifelse(
+                samples["group_rank"] < max_groups,
+                samples["group"],
+                ibis.literal(OTHER_GROUP),
+            )
+        )
+    binned = (
+        samples.mutate(
+            bin_start=(samples["fold_change_log2_tpm"] / bin_width).floor()
+            * bin_width
+        )
+        .group_by(["group", "bin_start"])
+        .aggregate(count=ibis._.count())
+    )
+    return binned.mutate(
+        bin_end=binned["bin_start"] + bin_width,
+        ecdf=binned["count"].sum().over(
+            ibis.cumulative_window(group_by="group", order_by="bin_start")
+        )
+        / binned["count"].sum().over(group_by="group"),
+    ).order_by(["group", "bin_start"])
+
+
+def get_fold_change_distribution(
+    con: ibis.BaseBackend,
+    gene: str,
+    group_by: str | None = None,
+    bin_width: float = 0.25,
+) -> pd.DataFrame:
+    return execute_cached(
+        con,
+        fold_change_distribution_query(get_catalog(con), gene, group_by, bin_width),
+    )
+
+
+def fold_change_distribution_plot(
+    bins: pd.DataFrame,
+    kind: str = "histogram",
+    neg_bound: float | None = None,
+    pos_bound: float | None = None,
+    width: int = 700,
+    height: int = 350,
+) -> alt.LayerChart:
+    # bins is a result of fold_change_distribution_query, drawn as a stacked
+    # histogram or as an ECDF per group, with the bounds as dashed rules
+    bins = pd.DataFrame(bins)
+    bins["group"] = bins["group"].astype(str)
+    x_title = "Fold Change (log2(tpm))"
+    color = alt.Color("group:N", title="Group")
+    if kind == "histogram":
+        distribution = (
+            alt.Chart(bins)
+            .mark_bar()
+            .encode(
+                x=alt.X("bin_start:Q", bin="binned", title=x_title),
+                x2="bin_end:Q",
+                y=alt.Y("count:Q", stack=True, title="Samples"),
+                color=color,
+                tooltip=[
+                    alt.Tooltip("group:N", title="Group"),
+                    alt.Tooltip("bin_start:Q", title="From", format=".2f"),
+                    alt.Tooltip("bin_end:Q", title="To", format=".2f"),
+                    alt.Tooltip("count:Q", title="Samples"),
+                ],
+            )
+        )
+    elif kind == "ecdf":
+        distribution = (
+            alt.Chart(bins)
+            .mark_line(interpolate="step-after")
+            .encode(
+                x=alt.X("bin_end:Q", title=x_title),
+                y=alt.Y(
+                    "ecdf:Q",
+                    title="Fraction of Samples at or Below",
+                    scale=alt.Scale(domain=[0, 1]),
+                ),
+                color=color,
+                tooltip=[
+                    alt.Tooltip("group:N", title="Group"),
+                    alt.Tooltip("bin_end:Q", title="Fold Change", format=".2f"),
+                    alt.Tooltip("ecdf:Q", title="Fraction", format=".2f"),
+                ],
+            )
+        )
+    else:
+        raise ValueError(f"Invalid distribution plot kind: {kind}")
+    bounds = pd.DataFrame(
+        {
+            "bound": [b for b in (neg_bound, pos_bound) if b is not None],
+            "label": [
+                label
+                for label, b in (
+                    ("Negative bound", neg_bound),
+                    ("Positive bound", pos_bound),
+                )
+                if b is not None
+            ],
+        }
+    )
+    rules = (
+        alt.Chart(bounds)
+        .mark_rule(color="black", strokeDash=[6, 4])
+        .encode(
+            x="bound:Q",
+            tooltip=[
+                alt.Tooltip("label:N", title="Bound"),
+                alt.Tooltip("bound:Q", title="Fold Change", format=".2f"),
+            ],
+        )
+    )
+    return (distribution + rules).properties(width=width, height=height)
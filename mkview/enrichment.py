@@ -0,0 +1,271 @@
+"""
+Module for testing a list of genes for enrichment in the targets of each
+transcription factor and STPK
+
+The target sets of every regulator (TF regulons from the TF overexpression
+data, and the differentially expressed genes and differentially
+phosphorylated proteins of each STPK mutant) are found once for a choice of
+cutoffs and stored as a boolean membership matrix. A list of genes is then
+tested against all of the regulators at once, with hypergeometric tests
+computed in NumPy from a table of log-factorials, and the p-values are
+adjusted with the Benjamini-Hochberg procedure.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import dataclasses
+from typing import Iterable
+
+# External Imports
+import ibis
+import numpy as np
+import pandas as pd
+
+# Local Imports
+from .catalog import Catalog, get_catalog
+from .connection_pool import pooled_to_pyarrow
+from .database import data_version
+from .result_cache import ResultCache
+
+# Sources of target sets, as the table, regulator column, mutant column (if
+# any), target gene column, fold change column and p-value column
+TARGET_SET_SOURCES = {
+    "TF regulon": ("tfoe", "TF", None, "Gene", "fold_change", "p_value"),
+    "STPK DEG": (
+        "all_kinase_diff_genes",
+        "STPK",
+        "Mutant",
+        "DEG",
+        "Fold-change (log2)",
+        "p-value",
+    ),
+    "STPK phosphosite": (
+        "all_phosphosites",
+        "STPK",
+        "Mutant",
+        "Rv Number",
+        "Fold-change (log2)",
+        "p-value",
+    ),
+}
+
+# Target sets for each data version and choice of cutoffs
+target_sets_cache = ResultCache("target_sets", max_entries=32)
+
+
+def log_factorials(n: int) -> np.ndarray:
+    # log(i!) for i in 0..n
+    table = np.zeros(n + 1)
+    table[1:] = np.cumsum(np.log(np.arange(1, n + 1)))
+    return table
+
+
+def hypergeometric_sf(
+    overlap: np.ndarray,
+    set_sizes: np.ndarray,
+    n_query: int,
+    n_universe: int,
+    log_fact: np.ndarray | None = None,
+) -> np.ndarray:
+    # P(X >= overlap) for X ~ Hypergeometric(n_universe, set_size, n_query),
+    # for every set at once: the probabilities of all possible overlaps are
+    # laid out in a (sets x overlaps) grid and summed over the upper tail
+    if log_fact is None:
+        log_fact = log_factorials(n_universe)
+    overlap = np.asarray(overlap, dtype=np.int64)
+    set_sizes = np.asarray(set_sizes, dtype=np.int64)
+
+    def log_choose(n, k):
+        return log_fact[n] - log_fact[k] - log_fact[n - k]
+
+    i = np.arange(n_query + 1)[np.newaxis, :]
+    sizes = set_sizes[:, np.newaxis]
+    valid = (
+        (i >= overlap[:, np.newaxis])
+        & (i <= sizes)
+        & (n_query - i <= n_universe - sizes)
+    )
+    # Invalid cells are clipped into range and masked out afterwards
+    log_pmf = (
+        log_choose(sizes, np.minimum(i, sizes))
+        + log_choose(
+            n_universe - sizes,
+            np.clip(n_query - i, 0, n_universe - sizes),
+        )
+        - log_choose(n_universe, n_query)
+    )
+    log_pmf = np.where(valid, log_pmf, -np.inf)
+    # Sum in log space (shifted by the largest term) to avoid underflow
+    shift = log_pmf.max(axis=1, keepdims=True)
+    shift = np.where(np.isfinite(shift), shift, 0.0)
+    sf = np.exp(shift[:, 0]) * np.exp(log_pmf - shift).sum(axis=1)
+    return np.clip(sf, 0.0, 1.0)
+
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    # Adjusted p-values (q-values) controlling the false discovery rate
+    p_values = np.asarray(p_values, dtype=float)
+    n = len(p_values)
+    if n == 0:
+        return p_values
+    order = np.argsort(p_values)
+    scaled = p_values[order] * n / np.arange(1, n + 1)
+    # Running minimum from the largest p-value down
+    adjusted = np.minimum.accumulate(scaled[::-1])[::-1]
+    q_values = np.empty(n)
+    q_values[order] = np.clip(adjusted, 0.0, 1.0)
+    return q_values
+
+
+@dataclasses.dataclass
+class TargetSets:
+    """
+    Target sets of every regulator as a boolean matrix, with one row per
+    regulator (described by sets) and one column per gene in the universe
+    """
+
+    genes: np.ndarray
+    sets: pd.DataFrame
+    membership: np.ndarray
+
+    def __post_init__(self):
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.set_sizes = self.membership.sum(axis=1)
+        self.log_fact = log_factorials(len(self.genes))
+
+    @property
+    def nbytes(self) -> int:
+        return self.genes.nbytes + self.membership.nbytes + self.log_fact.nbytes
+
+    def enrichment(
+        self, genes: Iterable[str], sources: Iterable[str] | None = None
+    ) -> pd.DataFrame:
+        # Test the genes against every target set (or those from the given
+        # sources), genes outside of the universe are ignored
+        query = np.array(
+            sorted({self.gene_index[g] for g in genes if g in self.gene_index}),
+            dtype=np.int64,
+        )
+        rows = np.ones(len(self.sets), dtype=bool)
+        if sources is not None:
+            rows = self.sets["source"].isin(list(sources)).to_numpy()
+        membership = self.membership[rows]
+        set_sizes = self.set_sizes[rows]
+        overlap = membership[:, query].sum(axis=1)
+        n_universe = len(self.genes)
+        p_values = hypergeometric_sf(
+            overlap, set_sizes, len(query), n_universe, self.log_fact
+        )
+        expected = set_sizes * len(query) / max(n_universe, 1)
+        result = self.sets[rows].reset_index(drop=True).assign(
+            set_size=set_sizes,
+            overlap=overlap,
+            expected=expected,
+            fold_enrichment=np.divide(
+                overlap,
+                expected,
+                out=np.zeros(len(overlap)),
+                where=expected > 0,
+            ),
+            p_value=p_values,
+            q_value=benjamini_hochberg(p_values),
+        )
+        query_genes = self.genes[query]
+        result["overlap_genes"] = [
+            ", ".join(query_genes[members]) for members in membership[:, query]
+        ]
+        return result.sort_values(
+            ["p_value", "fold_enrichment"], ascending=[True, False]
+        )
+
+
+def _target_query(
+    catalog: Catalog, source: str, pval_cutoff: float, fold_change_threshold: float
+) -> ibis.Table | None:
+    table_name, regulator_col, mutant_col, gene_col, fc_col, pval_col = (
+        TARGET_SET_SOURCES[source]
+    )
+    if table_name not in catalog.tables:
+        return None
+    table = catalog.table(table_name)
+    return (
+        table.filter(
+            (table[pval_col] <= pval_cutoff)
+            & (table[fc_col].abs() >= fold_change_threshold)
+            & table[gene_col].notnull()
+        )
+        .select(
+            source=ibis.literal(source),
+            regulator=table[regulator_col],
+            mutant=table[mutant_col] if mutant_col else ibis.literal(None, "string"),
+            gene=table[gene_col],
+        )
+        .distinct()
+    )
+
+
+def build_target_sets(
+    con: ibis.BaseBackend, pval_cutoff: float, fold_change_threshold: float
+) -> TargetSets:
+    # The targets of every source are read with a single query
+    catalog = get_catalog(con)
+    queries = [
+        query
+        for source in TARGET_SET_SOURCES
+        if (
+            query := _target_query(catalog, source, pval_cutoff, fold_change_threshold)
+        )
+        is not None
+    ]
+    targets = (
+        pooled_to_pyarrow(ibis.union(*queries), con).to_pandas()
+        if queries
+        else pd.DataFrame(columns=["source", "regulator", "mutant", "gene"])
+    )
+    # The universe is every gene in the compendia, along with any target
+    # missing from it
+    genes = np.array(
+        sorted(set(catalog.gene_list) | set(targets["gene"])), dtype=object
+    )
+    set_keys = ["source", "regulator", "mutant"]
+    sets = (
+        targets[set_keys]
+        .drop_duplicates()
+        .sort_values(set_keys, na_position="first")
+        .reset_index(drop=True)
+    )
+    set_codes = (
+        targets[set_keys]
+        .merge(sets.reset_index(), on=set_keys, how="left")["index"]
+        .to_numpy()
+    )
+    gene_codes = np.searchsorted(genes, targets["gene"].to_numpy())
+    membership = np.zeros((len(sets), len(genes)), dtype=bool)
+    membership[set_codes, gene_codes] = True
+    return TargetSets(genes=genes, sets=sets, membership=membership)
+
+
+def get_target_sets(
+    con: ibis.BaseBackend,
+    pval_cutoff: float = 0.05,
+    fold_change_threshold: float = 1.0,
+) -> TargetSets:
+    return target_sets_cache.get_or_compute(
+        (data_version(con), float(pval_cutoff), float(fold_change_threshold)),
+        lambda: build_target_sets(con, pval_cutoff, fold_change_threshold),
+    )
+
+
+def regulator_enrichment(
+    con: ibis.BaseBackend,
+    genes: Iterable[str],
+    pval_cutoff: float = 0.05,
+    fold_change_threshold: float = 1.0,
+    sources: Iterable[str] | None = None,
+) -> pd.DataFrame:
+    # Enrichment of the genes in the targets of every regulator, most
+    # significant first
+    return get_target_sets(con, pval_cutoff, fold_change_threshold).enrichment(
+        genes, sources
+    )
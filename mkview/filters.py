@@ -0,0 +1,242 @@
+"""
+Module for running filtered queries which can be answered from the cached
+results of looser filters
+
+Users often refine a table step by step (lowering the p-value cutoff,
+widening the fold change bounds, or dropping a gene from the selection),
+and every refinement selects a subset of a result already in the cache. The
+filters on a table are described by a FilterSpec, made up of conditions on
+single columns, so a cached result whose filter is implied by the new one
+can be found and filtered in process with pyarrow.compute rather than
+querying the database again.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import dataclasses
+import threading
+from typing import Hashable, Iterable, Union
+
+# External Imports
+import ibis
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Local Imports
+from .compact import compact_table
+from .connection_pool import pooled_to_pyarrow
+from .result_cache import ResultCache, query_key
+
+# Most cached filters remembered for each table, when looking for one which
+# contains a new filter
+MAX_SPECS_PER_TABLE = 64
+
+
+@dataclasses.dataclass(frozen=True)
+class IsIn:
+    """
+    Values of the column are one of the given values
+    """
+
+    column: str
+    values: frozenset
+
+    def __init__(self, column: str, values: Iterable):
+        object.__setattr__(self, "column", column)
+        object.__setattr__(self, "values", frozenset(values))
+
+    def implies(self, other: Condition) -> bool:
+        return isinstance(other, IsIn) and self.values <= other.values
+
+    def to_ibis(self, table: ibis.Table) -> ibis.BooleanValue:
+        return table[self.column].isin(sorted(self.values, key=str))
+
+    def to_arrow(self) -> pc.Expression:
+        return pc.field(self.column).isin(sorted(self.values, key=str))
+
+
+@dataclasses.dataclass(frozen=True)
+class AtMost:
+    """
+    Values of the column are at most the bound
+    """
+
+    column: str
+    value: float
+
+    def implies(self, other: Condition) -> bool:
+        if isinstance(other, AtMost):
+            return self.value <= other.value
+        # x <= value is inside of (x <= low or x >= high) when value <= low
+        return isinstance(other, Outside) and self.value <= other.low
+
+    def to_ibis(self, table: ibis.Table) -> ibis.BooleanValue:
+        return table[self.column] <= self.value
+
+    def to_arrow(self) -> pc.Expression:
+        return pc.field(self.column) <= self.value
+
+
+@dataclasses.dataclass(frozen=True)
+class AtLeast:
+    """
+    Values of the column are at least the bound
+    """
+
+    column: str
+    value: float
+
+    def implies(self, other: Condition) -> bool:
+        if isinstance(other, AtLeast):
+            return self.value >= other.value
+        return isinstance(other, Outside) and self.value >= other.high
+
+    def to_ibis(self, table: ibis.Table) -> ibis.BooleanValue:
+        return table[self.column] >= self.value
+
+    def to_arrow(self) -> pc.Expression:
+        return pc.field(self.column) >= self.value
+
+
+@dataclasses.dataclass(frozen=True)
+class Outside:
+    """
+    Values of the column are at most low or at least high (such as a fold
+    change past either of a negative and positive bound)
+    """
+
+    column: str
+    low: float
+    high: float
+
+    def implies(self, other: Condition) -> bool:
+        return (
+            isinstance(other, Outside)
+            and self.low <= other.low
+            and self.high >= other.high
+        )
+
+    def to_ibis(self, table: ibis.Table) -> ibis.BooleanValue:
+        return (table[self.column] <= self.low) | (table[self.column] >= self.high)
+
+    def to_arrow(self) -> pc.Expression:
+        return (pc.field(self.column) <= self.low) | (
+            pc.field(self.column) >= self.high
+        )
+
+
+Condition = Union[IsIn, AtMost, AtLeast, Outside]
+
+
+@dataclasses.dataclass(frozen=True)
+class FilterSpec:
+    """
+    Conjunction of conditions on the columns of a table, which can be applied
+    to the query or to an Arrow table of (a superset of) its result
+    """
+
+    conditions: tuple[Condition, ...]
+
+    def __init__(self, *conditions: Condition):
+        # Conditions are sorted so the same filter always has the same key
+        object.__setattr__(
+            self, "conditions", tuple(sorted(set(conditions), key=repr))
+        )
+
+    def implies(self, other: FilterSpec) -> bool:
+        # Every row passing this filter passes the other when each of the
+        # other's conditions is implied by one of these (on the same column)
+        return all(
+            any(
+                mine.column == theirs.column and mine.implies(theirs)
+                for mine in self.conditions
+            )
+            for theirs in other.conditions
+        )
+
+    def apply(self, table: ibis.Table) -> ibis.Table:
+        if not self.conditions:
+            return table
+        return table.filter(*[c.to_ibis(table) for c in self.conditions])
+
+    def filter_arrow(self, table: pa.Table) -> pa.Table:
+        if not self.conditions:
+            return table
+        expression = self.conditions[0].to_arrow()
+        for condition in self.conditions[1:]:
+            expression = expression & condition.to_arrow()
+        return table.filter(expression)
+
+
+# Filtered results as Arrow tables (with doubles kept at full precision, so
+# they can be filtered again exactly), keyed by the query of the unfiltered
+# table along with the filter
+filtered_results = ResultCache("filtered_results")
+# Filters with results cached for each unfiltered table, most recent last
+_cached_specs: dict[Hashable, list[FilterSpec]] = {}
+_specs_lock = threading.Lock()
+# Requests answered by filtering a cached result rather than a query
+# (incremented under _specs_lock, as += isn't atomic across threads)
+superset_hits = 0
+
+
+def _find_superset(base_key: Hashable, spec: FilterSpec) -> pa.Table | None:
+    # Smallest cached result whose filter contains the requested one
+    with _specs_lock:
+        candidates = [
+            cached
+            for cached in _cached_specs.get(base_key, [])
+            if cached != spec and spec.implies(cached)
+        ]
+    best = None
+    for cached in candidates:
+        table = filtered_results.get((base_key, cached))
+        if table is not None and (best is None or table.num_rows < best.num_rows):
+            best = table
+    return best
+
+
+def _remember_spec(base_key: Hashable, spec: FilterSpec):
+    with _specs_lock:
+        specs = _cached_specs.setdefault(base_key, [])
+        if spec in specs:
+            specs.remove(spec)
+        specs.append(spec)
+        # Filters whose results have been evicted are forgotten
+        specs[:] = [
+            s for s in specs if s == spec or (base_key, s) in filtered_results
+        ]
+        del specs[:-MAX_SPECS_PER_TABLE]
+
+
+def query_filtered_arrow(
+    con: ibis.BaseBackend, table: ibis.Table, spec: FilterSpec
+) -> pa.Table:
+    base_key = query_key(con, table)
+
+    def compute() -> pa.Table:
+        global superset_hits
+        superset = _find_superset(base_key, spec)
+        if superset is not None:
+            with _specs_lock:
+                superset_hits += 1
+            return spec.filter_arrow(superset)
+        return compact_table(
+            pooled_to_pyarrow(spec.apply(table), con), narrow_floats=False
+        )
+
+    result = filtered_results.get_or_compute((base_key, spec), compute)
+    _remember_spec(base_key, spec)
+    return result
+
+
+def execute_filtered(
+    con: ibis.BaseBackend, table: ibis.Table, spec: FilterSpec
+) -> pd.DataFrame:
+    # Rows of the table passing the filter, as a compact frame like the ones
+    # from execute_cached
+    return compact_table(query_filtered_arrow(con, table, spec)).to_pandas(
+        date_as_object=False
+    )
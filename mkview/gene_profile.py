@@ -0,0 +1,151 @@
+"""
+Module for the gene profile, everything in the database about a single gene
+
+The profile is split into sections (one query per data set), which are run
+in parallel on a thread pool (each on a pooled cursor, see
+mkview.connection_pool). The
+results are yielded as each query finishes, so a page can show every section
+as soon as it is ready, and the profile takes about as long as the slowest
+query rather than the sum of them all.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import concurrent.futures
+import dataclasses
+import time
+from typing import Iterator
+
+# External Imports
+import ibis
+import pandas as pd
+
+# Local Imports
+from .catalog import Catalog, get_catalog
+from .result_cache import execute_cached
+
+# Titles of the profile sections, in the order they are shown
+PROFILE_SECTIONS = {
+    "compendia": "Gene Expression Compendia (Strongest Changes)",
+    "phosphosites": "STPK Differential Phosphorylation",
+    "kinase_degs": "STPK Differential Gene Expression",
+    "tf_regulators": "Transcription Factors Regulating the Gene",
+    "tf_targets": "Genes Regulated by the Transcription Factor",
+    "mycobrowser": "Mycobrowser Annotations",
+}
+
+
+@dataclasses.dataclass
+class SectionResult:
+    section: str
+    title: str
+    frame: pd.DataFrame | None
+    error: Exception | None
+    seconds: float
+
+
+def profile_queries(
+    catalog: Catalog, gene: str, n_extremes: int = 20
+) -> dict[str, ibis.Table]:
+    # Query for each section of the profile, sections whose tables aren't in
+    # the database are left out
+    queries = {}
+    if {"gene_expression_compendia_unpivoted", "gene_expression_metadata"} <= set(
+        catalog.tables
+    ):
+        expression_table = catalog.table("gene_expression_compendia_unpivoted")
+        meta_table = catalog.table("gene_expression_metadata")
+        queries["compendia"] = (
+            expression_table.filter(expression_table["Gene"] == gene)
+            .order_by(expression_table["fold_change_log2_tpm"].abs().desc())
+            .limit(n_extremes)
+            .left_join(
+                meta_table, meta_table["sample_id"] == expression_table["sample"]
+            )
+            .select(
+                "sample",
+                "fold_change_log2_tpm",
+                "condition",
+                "reference_condition",
+                "project",
+                "pubmed_link",
+            )
+            .order_by(ibis.desc("fold_change_log2_tpm"))
+        )
+    if "all_phosphosites" in catalog.tables:
+        phosphosites = catalog.table("all_phosphosites")
+        queries["phosphosites"] = phosphosites.filter(
+            phosphosites["Rv Number"] == gene
+        ).order_by("p-value")
+    if "all_kinase_diff_genes" in catalog.tables:
+        kinase_degs = catalog.table("all_kinase_diff_genes")
+        queries["kinase_degs"] = kinase_degs.filter(
+            kinase_degs["DEG"] == gene
+        ).order_by("p-value")
+    if "tfoe" in catalog.tables:
+        tfoe = catalog.table("tfoe")
+        queries["tf_regulators"] = tfoe.filter(tfoe["Gene"] == gene).order_by(
+            "p_value"
+        )
+        queries["tf_targets"] = tfoe.filter(tfoe["TF"] == gene).order_by("p_value")
+    if "mycobrowser" in catalog.tables:
+        mycobrowser = catalog.table("mycobrowser")
+        # Annotations in the other species are matched on the gene name
+        matches = mycobrowser["Locus"].upper() == gene.upper()
+        if "gene_info" in catalog.tables:
+            gene_info = catalog.table("gene_info")
+            names = gene_info.filter(
+                (gene_info["gene"] == gene) & gene_info["Name"].notnull()
+            )["Name"]
+            matches = matches | mycobrowser["Name"].isin(names)
+        queries["mycobrowser"] = mycobrowser.filter(matches).order_by(
+            "species", "Locus"
+        )
+    return queries
+
+
+def _run_section(
+    con: ibis.BaseBackend, expr: ibis.Table
+) -> tuple[pd.DataFrame, float]:
+    start = time.perf_counter()
+    frame = execute_cached(con, expr)
+    return frame, time.perf_counter() - start
+
+
+def fetch_gene_profile(
+    con: ibis.BaseBackend, gene: str, max_workers: int | None = None
+) -> Iterator[SectionResult]:
+    # Run the queries for every section in parallel, yielding each result as
+    # it finishes (a failing query is yielded with its error rather than
+    # stopping the other sections)
+    queries = profile_queries(get_catalog(con), gene)
+    if not queries:
+        return
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers or len(queries),
+        thread_name_prefix="gene_profile",
+    )
+    try:
+        futures = {
+            executor.submit(_run_section, con, expr): section
+            for section, expr in queries.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            section = futures[future]
+            try:
+                frame, seconds = future.result()
+                error = None
+            except Exception as e:
+                frame, seconds, error = None, 0.0, e
+            yield SectionResult(
+                section=section,
+                title=PROFILE_SECTIONS[section],
+                frame=frame,
+                error=error,
+                seconds=seconds,
+            )
+    finally:
+        # When the caller stops early (e.g. the page is rerun), queries which
+        # haven't started yet are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,215 @@
+"""
+Module for searching genes by locus tag, name or synonym
+
+An index is built in memory (once per process and gene list) over the locus
+tags of the genes offered by a page, along with their names and synonyms
+from the gene_info table. Every searchable key is kept in a sorted list, so
+the keys starting with the query are a slice found by bisection, and in a
+table of the trigrams each key contains, so keys matching the query only in
+part (such as a typo, or a fragment from the middle of a name) can be found
+by counting the trigrams they share with it. A search only returns the best
+few genes, so a page can offer them as choices rather than the whole list.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import bisect
+import heapq
+import re
+import threading
+from typing import Iterable
+
+# External Imports
+import ibis
+import numpy as np
+
+# Local Imports
+from .catalog import get_catalog
+from .database import data_version
+from .result_cache import execute_cached
+
+# Genes returned by a search
+MAX_RESULTS = 20
+# Fraction of the query's trigrams a key has to contain to match in part
+MIN_TRIGRAM_SIMILARITY = 0.5
+# Separators between the synonyms of a gene in the gene_info table
+_SYNONYM_SEPARATORS = re.compile(r"[,;|]\s*|\s+")
+
+# Kinds of key, in the order their matches are ranked
+LOCUS_TAG = 0
+NAME = 1
+SYNONYM = 2
+
+
+def _trigrams(text: str) -> set[str]:
+    # Not padded, so a query from the middle of a key shares all of its
+    # trigrams with the key
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class GeneSearchIndex:
+    """
+    Prefix and trigram index over the locus tags, names and synonyms of a
+    list of genes
+    """
+
+    def __init__(
+        self,
+        genes: Iterable[str],
+        names: dict[str, str] | None = None,
+        synonyms: dict[str, Iterable[str]] | None = None,
+    ):
+        names = names or {}
+        synonyms = synonyms or {}
+        self.genes = sorted(set(genes))
+        self.gene_ids = {gene: i for i, gene in enumerate(self.genes)}
+        self.names = {gene: names[gene] for gene in self.genes if names.get(gene)}
+        entries = set()
+        for i, gene in enumerate(self.genes):
+            entries.add((gene.lower(), i, LOCUS_TAG))
+            if gene in self.names:
+                entries.add((self.names[gene].lower(), i, NAME))
+            for synonym in synonyms.get(gene, ()):
+                if synonym:
+                    entries.add((synonym.lower(), i, SYNONYM))
+        entries = sorted(entries)
+        self.keys = [key for key, _, _ in entries]
+        self.key_genes = np.array([gene for _, gene, _ in entries], dtype=np.int64)
+        self.key_kinds = np.array([kind for _, _, kind in entries], dtype=np.int8)
+        self.key_lengths = np.array([len(key) for key in self.keys], dtype=np.int64)
+        postings: dict[str, list[int]] = {}
+        for key_id, key in enumerate(self.keys):
+            for trigram in _trigrams(key):
+                postings.setdefault(trigram, []).append(key_id)
+        self.postings = {
+            trigram: np.array(key_ids, dtype=np.int64)
+            for trigram, key_ids in postings.items()
+        }
+        self.key_trigram_counts = np.array(
+            [len(_trigrams(key)) for key in self.keys], dtype=np.int64
+        )
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    def __contains__(self, gene: str) -> bool:
+        return gene in self.gene_ids
+
+    def label(self, gene: str) -> str:
+        # How a gene is shown as a choice, with its name when it has one
+        name = self.names.get(gene)
+        return f"{gene} ({name})" if name and name != gene else gene
+
+    def _prefix_matches(self, query: str) -> range:
+        start = bisect.bisect_left(self.keys, query)
+        stop = bisect.bisect_left(self.keys, query + "\U0010ffff", lo=start)
+        return range(start, stop)
+
+    def _trigram_matches(self, query: str) -> tuple[np.ndarray, np.ndarray]:
+        # Keys sharing enough of the query's trigrams, along with their
+        # similarity (shared trigrams over the trigrams of both)
+        all_trigrams = _trigrams(query)
+        query_trigrams = [t for t in all_trigrams if t in self.postings]
+        if not query_trigrams:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        shared = np.bincount(
+            np.concatenate([self.postings[t] for t in query_trigrams]),
+            minlength=len(self.keys),
+        )
+        n_query = len(all_trigrams)
+        key_ids = np.flatnonzero(shared >= MIN_TRIGRAM_SIMILARITY * n_query)
+        similarity = shared[key_ids] / (
+            n_query + self.key_trigram_counts[key_ids] - shared[key_ids]
+        )
+        return key_ids, similarity
+
+    def search(self, query: str, k: int = MAX_RESULTS) -> list[str]:
+        # The k best genes for the query, ranked by how their best key
+        # matches: exactly, then by prefix, then containing the query, then
+        # in part (each by kind of key, then shortest key first)
+        query = query.strip().lower()
+        if not query:
+            return self.genes[:k]
+        ranks: dict[int, tuple] = {}
+
+        def offer(gene: int, rank: tuple):
+            if gene not in ranks or rank < ranks[gene]:
+                ranks[gene] = rank
+
+        for key_id in self._prefix_matches(query):
+            tier = 0 if self.keys[key_id] == query else 1
+            offer(
+                int(self.key_genes[key_id]),
+                (tier, int(self.key_kinds[key_id]), self.key_lengths[key_id], 0.0),
+            )
+        if len(query) >= 3:
+            key_ids, similarity = self._trigram_matches(query)
+            for key_id, score in zip(key_ids.tolist(), similarity.tolist()):
+                tier = 2 if query in self.keys[key_id] else 3
+                offer(
+                    int(self.key_genes[key_id]),
+                    (
+                        tier,
+                        int(self.key_kinds[key_id]),
+                        -score,
+                        self.key_lengths[key_id],
+                    ),
+                )
+        best = heapq.nsmallest(
+            k, ranks.items(), key=lambda item: (item[1], item[0])
+        )
+        return [self.genes[gene] for gene, _ in best]
+
+
+def build_gene_search_index(
+    con: ibis.BaseBackend, genes: Iterable[str]
+) -> GeneSearchIndex:
+    # Names and synonyms are read from gene_info when the database has it,
+    # otherwise genes can only be found by locus tag
+    catalog = get_catalog(con)
+    if "gene_info" not in catalog.tables:
+        return GeneSearchIndex(genes)
+    gene_info = catalog.table("gene_info")
+    columns = [c for c in ("gene", "Name", "Synonyms") if c in gene_info.columns]
+    info = execute_cached(
+        con, gene_info.select(*columns).filter(ibis._.gene.notnull())
+    )
+    names = (
+        dict(zip(info["gene"].astype(str), info["Name"].astype(object)))
+        if "Name" in info
+        else {}
+    )
+    names = {gene: name for gene, name in names.items() if isinstance(name, str)}
+    synonyms = {}
+    if "Synonyms" in info:
+        for gene, value in zip(
+            info["gene"].astype(str), info["Synonyms"].astype(object)
+        ):
+            if isinstance(value, str):
+                synonyms[gene] = [s for s in _SYNONYM_SEPARATORS.split(value) if s]
+    return GeneSearchIndex(genes, names=names, synonyms=synonyms)
+
+
+# Indexes for each gene list of the catalog, rebuilt when the data version
+# changes
+_indexes: dict[tuple[str, str], GeneSearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_gene_search_index(
+    con: ibis.BaseBackend, gene_list: str = "gene_list"
+) -> GeneSearchIndex:
+    # gene_list names the list of the catalog the genes are chosen from
+    # (gene_list or tf_gene_list)
+    version = data_version(con)
+    with _indexes_lock:
+        index = _indexes.get((version, gene_list))
+        if index is None:
+            for stale in [key for key in _indexes if key[0] != version]:
+                del _indexes[stale]
+            index = build_gene_search_index(
+                con, getattr(get_catalog(con), gene_list)
+            )
+            _indexes[(version, gene_list)] = index
+        return index
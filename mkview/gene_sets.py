@@ -0,0 +1,252 @@
+"""
+Module for combining the target sets of regulators with set algebra
+
+Every target set (see mkview.enrichment) is stored as a fixed-width bitset,
+with one bit per gene (by its position in the sorted gene universe) packed
+into 64-bit words, so intersections, unions and differences are a handful of
+word-wise operations. Sets are combined with a small expression language:
+
+    DEG:PknB:LOF & TF:Rv0081
+    (PHOS:PknD - DEG:PknD) | TF:Rv3133c
+
+where & is intersection, | is union, - is difference (& and - bind tighter
+than |), and parentheses group. Sets are named SOURCE:REGULATOR[:MUTANT],
+with sources TF (regulons), DEG (differentially expressed genes) and PHOS
+(differentially phosphorylated proteins). Leaving out the mutant of an STPK
+takes the union of its mutants, and ALL is every gene.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import dataclasses
+import itertools
+import re
+from typing import Union
+
+# External Imports
+import ibis
+import numpy as np
+import pandas as pd
+
+# Local Imports
+from .database import data_version
+from .enrichment import TargetSets, get_target_sets, target_sets_cache
+
+# Prefix naming the sets from each source in expressions
+SET_PREFIXES = {
+    "TF regulon": "TF",
+    "STPK DEG": "DEG",
+    "STPK phosphosite": "PHOS",
+}
+UNIVERSE_NAME = "ALL"
+WORD_BITS = 64
+
+_TOKEN_PATTERN = re.compile(r"\s*(?:(?P<op>[&|()-])|(?P<name>[A-Za-z0-9_.:]+))")
+
+# Parsed expressions are a set name, or an operator with its two operands
+Expression = Union[str, tuple[str, "Expression", "Expression"]]
+
+
+def pack_bits(membership: np.ndarray) -> np.ndarray:
+    # Pack rows of booleans into rows of 64-bit words (bit i of the row is
+    # bit i % 64 of word i // 64)
+    n_rows, n_bits = membership.shape
+    n_words = -(-n_bits // WORD_BITS)
+    padded = np.zeros((n_rows, n_words * WORD_BITS), dtype=bool)
+    padded[:, :n_bits] = membership
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8")
+
+
+def unpack_bits(bits: np.ndarray, n_bits: int) -> np.ndarray:
+    # Positions of the set bits of a single bitset
+    return np.flatnonzero(
+        np.unpackbits(bits.view(np.uint8), bitorder="little")[:n_bits]
+    )
+
+
+def tokenize(expression: str) -> list[str]:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if match is None:
+            raise ValueError(
+                f"Unexpected character {expression[position:].lstrip()[0]!r} at "
+                f"position {position} of {expression!r}"
+            )
+        tokens.append(match.group("op") or match.group("name"))
+        position = match.end()
+    return tokens
+
+
+def parse_expression(expression: str) -> Expression:
+    # Recursive descent over the grammar:
+    #   union        := intersection ("|" intersection)*
+    #   intersection := operand (("&" | "-") operand)*
+    #   operand      := NAME | "(" union ")"
+    tokens = tokenize(expression)
+    position = 0
+
+    def peek() -> str | None:
+        return tokens[position] if position < len(tokens) else None
+
+    def advance() -> str:
+        nonlocal position
+        token = peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of expression {expression!r}")
+        position += 1
+        return token
+
+    def union() -> Expression:
+        node = intersection()
+        while peek() == "|":
+            advance()
+            node = ("|", node, intersection())
+        return node
+
+    def intersection() -> Expression:
+        node = operand()
+        while peek() in ("&", "-"):
+            op = advance()
+            node = (op, node, operand())
+        return node
+
+    def operand() -> Expression:
+        token = advance()
+        if token == "(":
+            node = union()
+            if advance() != ")":
+                raise ValueError(f"Missing closing parenthesis in {expression!r}")
+            return node
+        if token in ("&", "|", "-", ")"):
+            raise ValueError(
+                f"Expected a set name but found {token!r} in {expression!r}"
+            )
+        return token
+
+    if not tokens:
+        raise ValueError("Empty gene set expression")
+    tree = union()
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()!r} in {expression!r}")
+    return tree
+
+
+@dataclasses.dataclass
+class GeneSetStore:
+    """
+    Named target sets as bitsets over the gene universe, which can be
+    combined with gene set expressions
+    """
+
+    genes: np.ndarray
+    names: list[str]
+    bits: np.ndarray
+
+    def __post_init__(self):
+        self._index = {name.upper(): i for i, name in enumerate(self.names)}
+        self.universe = pack_bits(np.ones((1, len(self.genes)), dtype=bool))[0]
+
+    @classmethod
+    def from_target_sets(cls, target_sets: TargetSets) -> GeneSetStore:
+        sets = target_sets.sets
+        prefixes = sets["source"].map(SET_PREFIXES)
+        names = [
+            ":".join(part for part in parts if isinstance(part, str))
+            for parts in zip(prefixes, sets["regulator"], sets["mutant"])
+        ]
+        membership = target_sets.membership
+        # STPKs also get a set with the union of their mutants
+        has_mutant = sets["mutant"].notna().to_numpy()
+        union_names = []
+        union_rows = []
+        groups = pd.Series(np.arange(len(sets)))[has_mutant].groupby(
+            [prefixes[has_mutant], sets["regulator"][has_mutant]], sort=True
+        )
+        for (prefix, regulator), rows in groups:
+            union_names.append(f"{prefix}:{regulator}")
+            union_rows.append(membership[rows.to_numpy()].any(axis=0))
+        if union_rows:
+            names = names + union_names
+            membership = np.vstack([membership, np.array(union_rows)])
+        return cls(
+            genes=target_sets.genes, names=names, bits=pack_bits(membership)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.genes.nbytes + self.bits.nbytes
+
+    def bitset(self, name: str) -> np.ndarray:
+        if name.upper() == UNIVERSE_NAME:
+            return self.universe
+        try:
+            return self.bits[self._index[name.upper()]]
+        except KeyError:
+            raise ValueError(f"Unknown gene set {name!r}") from None
+
+    def evaluate(self, expression: str | Expression) -> np.ndarray:
+        # Bitset of the genes matching an expression
+        if isinstance(expression, str) and not re.fullmatch(
+            r"[A-Za-z0-9_.:]+", expression
+        ):
+            expression = parse_expression(expression)
+        if isinstance(expression, str):
+            return self.bitset(expression)
+        op, left, right = expression
+        left, right = self.evaluate(left), self.evaluate(right)
+        if op == "&":
+            return left & right
+        if op == "|":
+            return left | right
+        return left & ~right
+
+    def count(self, bits: np.ndarray) -> int:
+        return int(np.bitwise_count(bits).sum())
+
+    def genes_in(self, bits: np.ndarray) -> list[str]:
+        return self.genes[unpack_bits(bits, len(self.genes))].tolist()
+
+    def select(self, expression: str) -> list[str]:
+        return self.genes_in(self.evaluate(expression))
+
+    def overlap(self, expressions: list[str]) -> pd.DataFrame:
+        # Genes in each region of the Venn diagram of the expressions, with
+        # a column per expression flagging whether the region is inside it
+        bitsets = [self.evaluate(expression) for expression in expressions]
+        rows = []
+        for inside in itertools.product([True, False], repeat=len(bitsets)):
+            if not any(inside):
+                continue
+            region = self.universe
+            for bits, is_inside in zip(bitsets, inside):
+                region = region & (bits if is_inside else ~bits)
+            rows.append(
+                (
+                    *inside,
+                    self.count(region),
+                    ", ".join(self.genes_in(region)),
+                )
+            )
+        return pd.DataFrame(rows, columns=[*expressions, "n_genes", "genes"])
+
+
+def get_gene_set_store(
+    con: ibis.BaseBackend,
+    pval_cutoff: float = 0.05,
+    fold_change_threshold: float = 1.0,
+) -> GeneSetStore:
+    return target_sets_cache.get_or_compute(
+        (
+            "gene_set_store",
+            data_version(con),
+            float(pval_cutoff),
+            float(fold_change_threshold),
+        ),
+        lambda: GeneSetStore.from_target_sets(
+            get_target_sets(con, pval_cutoff, fold_change_threshold)
+        ),
+    )
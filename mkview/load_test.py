@@ -0,0 +1,419 @@
+"""
+Module for load testing the Streamlit pages with many concurrent sessions
+
+Each session drives the page scripts headlessly (with Streamlit's AppTest)
+using randomized inputs, against a local replica of the database, and the
+latency of every script run is recorded. The report includes the throughput,
+the latency percentiles for each page, and the peak memory use.
+
+Run with `python -m mkview.load_test --database <local duckdb file>` (which
+is synced into a temporary replica), or `--replica <directory>` to use an
+existing replica.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import argparse
+import contextlib
+import dataclasses
+import os
+import pathlib
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from unittest import mock
+
+# External Imports
+import ibis
+import numpy as np
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import (
+    MemoryCacheStorageManager,
+)
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.pages_manager import PagesStrategyV1
+from streamlit.testing.v1 import AppTest
+
+# Local Imports
+from .catalog import Catalog, get_catalog
+from .database import REPLICA_ENV_VAR, connect
+from . import filters
+from .result_cache import memory_budget
+from .sync import sync_replica
+
+# Search terms for the Mycobrowser page (along with random gene names)
+MYCOBROWSER_TERMS = [
+    "kinase",
+    "transcription",
+    "membrane",
+    "hypothetical",
+    "PE/PPE",
+    "dehydrogenase",
+    "Rv00[0-9]1",
+    "^esx",
+]
+
+
+def _widget(elements, label: str):
+    # Find a widget by the start of its label (pages don't give most of their
+    # widgets keys)
+    for element in elements:
+        if element.label.startswith(label):
+            return element
+    raise LookupError(f"No widget with label starting with {label!r}")
+
+
+def _sample(rng: random.Random, values: list[str], low: int = 1, high: int = 5):
+    return rng.sample(values, min(rng.randint(low, high), len(values)))
+
+
+def _select_genes(at: AppTest, key: str, genes: list[str]):
+    # Gene selectors (mkview.gene_selector) only offer the matches of their
+    # search as choices, so the genes are selected through the session state,
+    # and the last one is searched for as a user would
+    at.session_state[key] = genes
+    at.text_input(key=f"{key}_query").set_value(genes[-1][:4] if genes else "")
+
+
+# Scenarios set randomized inputs on a page, and trigger the rerun being
+# timed (by clicking a submit button), the run itself is done by the harness
+def _compendia_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    if rng.random() < 0.5:
+        _select_genes(at, "compendia_genes", _sample(rng, catalog.gene_list))
+        bound = rng.choice([0.5, 1.0, 2.0])
+        _widget(at.number_input, "Choose a positive bound").set_value(bound)
+        _widget(at.number_input, "Choose a negative bound").set_value(-bound)
+        at.button[0].click()
+    else:
+        _select_genes(
+            at, "coexpression_genes", _sample(rng, catalog.gene_list, high=2)
+        )
+        at.button(key="coexpression_submit").click()
+
+
+def _kinase_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    if rng.random() < 0.5:
+        at.selectbox[0].set_value(rng.choice(catalog.stpk_list))
+        at.radio[0].set_value(rng.choice(at.radio[0].options))
+        at.button[0].click()
+    else:
+        _widget(at.multiselect, "Choose STPKs").set_value(
+            _sample(rng, catalog.stpk_list, high=3)
+        )
+        _widget(at.number_input, "Choose a p-value cutoff").set_value(
+            rng.choice([0.05, 0.01, 0.001])
+        )
+        at.button(key="table_submit").click()
+
+
+def _tf_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    if rng.random() < 0.5:
+        at.selectbox[0].set_value(rng.choice(catalog.tf_list))
+        at.button[0].click()
+    else:
+        _widget(at.multiselect, "Select TFs").set_value(
+            _sample(rng, catalog.tf_list, high=3)
+        )
+        _widget(at.number_input, "Choose a p-value cutoff").set_value(
+            rng.choice([0.05, 0.01, 0.001])
+        )
+        at.button(key="table_submit").click()
+
+
+def _kinase_network_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    _select_genes(
+        at, "kinase_network_genes", _sample(rng, catalog.gene_list, high=20)
+    )
+    at.radio[0].set_value(rng.choice(at.radio[0].options))
+    at.radio[1].set_value(rng.choice(at.radio[1].options))
+    at.button[0].click()
+
+
+def _tf_network_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    _select_genes(
+        at, "tf_network_genes", _sample(rng, catalog.tf_gene_list, high=20)
+    )
+    at.button[0].click()
+
+
+def _mycobrowser_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    if rng.random() < 0.5:
+        term = rng.choice(MYCOBROWSER_TERMS)
+    else:
+        term = rng.choice(catalog.gene_list)
+    _widget(at.text_input, "Search term").set_value(term)
+    _widget(at.multiselect, "Select species").set_value(
+        _sample(rng, catalog.species_list, low=0, high=3)
+    )
+    at.button[0].click()
+
+
+def _overview_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    _widget(at.selectbox, "Select a gene").set_value(rng.choice(catalog.gene_list))
+
+
+def _gene_set_scenario(at: AppTest, rng: random.Random, catalog: Catalog):
+    stpk = rng.choice(catalog.stpk_list)
+    _widget(at.text_input, "Gene set A").set_value(
+        f"{rng.choice(['DEG', 'PHOS'])}:{stpk}:{rng.choice(catalog.mutant_list)}"
+    )
+    _widget(at.text_input, "Gene set B").set_value(
+        f"TF:{rng.choice(catalog.tf_list)} | TF:{rng.choice(catalog.tf_list)}"
+    )
+    _widget(at.text_input, "Gene set C").set_value(
+        rng.choice(["", f"PHOS:{stpk} - DEG:{stpk}"])
+    )
+
+
+PAGE_SCENARIOS: dict[str, Callable[[AppTest, random.Random, Catalog], None]] = {
+    "1_Gene_Expression_Compendia.py": _compendia_scenario,
+    "2_STPK_Differential_Phosphorylation.py": _kinase_scenario,
+    "3_STPK_Differential_Gene_Expression.py": _kinase_scenario,
+    "4_Transcription_Factor_Overexpression.py": _tf_scenario,
+    "5_Kinase_Network.py": _kinase_network_scenario,
+    "6_Transcription_Factor_Network.py": _tf_network_scenario,
+    "7_Mycobrowser.py": _mycobrowser_scenario,
+    "8_Overview.py": _overview_scenario,
+    "9_Gene_Profile.py": _overview_scenario,
+    "10_Gene_Set_Explorer.py": _gene_set_scenario,
+}
+
+
+@dataclasses.dataclass
+class RunResult:
+    page: str
+    kind: str
+    seconds: float
+    error: str | None = None
+
+
+@dataclasses.dataclass
+class LoadTestResult:
+    runs: list[RunResult]
+    elapsed: float
+    sessions: int
+    peak_rss_bytes: int
+    # Computations saved by waiting on an identical one already in progress
+    coalesced: int = 0
+    # Filtered tables answered from a cached result of a looser filter
+    superset_hits: int = 0
+
+
+@contextlib.contextmanager
+def _concurrent_app_tests():
+    # AppTest assumes one run at a time in the process, so patch the two
+    # pieces of global state it relies on for the duration of the load test:
+    # AppTest installs a mock runtime for each run and removes it when the run
+    # finishes (so one session's teardown would remove the runtime from under
+    # another), fall back to a shared mock runtime instead. And the page to
+    # run is looked up in the process-wide cache of the app's pages (which is
+    # filled for whichever page ran first), run each session's own script
+    # instead.
+    shared = mock.MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+
+    def instance(cls):
+        return cls._instance if cls._instance is not None else shared
+
+    def initial_active_script(self, page_script_hash, page_name):
+        return self.pages_manager.get_main_page()
+
+    with mock.patch.object(Runtime, "instance", classmethod(instance)), mock.patch.object(
+        PagesStrategyV1, "get_initial_active_script", initial_active_script
+    ):
+        yield
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _run_session(
+    session_id: int,
+    pages: list[str],
+    pages_dir: pathlib.Path,
+    catalog: Catalog,
+    deadline: float,
+    max_runs: int | None,
+    timeout: float,
+    seed: int,
+) -> list[RunResult]:
+    # A session moves between pages at random, keeping the state of each
+    # page (as a user's browser tab would)
+    rng = random.Random(seed + session_id)
+    apps: dict[str, AppTest] = {}
+    results = []
+    while time.perf_counter() < deadline and (
+        max_runs is None or len(results) < max_runs
+    ):
+        page = rng.choice(pages)
+        if page not in apps:
+            apps[page] = AppTest.from_file(
+                str(pages_dir / page), default_timeout=timeout
+            )
+            kind = "load"
+        else:
+            kind = "interact"
+        at = apps[page]
+        error = None
+        start = time.perf_counter()
+        try:
+            if kind == "interact":
+                PAGE_SCENARIOS[page](at, rng, catalog)
+            at.run()
+            if at.exception:
+                error = at.exception[0].value
+            elif not at.main.children:
+                # Counted against this run rather than failing the next
+                # interaction when its widgets can't be found
+                error = "Page rendered no elements"
+        except Exception as exc:
+            error = repr(exc)
+        if error is not None:
+            # The page may only be partly rendered, so start over with a
+            # fresh session for it
+            del apps[page]
+        results.append(RunResult(page, kind, time.perf_counter() - start, error))
+    return results
+
+
+def run_load_test(
+    replica: str | pathlib.Path,
+    sessions: int = 4,
+    duration: float = 60.0,
+    max_runs: int | None = None,
+    pages: list[str] | None = None,
+    app_dir: str | pathlib.Path = ".",
+    timeout: float = 120.0,
+    seed: int = 0,
+) -> LoadTestResult:
+    # The pages read from the replica through the environment, as they would
+    # when deployed
+    os.environ[REPLICA_ENV_VAR] = str(pathlib.Path(replica).resolve())
+    pages_dir = pathlib.Path(app_dir).resolve() / "pages"
+    if pages is None:
+        pages = list(PAGE_SCENARIOS)
+    catalog = get_catalog(connect())
+    coalesced_before = _coalesced()
+    superset_hits_before = filters.superset_hits
+    start = time.perf_counter()
+    deadline = start + duration
+    with _concurrent_app_tests(), ThreadPoolExecutor(
+        max_workers=sessions, thread_name_prefix="mkview-load-test"
+    ) as executor:
+        futures = [
+            executor.submit(
+                _run_session,
+                session_id,
+                pages,
+                pages_dir,
+                catalog,
+                deadline,
+                max_runs,
+                timeout,
+                seed,
+            )
+            for session_id in range(sessions)
+        ]
+        runs = [run for future in futures for run in future.result()]
+    return LoadTestResult(
+        runs=runs,
+        elapsed=time.perf_counter() - start,
+        sessions=sessions,
+        peak_rss_bytes=_peak_rss_bytes(),
+        coalesced=_coalesced() - coalesced_before,
+        superset_hits=filters.superset_hits - superset_hits_before,
+    )
+
+
+def _coalesced() -> int:
+    return sum(cache.coalesced for cache in memory_budget.caches)
+
+
+def format_report(result: LoadTestResult) -> str:
+    lines = [
+        f"{'Page':<42} {'Kind':<9} {'Runs':>6} {'Errors':>7} "
+        f"{'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}"
+    ]
+    groups: dict[tuple[str, str], list[RunResult]] = {}
+    for run in result.runs:
+        groups.setdefault((run.page, run.kind), []).append(run)
+    for (page, kind), runs in sorted(groups.items()):
+        p50, p95, p99 = np.percentile([run.seconds for run in runs], [50, 95, 99]) * 1000
+        n_errors = sum(run.error is not None for run in runs)
+        lines.append(
+            f"{page:<42} {kind:<9} {len(runs):>6} {n_errors:>7} "
+            f"{p50:>9.0f} {p95:>9.0f} {p99:>9.0f}"
+        )
+    lines.append(
+        f"{len(result.runs)} runs by {result.sessions} sessions in "
+        f"{result.elapsed:.1f}s ({len(result.runs) / result.elapsed:.2f} runs/s), "
+        f"peak RSS {result.peak_rss_bytes / 2**20:.0f} MB, "
+        f"{result.coalesced} computations saved by coalescing, "
+        f"{result.superset_hits} filtered from cached results"
+    )
+    errors = sorted({run.error for run in result.runs if run.error is not None})
+    for error in errors:
+        lines.append(f"Error: {error}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the pages with concurrent headless sessions"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--database",
+        help="Local database file to test against (synced into a temporary replica)",
+    )
+    source.add_argument("--replica", help="Existing replica to test against")
+    parser.add_argument(
+        "--sessions", type=int, default=4, help="Number of concurrent sessions"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60.0, help="Length of the test in seconds"
+    )
+    parser.add_argument(
+        "--max-runs", type=int, default=None, help="Maximum runs for each session"
+    )
+    parser.add_argument(
+        "--pages",
+        nargs="*",
+        default=None,
+        choices=list(PAGE_SCENARIOS),
+        help="Only test these pages",
+    )
+    parser.add_argument(
+        "--app-dir", default=".", help="Directory containing the pages directory"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed for the randomized inputs"
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        replica = args.replica
+        if args.database is not None:
+            replica = pathlib.Path(tmp_dir) / "replica"
+            sync_replica(ibis.duckdb.connect(args.database, read_only=True), replica)
+        result = run_load_test(
+            replica,
+            sessions=args.sessions,
+            duration=args.duration,
+            max_runs=args.max_runs,
+            pages=args.pages,
+            app_dir=args.app_dir,
+            seed=args.seed,
+        )
+    print(format_report(result))
+
+
+if __name__ == "__main__":
+    main()
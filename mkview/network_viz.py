@@ -13,6 +13,7 @@ import pyvis
 
 
 # Local Imports
+from .connection_pool import pooled_to_pyarrow
 
 
 def create_kinase_network(
@@ -36,7 +37,8 @@ def create_kinase_network(
         kinase_target_table["Mutant"].isin(mutant_type)
     ).filter(
         kinase_target_table[gene_col].isin(gene_list)
-    ).select("STPK", gene_col).to_pandas()
+    ).select("STPK", gene_col)
+    edge_df = pooled_to_pyarrow(edge_df).to_pandas()
     # Rename the edges
     edge_df = edge_df.rename({gene_col: "gene"}, axis=1)
     # Get a list of the kinases of interest
@@ -90,7 +92,8 @@ def create_tf_network(
     ).filter(
         (tf_target_table["fold_change"] >= pos_bound) |
         (tf_target_table["fold_change"] <= neg_bound)
-    ).select("TF", gene_col).to_pandas()
+    ).select("TF", gene_col)
+    edge_df = pooled_to_pyarrow(edge_df).to_pandas()
     # Rename the edges
     edge_df = edge_df.rename({gene_col: "gene"}, axis=1)
     # Get a list of the kinases of interest
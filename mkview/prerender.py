@@ -0,0 +1,133 @@
+"""
+Module for pre-rendering every volcano plot spec the pages can show (with
+the default sizes) to disk, so the pages only need to read them
+
+The specs are written to a directory named after the data version (for a
+database without a replica, a checksum of the tables the specs are built
+from), which is built under a temporary name and renamed into place once
+complete. The sync (mkview.sync) pre-renders the specs inside the replica
+after every sync.
+
+Run with `python -m mkview.prerender --replica <directory>`, or
+`--database <database> --output <directory>` (along with the
+MKVIEW_PRERENDERED_SPECS environment variable pointing at the output
+directory) when not using a replica.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import argparse
+import logging
+import os
+import pathlib
+import shutil
+
+# External Imports
+import ibis
+
+# Local Imports
+from .catalog import get_catalog
+from .database import attached_replica, connect, content_version, data_version
+from .spec_store import REPLICA_SPECS_DIR, write_spec
+from .volcano_specs import VOLCANO_SOURCE_TABLES, fixed_volcano_specs
+
+logger = logging.getLogger(__name__)
+
+
+def specs_version(con: ibis.BaseBackend) -> str:
+    # A replica's data version, otherwise (as MotherDuck connections share
+    # one data version) a checksum of the source tables of the specs
+    if attached_replica(con) is not None:
+        return data_version(con)
+    return content_version(con, VOLCANO_SOURCE_TABLES)
+
+
+def prerender_volcano_specs(
+    con: ibis.BaseBackend,
+    output: str | pathlib.Path,
+    keep_versions: int = 2,
+    force: bool = False,
+) -> int:
+    # Write every fixed volcano spec for the connection's data version,
+    # returns the number written (0 if they were already pre-rendered)
+    output = pathlib.Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    target = output / specs_version(con)
+    if target.exists() and not force:
+        # Mark the specs as checked against the data, so readers keep using
+        # them past their maximum age
+        os.utime(target)
+        return 0
+    catalog = get_catalog(con)
+    tmp_dir = output / f".{target.name}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    n_written = 0
+    for name, build in fixed_volcano_specs(
+        con, catalog.stpk_list, catalog.tf_list
+    ).items():
+        try:
+            write_spec(tmp_dir, name, build())
+            n_written += 1
+        except Exception:
+            logger.exception(f"Failed to pre-render {name}")
+    if target.exists():
+        shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    _remove_old_versions(output, keep_versions)
+    return n_written
+
+
+def _remove_old_versions(output: pathlib.Path, keep_versions: int):
+    # Keep the most recent versions, processes which haven't picked up the
+    # latest sync may still be reading the previous one
+    versions = sorted(
+        (path for path in output.iterdir() if path.is_dir() and not path.name.startswith(".")),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True,
+    )
+    for path in versions[keep_versions:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-render the volcano plot specs shown by the pages"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--replica",
+        help="Replica to pre-render the specs for (they are written inside it)",
+    )
+    source.add_argument(
+        "--database",
+        help="Database to pre-render the specs from (a MotherDuck database uses "
+        "the motherduck_token environment variable for authentication)",
+    )
+    parser.add_argument(
+        "--output", default=None, help="Directory to write the specs to"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Pre-render the specs even if they already are for this data version",
+    )
+    args = parser.parse_args()
+    if args.replica is not None:
+        con = connect(replica=args.replica)
+        output = args.output or pathlib.Path(args.replica) / REPLICA_SPECS_DIR
+    else:
+        if args.output is None:
+            parser.error("--output is required with --database")
+        con = ibis.duckdb.connect(args.database)
+        output = args.output
+    n_written = prerender_volcano_specs(con, output, force=args.force)
+    if n_written:
+        print(f"Pre-rendered {n_written} specs to {output}")
+    else:
+        print("Specs are already pre-rendered for this data version")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Module for showing the results of broad queries progressively
+
+A query whose full result isn't cached yet is started in the background,
+while the first rows (from the same query with a LIMIT) and an estimate of
+the total number of rows (from the query plan, so nothing is executed) are
+returned straight away. A page can show the preview while waiting, then
+replace it with the full result, so the wait before anything is shown is
+that of the cheapest query.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import concurrent.futures
+import dataclasses
+import json
+import logging
+from typing import Iterator
+
+# External Imports
+import duckdb
+import ibis
+import pandas as pd
+
+# Local Imports
+from .compact import compact_table
+from .connection_pool import get_pool, pooled_to_pyarrow
+from .result_cache import disk_results, execute_cached, query_key, query_results
+
+logger = logging.getLogger(__name__)
+
+# Rows shown in a preview
+PREVIEW_ROWS = 300
+
+
+@dataclasses.dataclass
+class ProgressiveResult:
+    frame: pd.DataFrame
+    # Whether this is the full result (rather than a preview)
+    complete: bool
+    # Number of rows in the full result (exact once complete, otherwise the
+    # estimate from the query plan, or None when there is no estimate)
+    n_rows: int | None
+
+    def progress_text(self, rows: str = "rows") -> str:
+        # Caption shown with a preview
+        if self.n_rows is None:
+            total = "an unknown number of"
+        else:
+            total = f"about {self.n_rows}"
+        return (
+            f"Showing the first {len(self.frame)} of {total} {rows}, "
+            "loading the rest..."
+        )
+
+
+def estimate_row_count(con: ibis.BaseBackend, expr: ibis.Table) -> int | None:
+    # Cardinality estimated by DuckDB's optimizer for the root of the query
+    # plan, which can be far off for complex filters (such as regular
+    # expressions) but costs no more than planning the query. None if the
+    # plan can't be read (the estimate is only ever shown, so a database
+    # rejecting the EXPLAIN, or a plan of another shape, isn't an error).
+    sql = str(ibis.to_sql(expr, dialect="duckdb"))
+    try:
+        with get_pool(con).cursor() as backend:
+            plan = backend.con.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchall()
+        nodes = json.loads(plan[0][1])
+        while nodes:
+            estimate = nodes[0].get("extra_info", {}).get("Estimated Cardinality")
+            if estimate is not None:
+                return int(estimate)
+            nodes = nodes[0].get("children", [])
+    except (duckdb.Error, ValueError, KeyError, IndexError):
+        logger.warning("Failed to estimate the row count of a query", exc_info=True)
+        return None
+    # Plans without estimates (such as a filter known to be false) are empty
+    return 0
+
+
+def fetch_progressive(
+    con: ibis.BaseBackend, expr: ibis.Table, preview_rows: int = PREVIEW_ROWS
+) -> Iterator[ProgressiveResult]:
+    # Yields a preview of the result (unless the full result is already
+    # cached, in memory or on disk) followed by the full result
+    key = query_key(con, expr)
+    if key in query_results or key in disk_results:
+        frame = execute_cached(con, expr)
+        yield ProgressiveResult(frame=frame, complete=True, n_rows=len(frame))
+        return
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="progressive_query"
+    )
+    try:
+        full = executor.submit(execute_cached, con, expr)
+        # The preview is replaced by the full result, so it isn't cached
+        # (where it would compete with the full result for the budget)
+        preview = compact_table(
+            pooled_to_pyarrow(expr.limit(preview_rows), con)
+        ).to_pandas(date_as_object=False)
+        if full.done() or len(preview) < preview_rows:
+            # A preview which isn't cut off by the limit is the whole result
+            # (the full query still finishes in the background, and is cached)
+            frame = full.result() if full.done() else preview
+            yield ProgressiveResult(frame=frame, complete=True, n_rows=len(frame))
+            return
+        estimate = estimate_row_count(con, expr)
+        yield ProgressiveResult(
+            frame=preview,
+            complete=False,
+            n_rows=None if estimate is None else max(estimate, len(preview)),
+        )
+        frame = full.result()
+        yield ProgressiveResult(frame=frame, complete=True, n_rows=len(frame))
+    finally:
+        executor.shutdown(wait=False)
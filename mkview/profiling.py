@@ -0,0 +1,343 @@
+"""
+Module for profiling where the Python time of page runs goes
+
+Profiling is opt in: setting the MKVIEW_PROFILE environment variable to 1
+profiles every page run, and setting it to "request" profiles the runs of
+pages opened with ?profile=1 (the query parameter is ignored otherwise, so
+visitors of a public app can't make it write profiles). Only the most
+recent runs are kept. A profiled run is sampled from a background thread
+(so the page itself isn't slowed down by tracing), recording the stack of
+the thread running the page every few milliseconds until the script
+finishes. The reruns of a page's fragments (which don't rerun the script)
+are profiled in the same way when the fragments are decorated with
+profile_fragment. Each run is written to the profile directory as a
+collapsed-stack file (one "frame;frame;... count" line per distinct stack,
+the input format of flamegraph.pl and speedscope), and a line describing
+the run (its page, duration and hottest functions) is added to runs.jsonl,
+from which the slowest runs can be listed with
+
+    python -m mkview.profiling --dir data/profiles
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import argparse
+import collections
+import datetime
+import functools
+import json
+import logging
+import os
+import pathlib
+import sys
+import threading
+import time
+import uuid
+from types import FrameType
+from typing import Callable
+
+# External Imports
+import pandas as pd
+
+# Local Imports
+
+logger = logging.getLogger(__name__)
+
+# Environment variables enabling profiling (of every run, or of requested
+# runs), and setting where profiles are written, how many runs are kept and
+# how often stacks are sampled
+PROFILE_ENV_VAR = "MKVIEW_PROFILE"
+PROFILE_DIR_ENV_VAR = "MKVIEW_PROFILE_DIR"
+PROFILE_MAX_RUNS_ENV_VAR = "MKVIEW_PROFILE_MAX_RUNS"
+PROFILE_INTERVAL_ENV_VAR = "MKVIEW_PROFILE_INTERVAL_MS"
+DEFAULT_PROFILE_DIR = "data/profiles"
+DEFAULT_MAX_RUNS = 200
+DEFAULT_INTERVAL_MS = 5.0
+RUNS_FILE = "runs.jsonl"
+# Runs longer than this stop being sampled
+MAX_PROFILE_SECONDS = 600.0
+# Functions listed for each run in runs.jsonl
+TOP_FUNCTIONS = 5
+
+_REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+_runs_lock = threading.Lock()
+
+
+def profiling_mode() -> str | None:
+    # "all" to profile every run, "request" to profile requested runs, or
+    # None when profiling is disabled
+    value = os.environ.get(PROFILE_ENV_VAR, "0").lower()
+    if value in ("1", "true", "yes", "all"):
+        return "all"
+    if value == "request":
+        return "request"
+    return None
+
+
+def profile_dir() -> pathlib.Path:
+    return pathlib.Path(os.environ.get(PROFILE_DIR_ENV_VAR, DEFAULT_PROFILE_DIR))
+
+
+def _frame_label(code) -> str:
+    # Functions are labelled with their file relative to the repository (or
+    # to site-packages for libraries) so stacks stay readable
+    path = pathlib.Path(code.co_filename)
+    try:
+        path = path.resolve().relative_to(_REPO_ROOT)
+    except ValueError:
+        parts = path.parts
+        if "site-packages" in parts:
+            path = pathlib.Path(*parts[parts.index("site-packages") + 1 :])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class PageProfiler:
+    """
+    Sampling profiler for one run of a page script (or of one of its
+    fragments), following the thread running it until the frame the run
+    started from leaves the stack
+    """
+
+    def __init__(
+        self,
+        page: str,
+        root_frame: FrameType,
+        thread_id: int,
+        output_dir: pathlib.Path,
+        interval: float = DEFAULT_INTERVAL_MS / 1000,
+        fragment: str | None = None,
+    ):
+        self.page = page
+        self.fragment = fragment
+        self.root_frame = root_frame
+        self.thread_id = thread_id
+        self.output_dir = output_dir
+        self.interval = interval
+        self.run_id = uuid.uuid4().hex[:8]
+        self.stacks: collections.Counter[tuple[str, ...]] = collections.Counter()
+        self.started = datetime.datetime.now()
+        self.seconds = 0.0
+        self._thread = threading.Thread(
+            target=self._sample, name=f"mkview-profiler-{self.run_id}", daemon=True
+        )
+
+    def start(self) -> PageProfiler:
+        self._thread.start()
+        return self
+
+    def _stack(self) -> tuple[str, ...] | None:
+        # Stack of the page thread from the root frame down, or None once
+        # the run has finished
+        frame = sys._current_frames().get(self.thread_id)
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            if frame is self.root_frame:
+                return tuple(reversed(labels))
+            frame = frame.f_back
+        return None
+
+    def _sample(self):
+        start = time.perf_counter()
+        while time.perf_counter() - start < MAX_PROFILE_SECONDS:
+            stack = self._stack()
+            if stack is None:
+                break
+            self.stacks[stack] += 1
+            time.sleep(self.interval)
+        self.seconds = time.perf_counter() - start
+        # The frame (and so its locals) isn't kept alive past the run
+        self.root_frame = None
+        try:
+            self.write()
+        except Exception:
+            logger.exception("Failed to write the profile of %s", self.page)
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in self.stacks.most_common()
+        )
+
+    def top_functions(self, n: int = TOP_FUNCTIONS) -> list[tuple[str, float]]:
+        # Functions the most samples were spent in (excluding their callees),
+        # as the fraction of samples
+        total = sum(self.stacks.values())
+        leaves: collections.Counter[str] = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack[-1]] += count
+        return [(label, count / total) for label, count in leaves.most_common(n)]
+
+    def write(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = pathlib.Path(self.page).stem
+        if self.fragment is not None:
+            name = f"{name}_{self.fragment}"
+        stem = f"{self.started:%Y%m%d-%H%M%S}_{name}_{self.run_id}"
+        collapsed_path = self.output_dir / f"{stem}.collapsed"
+        collapsed_path.write_text(self.collapsed())
+        record = {
+            "run_id": self.run_id,
+            "page": self.page,
+            "fragment": self.fragment,
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": round(self.seconds, 4),
+            "samples": sum(self.stacks.values()),
+            "collapsed": collapsed_path.name,
+            "top_functions": [
+                [label, round(fraction, 3)] for label, fraction in self.top_functions()
+            ],
+        }
+        max_runs = int(os.environ.get(PROFILE_MAX_RUNS_ENV_VAR, DEFAULT_MAX_RUNS))
+        with _runs_lock:
+            with open(self.output_dir / RUNS_FILE, "a") as runs_file:
+                runs_file.write(json.dumps(record) + "\n")
+            _enforce_max_runs(self.output_dir, max_runs)
+
+
+def _enforce_max_runs(directory: pathlib.Path, max_runs: int):
+    # Keep the most recent runs, removing the collapsed stacks of the rest
+    # (and any left behind by other processes sharing the directory)
+    runs_path = directory / RUNS_FILE
+    lines = runs_path.read_text().splitlines(keepends=True)
+    if len(lines) > max_runs:
+        lines = lines[len(lines) - max_runs :]
+        tmp_path = runs_path.with_name(f".{RUNS_FILE}.tmp-{os.getpid()}")
+        tmp_path.write_text("".join(lines))
+        os.replace(tmp_path, runs_path)
+    collapsed = list(directory.glob("*.collapsed"))
+    if len(collapsed) <= max_runs:
+        return
+    kept = set()
+    for line in lines:
+        try:
+            kept.add(json.loads(line)["collapsed"])
+        except (ValueError, KeyError):
+            continue
+    for path in collapsed:
+        if path.name not in kept:
+            path.unlink(missing_ok=True)
+
+
+def _start_profiler(
+    script_path: str,
+    root_frame: FrameType,
+    requested: bool,
+    fragment: str | None = None,
+) -> PageProfiler | None:
+    # Profile the run of a page from the root frame when profiling is
+    # enabled, or when it is requested (e.g. by a query parameter) and
+    # requests are allowed
+    mode = profiling_mode()
+    if not (mode == "all" or (mode == "request" and requested)):
+        return None
+    interval = float(os.environ.get(PROFILE_INTERVAL_ENV_VAR, DEFAULT_INTERVAL_MS))
+    return PageProfiler(
+        page=pathlib.Path(script_path).name,
+        root_frame=root_frame,
+        thread_id=threading.get_ident(),
+        output_dir=profile_dir(),
+        interval=interval / 1000,
+        fragment=fragment,
+    ).start()
+
+
+def profile_page_run(requested: bool = False) -> PageProfiler | None:
+    # Called at the top of a page script, profiles the rest of the run
+    caller = sys._getframe(1)
+    return _start_profiler(caller.f_code.co_filename, caller, requested)
+
+
+def _in_script_run(script_path: str) -> bool:
+    # Whether the calling thread is running the page script itself (rather
+    # than rerunning one of its fragments)
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "<module>" and code.co_filename == script_path:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def profile_fragment(requested: bool = False) -> Callable[[Callable], Callable]:
+    # Decorator (applied under st.fragment) profiling the reruns of a
+    # fragment, which happen without rerunning the page script. The runs of
+    # the fragment during a run of the script are part of the script's
+    # profile, so aren't profiled on their own.
+    def decorator(func: Callable) -> Callable:
+        script_path = func.__code__.co_filename
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _in_script_run(script_path):
+                _start_profiler(
+                    script_path, sys._getframe(), requested, fragment=func.__name__
+                )
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def slowest_runs(
+    directory: str | pathlib.Path | None = None,
+    n: int = 20,
+    page: str | None = None,
+) -> pd.DataFrame:
+    # The slowest profiled runs (of a page, or of every page), slowest first
+    path = pathlib.Path(directory or profile_dir()) / RUNS_FILE
+    if not path.exists():
+        return pd.DataFrame(
+            columns=[
+                "run_id",
+                "page",
+                "fragment",
+                "started",
+                "seconds",
+                "samples",
+                "collapsed",
+            ]
+        )
+    runs = pd.read_json(path, lines=True)
+    if page is not None:
+        runs = runs[runs["page"] == page]
+    return runs.sort_values("seconds", ascending=False).head(n).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List the slowest profiled page runs, with their hottest functions"
+    )
+    parser.add_argument(
+        "--dir",
+        default=None,
+        help=f"Profile directory (default ${PROFILE_DIR_ENV_VAR} or {DEFAULT_PROFILE_DIR})",
+    )
+    parser.add_argument(
+        "--top", type=int, default=20, help="Number of runs to list"
+    )
+    parser.add_argument("--page", default=None, help="Only list runs of this page")
+    args = parser.parse_args()
+    runs = slowest_runs(args.dir, n=args.top, page=args.page)
+    if runs.empty:
+        print("No profiled runs found")
+        return
+    for run in runs.itertuples(index=False):
+        # Runs of a fragment are listed as page:fragment
+        page = run.page
+        fragment = getattr(run, "fragment", None)
+        if isinstance(fragment, str):
+            page = f"{page}:{fragment}"
+        print(
+            f"{run.seconds * 1000:8.0f} ms  {page:<42} {run.started}  "
+            f"{run.collapsed}"
+        )
+        for label, fraction in run.top_functions:
+            print(f"{'':12}{fraction:6.1%}  {label}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Module for the in-process caches of query results, chart specs and network
+HTML shared between all sessions (with query results also cached on disk,
+see mkview.disk_cache)
+
+Every cache tracks the approximate size in bytes of its entries, and all of
+the caches share a single memory budget. When the budget is exceeded,
+entries are evicted across all caches using GreedyDual-Size-Frequency, so
+small entries which were slow to compute and are used often are kept over
+large, cheap or rarely used ones. Identical computations requested at the
+same time (e.g. many sessions opening the same plot) run only once.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import dataclasses
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+# External Imports
+import ibis
+import pandas as pd
+import pyarrow as pa
+
+# Local Imports
+from .compact import compact_table
+from .connection_pool import pooled_to_pyarrow
+from .database import data_version
+from .disk_cache import DiskCache
+
+# Environment variable with the memory budget (in megabytes) for all caches
+CACHE_BUDGET_ENV_VAR = "MKVIEW_CACHE_BUDGET_MB"
+DEFAULT_CACHE_BUDGET_MB = 512
+
+
+def estimate_nbytes(value: Any) -> int:
+    # Approximate memory used by a cached value
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pa.Table, pa.RecordBatch, pa.Array, pa.ChunkedArray)):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    # Other values (such as NumPy arrays) may report their own size
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+@dataclasses.dataclass
+class _CacheEntry:
+    value: Any
+    nbytes: int
+    cost: float
+    frequency: int
+    priority: float
+
+
+class _Flight:
+    """
+    A computation in progress, which later callers for the same key wait on
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+
+    def result(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key, for per-process
+    values kept outside of the caches (such as the catalog), so building one
+    key doesn't block callers of the others
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[Hashable, _Flight] = {}
+
+    def run(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        # compute should store its value where callers look first, and check
+        # there before computing, as a caller may miss the value just before
+        # it's stored and reach here just after the flight is removed
+        while True:
+            with self._lock:
+                flight = self._in_flight.get(key)
+                is_leader = flight is None
+                if is_leader:
+                    flight = self._in_flight[key] = _Flight()
+            if is_leader:
+                break
+            flight.done.wait()
+            # When the first caller was interrupted rather than failing, the
+            # computation is tried again
+            if flight.error is None or isinstance(flight.error, Exception):
+                return flight.result()
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+
+class MemoryBudget:
+    """
+    Memory budget shared by a group of caches, responsible for choosing
+    which entries to evict
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.caches: list[ResultCache] = []
+        # Inflation value for GreedyDual, raised to the priority of each
+        # evicted entry so that old entries age out
+        self.inflation = 0.0
+        self.lock = threading.RLock()
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(cache.nbytes for cache in self.caches)
+
+    def register(self, cache: ResultCache):
+        with self.lock:
+            self.caches.append(cache)
+
+    def priority(self, entry: _CacheEntry) -> float:
+        # Entries which cost more to recompute per byte (and are used more
+        # often) are given a higher priority
+        return self.inflation + entry.frequency * entry.cost / max(entry.nbytes, 1)
+
+    def enforce(self):
+        with self.lock:
+            while self.used_bytes > self.max_bytes:
+                victim = None
+                for cache in self.caches:
+                    for key, entry in cache._entries.items():
+                        if victim is None or entry.priority < victim[2].priority:
+                            victim = (cache, key, entry)
+                if victim is None:
+                    return
+                cache, key, entry = victim
+                self.inflation = entry.priority
+                cache._evict(key)
+
+
+def _default_budget_bytes() -> int:
+    return int(
+        float(os.environ.get(CACHE_BUDGET_ENV_VAR, DEFAULT_CACHE_BUDGET_MB)) * 2**20
+    )
+
+
+# Budget shared by all of the caches in the process
+memory_budget = MemoryBudget(_default_budget_bytes())
+
+
+class ResultCache:
+    """
+    Thread-safe cache, shared by all sessions in the process, which evicts
+    entries to keep within a shared memory budget
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 512,
+        budget: MemoryBudget = memory_budget,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Calls which waited on an identical computation already in progress
+        # rather than starting their own
+        self.coalesced = 0
+        self.nbytes = 0
+        self._entries: dict[Hashable, _CacheEntry] = {}
+        self._in_flight: dict[Hashable, _Flight] = {}
+        budget.register(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.budget.lock:
+            return key in self._entries
+
+    def get(self, key: Hashable) -> Any | None:
+        with self.budget.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.frequency += 1
+            entry.priority = self.budget.priority(entry)
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, cost: float = 0.0):
+        # cost is the time (in seconds) it took to compute the value
+        nbytes = estimate_nbytes(value)
+        with self.budget.lock:
+            if key in self._entries:
+                self._evict(key, count=False)
+            entry = _CacheEntry(
+                value=value, nbytes=nbytes, cost=cost, frequency=1, priority=0.0
+            )
+            entry.priority = self.budget.priority(entry)
+            self._entries[key] = entry
+            self.nbytes += nbytes
+            while len(self._entries) > self.max_entries:
+                self._evict(min(self._entries, key=lambda k: self._entries[k].priority))
+            self.budget.enforce()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        # The computation happens outside of the lock, so a slow query
+        # doesn't block other sessions from using the cache. Concurrent calls
+        # for the same missing key are coalesced: the first computes the value
+        # and the rest wait for its result (or its error), so a burst of
+        # identical requests costs a single computation
+        value = self.get(key)
+        if value is not None:
+            return value
+        while True:
+            with self.budget.lock:
+                # The value may have been stored since the lookup above
+                entry = self._entries.get(key)
+                if entry is not None:
+                    return entry.value
+                flight = self._in_flight.get(key)
+                is_leader = flight is None
+                if is_leader:
+                    flight = self._in_flight[key] = _Flight()
+                else:
+                    self.coalesced += 1
+            if is_leader:
+                break
+            flight.done.wait()
+            # When the first caller was interrupted (e.g. its session was
+            # rerun) rather than failing, the computation is tried again
+            if flight.error is None or isinstance(flight.error, Exception):
+                return flight.result()
+        try:
+            start = time.perf_counter()
+            flight.value = compute()
+            self.put(key, flight.value, cost=time.perf_counter() - start)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # The value is stored before the flight is removed, so there is
+            # no window where a caller finds neither
+            with self.budget.lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+    def _evict(self, key: Hashable, count: bool = True):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+        if count:
+            self.evictions += 1
+
+    def clear(self):
+        with self.budget.lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+        }
+
+
+# Caches shared by all of the pages
+query_results = ResultCache("query_results")
+chart_specs = ResultCache("chart_specs")
+network_html = ResultCache("network_html", max_entries=128)
+# On-disk tier under query_results, which survives restarts
+disk_results = DiskCache.from_environment()
+
+
+def cache_usage() -> pd.DataFrame:
+    # Report of the current memory usage of every cache
+    usage = pd.DataFrame(
+        [cache.stats() for cache in memory_budget.caches] + [disk_results.stats()]
+    )
+    usage.attrs["budget_bytes"] = memory_budget.max_bytes
+    usage.attrs["used_bytes"] = memory_budget.used_bytes
+    return usage
+
+
+def query_key(con: ibis.BaseBackend, expr: ibis.Table) -> tuple[str, str]:
+    # Queries are identified by their SQL, along with the version of the data
+    # so a sync of the replica invalidates old results
+    return data_version(con), str(ibis.to_sql(expr, dialect="duckdb"))
+
+
+def execute_compact(expr: ibis.Table) -> pd.DataFrame:
+    # Execute a query, with the result converted to compact types (repetitive
+    # strings become categoricals, which are dictionary encoded when sent to
+    # the browser)
+    return compact_table(pooled_to_pyarrow(expr)).to_pandas(date_as_object=False)
+
+
+def execute_cached(con: ibis.BaseBackend, expr: ibis.Table) -> pd.DataFrame:
+    # The returned frame is shared between sessions, and so shouldn't be
+    # modified in place
+    key = query_key(con, expr)
+    return query_results.get_or_compute(
+        key, lambda: _execute_disk_cached(con, key, expr)
+    )
+
+
+def _execute_disk_cached(
+    con: ibis.BaseBackend, key: tuple[str, str], expr: ibis.Table
+) -> pd.DataFrame:
+    # Results missing from memory are read from the disk cache before
+    # running the query (the compact Arrow table is what's stored)
+    table = disk_results.get(key)
+    if table is None:
+        table = compact_table(pooled_to_pyarrow(expr, con))
+        disk_results.put(key, table)
+    return table.to_pandas(date_as_object=False)
@@ -0,0 +1,74 @@
+"""
+Module for planning text searches over the columns of a table
+
+Search terms without any regular expression metacharacters are matched as
+plain substrings (which DuckDB evaluates much faster than a regex), other
+terms are matched as regular expressions.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+
+# External Imports
+import ibis
+
+# Local Imports
+
+# Characters which give a search term a meaning beyond a literal substring
+REGEX_METACHARACTERS = frozenset(".^$*+?()[]{}|\\")
+
+
+def is_literal(term: str) -> bool:
+    return not any(char in REGEX_METACHARACTERS for char in term)
+
+
+def string_columns(table: ibis.Table) -> list[str]:
+    # Columns of the table which can be searched
+    return [name for name, dtype in table.schema().items() if dtype.is_string()]
+
+
+def search_filter(
+    table: ibis.Table,
+    term: str,
+    columns: list[str],
+    case_insensitive: bool = True,
+) -> ibis.Value:
+    # Predicate matching rows where any of the columns matches the term
+    if not columns:
+        raise ValueError("At least one column is needed to search")
+    if is_literal(term):
+        if case_insensitive:
+            term = term.lower()
+            matches = [table[col].lower().contains(term) for col in columns]
+        else:
+            matches = [table[col].contains(term) for col in columns]
+    else:
+        if case_insensitive:
+            term = "(?i)" + term
+        matches = [table[col].re_search(term) for col in columns]
+    predicate = matches[0]
+    for match in matches[1:]:
+        predicate |= match
+    return predicate
+
+
+def search_table(
+    table: ibis.Table,
+    term: str,
+    search_columns: list[str],
+    output_columns: list[str] | None = None,
+    case_insensitive: bool = True,
+    predicates: list[ibis.Value] | None = None,
+) -> ibis.Table:
+    # Project to the columns which are searched or returned before filtering,
+    # predicates are additional filters on the (unprojected) table
+    if output_columns is None:
+        output_columns = table.columns
+    if predicates:
+        table = table.filter(predicates)
+    needed = list(dict.fromkeys([*output_columns, *search_columns]))
+    projected = table.select(needed)
+    return projected.filter(
+        search_filter(projected, term, search_columns, case_insensitive)
+    ).select(output_columns)
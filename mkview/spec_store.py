@@ -0,0 +1,114 @@
+"""
+Module for storing pre-rendered chart specs on disk
+
+Specs are stored in one directory per data version, each spec as a JSON file
+with its datasets alongside it as Parquet files (so they are read back as
+compact DataFrames rather than parsed from JSON). Specs stored outside of a
+replica are read from the most recent version directory, as long as it was
+written (or checked against the data by mkview.prerender) within the
+maximum age.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import json
+import os
+import pathlib
+import re
+import time
+
+# External Imports
+import ibis
+import pandas as pd
+
+# Local Imports
+from .database import attached_replica, data_version
+
+# Environment variable with the directory of pre-rendered specs (when not
+# using a replica)
+SPEC_STORE_ENV_VAR = "MKVIEW_PRERENDERED_SPECS"
+# Maximum age (in hours) of specs stored outside of a replica, MotherDuck
+# connections don't have a data version, so the specs have to expire to pick
+# up changes
+SPEC_STORE_AGE_ENV_VAR = "MKVIEW_PRERENDERED_SPECS_MAX_AGE_HOURS"
+DEFAULT_SPEC_STORE_MAX_AGE_HOURS = 24
+# Directory inside the replica holding the pre-rendered specs
+REPLICA_SPECS_DIR = "prerendered_specs"
+
+
+def spec_name(*parts) -> str:
+    # File name for a spec, from the parameters identifying it
+    return "-".join(re.sub(r"[^A-Za-z0-9_.+]", "_", str(part)) for part in parts)
+
+
+def spec_store_root(con: ibis.BaseBackend) -> pathlib.Path | None:
+    # Pre-rendered specs for a replica are stored inside it, otherwise they are
+    # stored in the directory configured through the environment
+    replica = attached_replica(con)
+    if replica is not None:
+        return replica[0] / REPLICA_SPECS_DIR
+    if os.environ.get(SPEC_STORE_ENV_VAR):
+        return pathlib.Path(os.environ[SPEC_STORE_ENV_VAR])
+    return None
+
+
+def write_spec(directory: pathlib.Path, name: str, spec: dict):
+    spec = dict(spec)
+    datasets = spec.pop("datasets", {})
+    dataset_files = {}
+    for dataset_name, data in datasets.items():
+        file_name = f"{name}.{dataset_name}.parquet"
+        pd.DataFrame(data).to_parquet(directory / file_name, index=False)
+        dataset_files[dataset_name] = file_name
+    with open(directory / f"{name}.json", "w") as f:
+        json.dump({"spec": spec, "datasets": dataset_files}, f)
+
+
+def read_spec(directory: pathlib.Path, name: str) -> dict | None:
+    spec_path = directory / f"{name}.json"
+    if not spec_path.exists():
+        return None
+    with open(spec_path) as f:
+        stored = json.load(f)
+    spec = stored["spec"]
+    spec["datasets"] = {
+        dataset_name: pd.read_parquet(directory / file_name)
+        for dataset_name, file_name in stored["datasets"].items()
+    }
+    return spec
+
+
+def latest_version_dir(root: pathlib.Path, max_age: float) -> pathlib.Path | None:
+    # Most recently written version directory, if it is recent enough
+    try:
+        versions = [
+            path
+            for path in root.iterdir()
+            if path.is_dir() and not path.name.startswith(".")
+        ]
+    except FileNotFoundError:
+        return None
+    if not versions:
+        return None
+    latest = max(versions, key=lambda path: path.stat().st_mtime)
+    if time.time() - latest.stat().st_mtime > max_age:
+        return None
+    return latest
+
+
+def read_prerendered_spec(con: ibis.BaseBackend, name: str) -> dict | None:
+    # Pre-rendered spec for the connection's data version, if one was built
+    root = spec_store_root(con)
+    if root is None:
+        return None
+    if attached_replica(con) is not None:
+        return read_spec(root / data_version(con), name)
+    max_age = (
+        float(os.environ.get(SPEC_STORE_AGE_ENV_VAR, DEFAULT_SPEC_STORE_MAX_AGE_HOURS))
+        * 3600
+    )
+    directory = latest_version_dir(root, max_age)
+    if directory is None:
+        return None
+    return read_spec(directory, name)
@@ -0,0 +1,158 @@
+"""
+Module for building precomputed summary tables used by the overview page
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import argparse
+
+# External Imports
+import ibis
+
+# Local Imports
+
+# Standard cutoffs used for all of the summary tables
+FOLD_CHANGE_THRESHOLDS = (1.0, 2.0, 3.0)
+PVAL_CUTOFFS = (0.05, 0.01, 0.005, 0.001)
+
+# Names of the summary tables in the database
+COMPENDIA_SUMMARY_TABLE = "summary_compendia_gene_counts"
+KINASE_SUMMARY_TABLE = "summary_kinase_hit_counts"
+TF_SUMMARY_TABLE = "summary_tf_regulon_sizes"
+
+# Source tables the summaries are computed from
+SUMMARY_SOURCE_TABLES = (
+    "gene_expression_compendia_unpivoted",
+    "all_phosphosites",
+    "all_kinase_diff_genes",
+    "tfoe",
+)
+
+
+# Main Functions
+def compendia_gene_counts(
+    expression_table: ibis.Table,
+    gene_col: str = "Gene",
+    foldchange_col: str = "fold_change_log2_tpm",
+    thresholds: tuple[float, ...] = FOLD_CHANGE_THRESHOLDS,
+) -> ibis.Table:
+    # Count, for every gene, the number of compendia conditions where the
+    # expression changes past each threshold, split by the sign of the change
+    fold_change = expression_table[foldchange_col]
+    counts = [
+        expression_table.group_by(
+            expression_table[gene_col].name("Gene")
+        ).aggregate(
+            fold_change_threshold=ibis.literal(threshold, type="float64"),
+            n_up=(fold_change >= threshold).ifelse(1, 0).sum(),
+            n_down=(fold_change <= -threshold).ifelse(1, 0).sum(),
+            n_conditions=fold_change.count(),
+        )
+        for threshold in thresholds
+    ]
+    return ibis.union(*counts)
+
+
+def kinase_hit_counts(
+    kinase_tables: dict[str, tuple[ibis.Table, str]],
+    pval_col: str = "p-value",
+    foldchange_col: str = "Fold-change (log2)",
+    cutoffs: tuple[float, ...] = PVAL_CUTOFFS,
+) -> ibis.Table:
+    # Count the significant hits for every STPK/Mutant pair in each of the
+    # kinase datasets (keyed by dataset name, with the gene column to count)
+    counts = []
+    for dataset, (table, gene_col) in kinase_tables.items():
+        for cutoff in cutoffs:
+            significant = table[pval_col] <= cutoff
+            counts.append(
+                table.group_by("STPK", "Mutant").aggregate(
+                    dataset=ibis.literal(dataset, type="string"),
+                    pval_cutoff=ibis.literal(cutoff, type="float64"),
+                    n_hits=significant.ifelse(1, 0).sum(),
+                    n_up=(significant & (table[foldchange_col] > 0)).ifelse(1, 0).sum(),
+                    n_down=(significant & (table[foldchange_col] < 0)).ifelse(1, 0).sum(),
+                    n_genes=table[gene_col].nunique(where=significant),
+                )
+            )
+    return ibis.union(*counts)
+
+
+def tf_regulon_sizes(
+    tfoe_table: ibis.Table,
+    gene_col: str = "Gene",
+    pval_col: str = "p_value",
+    foldchange_col: str = "fold_change",
+    cutoffs: tuple[float, ...] = PVAL_CUTOFFS,
+    thresholds: tuple[float, ...] = FOLD_CHANGE_THRESHOLDS,
+) -> ibis.Table:
+    # Find the size of the regulon of every TF at each combination of the
+    # p-value cutoffs and fold-change thresholds
+    sizes = []
+    for cutoff in cutoffs:
+        for threshold in thresholds:
+            significant = tfoe_table[pval_col] <= cutoff
+            induced = significant & (tfoe_table[foldchange_col] >= threshold)
+            repressed = significant & (tfoe_table[foldchange_col] <= -threshold)
+            sizes.append(
+                tfoe_table.group_by("TF").aggregate(
+                    pval_cutoff=ibis.literal(cutoff, type="float64"),
+                    fold_change_threshold=ibis.literal(threshold, type="float64"),
+                    n_targets=tfoe_table[gene_col].nunique(where=induced | repressed),
+                    n_induced=tfoe_table[gene_col].nunique(where=induced),
+                    n_repressed=tfoe_table[gene_col].nunique(where=repressed),
+                )
+            )
+    return ibis.union(*sizes)
+
+
+def build_summary_tables(con: ibis.BaseBackend) -> dict[str, ibis.Table]:
+    # Create the expressions for all of the summary tables from the fact tables
+    # in the database
+    return {
+        COMPENDIA_SUMMARY_TABLE: compendia_gene_counts(
+            con.table("gene_expression_compendia_unpivoted")
+        ),
+        KINASE_SUMMARY_TABLE: kinase_hit_counts(
+            {
+                "phosphosites": (con.table("all_phosphosites"), "Rv Number"),
+                "gene_expression": (con.table("all_kinase_diff_genes"), "DEG"),
+            }
+        ),
+        TF_SUMMARY_TABLE: tf_regulon_sizes(con.table("tfoe")),
+    }
+
+
+def write_summary_tables(
+    con: ibis.BaseBackend, target_con: ibis.BaseBackend | None = None
+) -> list[str]:
+    # Materialize the summary tables, into the target database if one is given
+    # (otherwise into the database the fact tables come from)
+    if target_con is None:
+        target_con = con
+    written = []
+    for name, expr in build_summary_tables(con).items():
+        target_con.create_table(name, expr.to_pyarrow(), overwrite=True)
+        written.append(name)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the precomputed summary tables used by the overview page"
+    )
+    parser.add_argument(
+        "--database",
+        default="md:mkviewer",
+        help="Database to build the summary tables in (a MotherDuck database "
+        "uses the motherduck_token environment variable for authentication)",
+    )
+    args = parser.parse_args()
+    con = ibis.duckdb.connect(args.database)
+    for name in write_summary_tables(con):
+        print(f"Wrote {name}")
+
+
+if __name__ == "__main__":
+    main()
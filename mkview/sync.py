@@ -0,0 +1,322 @@
+"""
+Module for incrementally syncing the mkviewer database into a local replica
+
+The replica is a directory of Parquet files (one per table) along with a
+manifest recording the row count and checksum of every table. Only tables
+whose checksum has changed are copied, and the new manifest is swapped in
+with an atomic rename, so connections reading the replica never see a
+half-written table. Files the new manifest no longer references are kept
+for a grace period (recorded in the manifest) before they're removed, as
+connections which haven't refreshed yet may still be reading them.
+
+Run with `python -m mkview.sync --replica <directory>`.
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import argparse
+import dataclasses
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+
+# External Imports
+import ibis
+import pyarrow.parquet as pq
+
+# Local Imports
+from .compendia_matrix import COMPENDIA_TABLE, REPLICA_MATRIX_DIR, build_compendia_matrix
+from .database import (
+    MANIFEST_NAME,
+    connect,
+    manifest_version,
+    read_manifest,
+    table_checksum,
+)
+from .prerender import prerender_volcano_specs
+from .spec_store import REPLICA_SPECS_DIR
+from .summary_tables import (
+    COMPENDIA_SUMMARY_TABLE,
+    KINASE_SUMMARY_TABLE,
+    SUMMARY_SOURCE_TABLES,
+    TF_SUMMARY_TABLE,
+    build_summary_tables,
+)
+
+# Minutes files no longer referenced by the manifest are kept for
+DEFAULT_GRACE_MINUTES = 60
+
+
+@dataclasses.dataclass
+class TableSyncResult:
+    name: str
+    status: str
+    rows_before: int | None
+    rows_after: int | None
+
+
+# Main Functions
+def _write_parquet(batches, schema, path: pathlib.Path):
+    # Write to a temporary file first and then rename it into place
+    tmp_path = path.with_name(path.name + ".tmp")
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp_path, path)
+
+
+def copy_table(
+    con: ibis.BaseBackend, table_name: str, replica: pathlib.Path, checksum: str
+) -> str:
+    file_name = f"{table_name}-{checksum}.parquet"
+    batches = con.table(table_name).to_pyarrow_batches()
+    _write_parquet(batches, batches.schema, replica / file_name)
+    return file_name
+
+
+def _write_manifest(replica: pathlib.Path, manifest: dict):
+    tmp_path = replica / (MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, replica / MANIFEST_NAME)
+
+
+def _retire_unreferenced_files(
+    replica: pathlib.Path,
+    old_manifest: dict,
+    new_tables: dict,
+    now: datetime.datetime,
+    grace_period: datetime.timedelta,
+) -> tuple[dict[str, str], list[pathlib.Path]]:
+    # Files not referenced by the new tables are retired, with the time they
+    # were first found unreferenced carried over from the old manifest.
+    # Returns the files still within the grace period (to record in the new
+    # manifest) and those past it (to remove once the manifest is swapped in)
+    referenced = {entry["file"] for entry in new_tables.values()}
+    old_retired = old_manifest.get("retired", {})
+    retired = {}
+    expired = []
+    for path in replica.glob("*.parquet"):
+        if path.name in referenced:
+            continue
+        retired_at = old_retired.get(path.name, now.isoformat())
+        if now - datetime.datetime.fromisoformat(retired_at) < grace_period:
+            retired[path.name] = retired_at
+        else:
+            expired.append(path)
+    return retired, expired
+
+
+def sync_replica(
+    source_con: ibis.BaseBackend,
+    replica: str | pathlib.Path,
+    tables: list[str] | None = None,
+    summary_tables: bool = True,
+    compendia_matrix: bool = True,
+    prerendered_specs: bool = True,
+    grace_period: datetime.timedelta = datetime.timedelta(
+        minutes=DEFAULT_GRACE_MINUTES
+    ),
+) -> list[TableSyncResult]:
+    replica = pathlib.Path(replica)
+    replica.mkdir(parents=True, exist_ok=True)
+    old_manifest = read_manifest(replica)
+    new_tables = {}
+    results = []
+    if tables is None:
+        tables = source_con.list_tables()
+    else:
+        # Tables which weren't asked for are carried over unchanged
+        new_tables.update(
+            {
+                name: entry
+                for name, entry in old_manifest["tables"].items()
+                if name not in tables
+            }
+        )
+    if summary_tables:
+        # The summary tables are rebuilt locally rather than copied
+        summary_names = {COMPENDIA_SUMMARY_TABLE, KINASE_SUMMARY_TABLE, TF_SUMMARY_TABLE}
+        tables = [name for name in tables if name not in summary_names]
+    for name in tables:
+        n_rows, checksum = table_checksum(source_con, name)
+        old_entry = old_manifest["tables"].get(name)
+        if old_entry is not None and old_entry["checksum"] == checksum:
+            new_tables[name] = old_entry
+            results.append(TableSyncResult(name, "unchanged", n_rows, n_rows))
+            continue
+        new_tables[name] = {
+            "file": copy_table(source_con, name, replica, checksum),
+            "rows": n_rows,
+            "checksum": checksum,
+        }
+        results.append(
+            TableSyncResult(
+                name,
+                "added" if old_entry is None else "changed",
+                None if old_entry is None else old_entry["rows"],
+                n_rows,
+            )
+        )
+    if summary_tables and all(name in new_tables for name in SUMMARY_SOURCE_TABLES):
+        results += _sync_summary_tables(replica, old_manifest, new_tables)
+
+    if compendia_matrix and COMPENDIA_TABLE in new_tables:
+        # Rebuild the memory-mapped compendia matrix if the compendia changed
+        build_compendia_matrix(
+            _staging_connection(replica, new_tables, [COMPENDIA_TABLE]),
+            replica / REPLICA_MATRIX_DIR,
+            checksum=new_tables[COMPENDIA_TABLE]["checksum"],
+        )
+
+    for name, old_entry in old_manifest["tables"].items():
+        if name not in new_tables:
+            results.append(TableSyncResult(name, "removed", old_entry["rows"], None))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    retired, expired = _retire_unreferenced_files(
+        replica, old_manifest, new_tables, now, grace_period
+    )
+    new_manifest = {
+        "version": manifest_version(new_tables),
+        "synced_at": now.isoformat(),
+        "tables": new_tables,
+        "retired": retired,
+    }
+    _write_manifest(replica, new_manifest)
+    for path in expired:
+        path.unlink(missing_ok=True)
+
+    if prerendered_specs:
+        # Pre-render the volcano plots for the new version of the data (until
+        # they are written the pages build them live)
+        prerender_volcano_specs(connect(replica=replica), replica / REPLICA_SPECS_DIR)
+    return results
+
+
+def _staging_connection(
+    replica: pathlib.Path, new_tables: dict, names: list[str]
+) -> ibis.BaseBackend:
+    # Connection with views over the newly synced files (before the manifest
+    # pointing to them has been swapped in)
+    staging_con = ibis.duckdb.connect()
+    for name in names:
+        parquet_path = (replica / new_tables[name]["file"]).resolve().as_posix()
+        staging_con.raw_sql(
+            f"CREATE VIEW \"{name}\" AS SELECT * FROM read_parquet('{parquet_path}')"
+        )
+    return staging_con
+
+
+def _sync_summary_tables(
+    replica: pathlib.Path, old_manifest: dict, new_tables: dict
+) -> list[TableSyncResult]:
+    # The summary tables are rebuilt from the replica whenever one of the
+    # tables they summarize changes, their checksum is derived from the
+    # checksums of those source tables
+    h = hashlib.sha256()
+    for name in SUMMARY_SOURCE_TABLES:
+        h.update(new_tables[name]["checksum"].encode("utf-8"))
+    checksum = h.hexdigest()[:16]
+
+    staging_con = _staging_connection(replica, new_tables, SUMMARY_SOURCE_TABLES)
+    results = []
+    for name, expr in build_summary_tables(staging_con).items():
+        old_entry = old_manifest["tables"].get(name)
+        if old_entry is not None and old_entry["checksum"] == checksum:
+            new_tables[name] = old_entry
+            results.append(
+                TableSyncResult(name, "unchanged", old_entry["rows"], old_entry["rows"])
+            )
+            continue
+        file_name = f"{name}-{checksum}.parquet"
+        summary = expr.to_pyarrow()
+        _write_parquet(summary.to_batches(), summary.schema, replica / file_name)
+        new_tables[name] = {
+            "file": file_name,
+            "rows": summary.num_rows,
+            "checksum": checksum,
+        }
+        results.append(
+            TableSyncResult(
+                name,
+                "added" if old_entry is None else "changed",
+                None if old_entry is None else old_entry["rows"],
+                summary.num_rows,
+            )
+        )
+    return results
+
+
+def format_report(results: list[TableSyncResult]) -> str:
+    lines = [f"{'Table':<40} {'Status':<10} {'Rows Before':>12} {'Rows After':>12}"]
+    for result in results:
+        rows_before = "" if result.rows_before is None else result.rows_before
+        rows_after = "" if result.rows_after is None else result.rows_after
+        lines.append(
+            f"{result.name:<40} {result.status:<10} {rows_before:>12} {rows_after:>12}"
+        )
+    n_changed = sum(result.status != "unchanged" for result in results)
+    lines.append(f"{n_changed} of {len(results)} tables changed")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incrementally sync the mkviewer database into a local replica"
+    )
+    parser.add_argument(
+        "--source",
+        default="md:mkviewer",
+        help="Database to sync from (a MotherDuck database uses the "
+        "motherduck_token environment variable for authentication)",
+    )
+    parser.add_argument(
+        "--replica", required=True, help="Directory to hold the local replica"
+    )
+    parser.add_argument(
+        "--tables", nargs="*", default=None, help="Only sync these tables"
+    )
+    parser.add_argument(
+        "--grace-minutes",
+        type=float,
+        default=DEFAULT_GRACE_MINUTES,
+        help="Minutes to keep files no longer referenced by the manifest, for "
+        "connections still reading them",
+    )
+    parser.add_argument(
+        "--no-compendia-matrix",
+        action="store_true",
+        help="Don't rebuild the memory-mapped compendia matrix",
+    )
+    parser.add_argument(
+        "--no-prerendered-specs",
+        action="store_true",
+        help="Don't pre-render the volcano plot specs",
+    )
+    parser.add_argument(
+        "--no-summary-tables",
+        action="store_true",
+        help="Don't rebuild the summary tables used by the overview page",
+    )
+    args = parser.parse_args()
+    source_con = ibis.duckdb.connect(args.source)
+    results = sync_replica(
+        source_con,
+        args.replica,
+        tables=args.tables,
+        summary_tables=not args.no_summary_tables,
+        compendia_matrix=not args.no_compendia_matrix,
+        prerendered_specs=not args.no_prerendered_specs,
+        grace_period=datetime.timedelta(minutes=args.grace_minutes),
+    )
+    print(format_report(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Module for drawing Venn diagrams of two or three gene sets with Altair, from
+the region counts found by GeneSetStore.overlap
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import math
+
+# External Imports
+import altair as alt
+import pandas as pd
+
+# Local Imports
+
+# Circle centres for each number of sets, in units of the circle radius
+_CENTRES = {
+    2: [(-0.55, 0.0), (0.55, 0.0)],
+    3: [
+        (0.6 * math.cos(math.radians(a)), 0.6 * math.sin(math.radians(a)))
+        for a in (150, 30, 270)
+    ],
+}
+# Extent of the plot in each direction (in units of the circle radius)
+_EXTENT = 2.0
+
+
+def _region_position(inside: tuple[bool, ...]) -> tuple[float, float]:
+    # Label position for a region: the mean of the centres of the circles
+    # it's inside, pushed away from the circles it's outside of
+    centres = _CENTRES[len(inside)]
+    x = sum(c[0] for c, i in zip(centres, inside) if i) / sum(inside)
+    y = sum(c[1] for c, i in zip(centres, inside) if i) / sum(inside)
+    if not all(inside):
+        out_x = sum(c[0] for c, i in zip(centres, inside) if not i)
+        out_y = sum(c[1] for c, i in zip(centres, inside) if not i)
+        n_out = len(inside) - sum(inside)
+        x += 0.45 * (x - out_x / n_out)
+        y += 0.45 * (y - out_y / n_out)
+    return x, y
+
+
+def venn_diagram(
+    regions: pd.DataFrame, labels: list[str], width: int = 400, height: int = 400
+) -> alt.Chart:
+    # regions has a boolean column for each label along with n_genes, as
+    # returned by GeneSetStore.overlap
+    if len(labels) not in _CENTRES:
+        raise ValueError("Venn diagrams can only be drawn for 2 or 3 gene sets")
+    centres = _CENTRES[len(labels)]
+    x_scale = alt.Scale(domain=[-_EXTENT, _EXTENT])
+    y_scale = alt.Scale(domain=[-_EXTENT, _EXTENT])
+    # Marks are sized in pixels, so find the circle area from the plot size
+    radius_px = min(width, height) / (2 * _EXTENT)
+    circles = pd.DataFrame(
+        {
+            "set": labels,
+            "x": [c[0] for c in centres],
+            "y": [c[1] for c in centres],
+            # Set labels sit just outside of the circles
+            "label_x": [c[0] * 1.6 for c in centres],
+            "label_y": [c[1] * 1.6 + (1.1 if c[1] >= 0 else -1.1) for c in centres],
+        }
+    )
+    counts = pd.DataFrame(
+        [
+            (*_region_position(tuple(bool(row[label]) for label in labels)), n)
+            for row, n in zip(regions.to_dict("records"), regions["n_genes"])
+        ],
+        columns=["x", "y", "n_genes"],
+    )
+    axis = dict(axis=None)
+    base_circles = alt.Chart(circles).encode(
+        x=alt.X("x:Q", scale=x_scale, **axis),
+        y=alt.Y("y:Q", scale=y_scale, **axis),
+    )
+    circle_layer = base_circles.mark_circle(
+        size=math.pi * radius_px**2, opacity=0.3
+    ).encode(
+        color=alt.Color("set:N", legend=None, sort=labels),
+        tooltip=["set:N"],
+    )
+    set_labels = (
+        alt.Chart(circles)
+        .mark_text(fontSize=13, fontWeight="bold", limit=width / 2)
+        .encode(
+            x=alt.X("label_x:Q", scale=x_scale, **axis),
+            y=alt.Y("label_y:Q", scale=y_scale, **axis),
+            text="set:N",
+            color=alt.Color("set:N", legend=None, sort=labels),
+        )
+    )
+    count_labels = (
+        alt.Chart(counts)
+        .mark_text(fontSize=14)
+        .encode(
+            x=alt.X("x:Q", scale=x_scale, **axis),
+            y=alt.Y("y:Q", scale=y_scale, **axis),
+            text="n_genes:Q",
+        )
+    )
+    return (circle_layer + set_labels + count_labels).properties(
+        width=width, height=height
+    ).configure_view(strokeWidth=0)
@@ -5,21 +5,42 @@ Module for creating Volcano Plots with altair
 # Imports
 # Standard Library
 from __future__ import annotations
+import json
+import threading
 
 # External Imports
 import altair as alt
 import ibis
-import vegafusion as vf
+import numpy as np
+import pandas as pd
 
 # Local Imports
 
-# Setup vegafusion
-alt.data_transformers.enable("vegafusion")
+# Data of charts being converted by chart_to_spec, for each thread
+_collected = threading.local()
+
+
+def _named_dataset(data):
+    # Data transformer naming the data of charts converted by chart_to_spec,
+    # and using the default transformer for any other conversion
+    datasets = getattr(_collected, "datasets", None)
+    if datasets is None:
+        return _default_transformer(data)
+    name = f"data_{id(data):x}"
+    datasets[name] = data
+    return {"name": name}
+
+
+# The transformer is enabled once, rather than around each conversion, as
+# other threads (and Streamlit) convert charts at the same time
+_default_transformer = alt.data_transformers.get()
+alt.data_transformers.register("mkview_named_dataset", _named_dataset)
+alt.data_transformers.enable("mkview_named_dataset")
 
 
 # Main Function
 def kinase_volcano_plot(
-    data_table: ibis.Table,
+    data_table: ibis.Table | pd.DataFrame,
     pval_col:str,
     foldchange_col:str,
     locus_col:str,
@@ -29,16 +50,13 @@ def kinase_volcano_plot(
     font_size:int=20,
 )->alt.Chart:
     # Create columns for transformed pvalue, and fold change color
-    plot_data = data_table.mutate(
-        neg_log10_pval = data_table[pval_col].log10().negate(),
-        pos_fold = (data_table[foldchange_col]>0.)
-    )
+    plot_data = _add_volcano_columns(data_table, pval_col, foldchange_col)
 
     # Create brush for selection
     brush = alt.selection_interval()
 
     # Create Scatter Plot
-    scatter = alt.Chart(plot_data).mark_circle().encode(
+    scatter = alt.Chart().mark_circle().encode(
         alt.X(foldchange_col, title="Fold-change (log2)"),
         alt.Y("neg_log10_pval", title="Significance (-log10(p-value))"),
         alt.Color("pos_fold", legend=None),
@@ -52,57 +70,28 @@ def kinase_volcano_plot(
         height=volcano_height
     )
 
-    # Create base for table columns
-    ranked_text = alt.Chart(plot_data).mark_text(align='right', fontSize=font_size).encode(
-        y=alt.Y("row_number:O", axis=None)
-    ).transform_filter(
-        brush
-    ).transform_window(
-        row_number='row_number()'
-    ).transform_filter(
-        'datum.row_number < 30'
-    ).properties(
-        height=volcano_height,
+    # Create the table of the top selected points
+    text = _ranked_table(
+        {
+            "Rv Number": (locus_col, None),
+            "Gene Name": (genename_col, None),
+            "P-value": (pval_col, ".2e"),
+            "Fold-change (log2)": (foldchange_col, ".2f"),
+        },
+        brush,
+        volcano_height,
+        font_size,
     )
 
-    # Create the columns
-    # Locus tag
-    locus = ranked_text.encode(
-        alt.Text(locus_col, type='nominal')
-    ).properties(title=alt.TitleParams(
-        text="Rv Number", align='center', fontSize=30
-    ))
-    # Name
-    name = ranked_text.encode(
-        alt.Text(genename_col, type='nominal')
-    ).properties(title=alt.TitleParams(
-        text="Gene Name", align='center', fontSize=30
-    ))
-    # Fold Change
-    fold_change = ranked_text.encode(
-        alt.Text(foldchange_col, type='nominal', format=".2f")
-    ).properties(title=alt.TitleParams(
-        text="Fold-change (log2)", align='center', fontSize=30
-    ))
-    # P value
-    pval = ranked_text.encode(
-        alt.Text(pval_col, type='nominal', format=".2e")
-    ).properties(title=alt.TitleParams(
-        text="P-value", align='center', fontSize=30
-    ))
-
-    # Combine text into table
-    text = alt.hconcat(locus, name, pval, fold_change)
-
-    # Build final chart
-    volcano_chart = alt.hconcat(scatter, text).resolve_legend(color="independent"
+    # Build final chart, with the data shared by both charts
+    volcano_chart = alt.hconcat(scatter, text, data=plot_data).resolve_legend(color="independent"
     ).configure_view(strokeWidth=0)
 
     return volcano_chart
 
 
 def tf_volcano_plot(
-        data_table:ibis.Table,
+        data_table:ibis.Table | pd.DataFrame,
         pval_col:str,
         foldchange_col:str,
         gene_col:str,
@@ -111,16 +100,13 @@ def tf_volcano_plot(
         font_size:int=20,
 )->alt.Chart:
     # Create columns for transformed pvalue, and fold change color
-    plot_data = data_table.mutate(
-        neg_log10_pval=data_table[pval_col].log10().negate(),
-        pos_fold=(data_table[foldchange_col] > 0.)
-    )
+    plot_data = _add_volcano_columns(data_table, pval_col, foldchange_col)
 
     # Create brush for selection
     brush = alt.selection_interval()
 
     # Create Scatter Plot
-    scatter = alt.Chart(plot_data).mark_circle().encode(
+    scatter = alt.Chart().mark_circle().encode(
         alt.X(foldchange_col, title="Fold-change (log2)"),
         alt.Y("neg_log10_pval", title="Significance (-log10(p-value))"),
         alt.Color("pos_fold", legend=None),
@@ -133,44 +119,20 @@ def tf_volcano_plot(
         height=volcano_height
     )
 
-    # Create base for table columns
-    ranked_text = alt.Chart(plot_data).mark_text(align='right', fontSize=font_size).encode(
-        y=alt.Y("row_number:O", axis=None)
-    ).transform_filter(
-        brush
-    ).transform_window(
-        row_number='row_number()'
-    ).transform_filter(
-        'datum.row_number < 30'
-    ).properties(
-        height=volcano_height,
+    # Create the table of the top selected points
+    text = _ranked_table(
+        {
+            "Rv Number": (gene_col, None),
+            "P-value": (pval_col, ".2e"),
+            "Fold-change (log2)": (foldchange_col, ".2f"),
+        },
+        brush,
+        volcano_height,
+        font_size,
     )
 
-    # Create the columns
-    # Locus tag
-    gene = ranked_text.encode(
-        alt.Text(gene_col, type='nominal')
-    ).properties(title=alt.TitleParams(
-        text="Rv Number", align='center', fontSize=30
-    ))
-    # Fold Change
-    fold_change = ranked_text.encode(
-        alt.Text(foldchange_col, type='nominal', format=".2f")
-    ).properties(title=alt.TitleParams(
-        text="Fold-change (log2)", align='center', fontSize=30
-    ))
-    # P value
-    pval = ranked_text.encode(
-        alt.Text(pval_col, type='nominal', format=".2e")
-    ).properties(title=alt.TitleParams(
-        text="P-value", align='center', fontSize=30
-    ))
-
-    # Combine text into table
-    text = alt.hconcat(gene, pval, fold_change)
-
-    # Build final chart
-    volcano_chart = alt.hconcat(scatter, text).resolve_legend(color="independent"
+    # Build final chart, with the data shared by both charts
+    volcano_chart = alt.hconcat(scatter, text, data=plot_data).resolve_legend(color="independent"
                                                               ).configure_view(strokeWidth=0)
 
     return volcano_chart
@@ -179,4 +141,144 @@ def tf_volcano_plot(
 
 
 
+def kinase_comparison_plot(
+    data_table: pd.DataFrame,
+    locus_col: str,
+    genename_col: str,
+    mutants: tuple[str, str] = ("OE", "LOF"),
+    volcano_width: int = 400,
+    volcano_height: int = 400,
+) -> alt.Chart:
+    # data_table has one row per gene (or site), with fold_change_<mutant>
+    # and pval_<mutant> columns for both of the mutants
+    first, second = mutants
+    plot_data = data_table.assign(
+        **{
+            f"neg_log10_pval_{mutant}": -np.log10(data_table[f"pval_{mutant}"])
+            for mutant in mutants
+        }
+    )
+
+    # Brush shared by all of the views, so selecting points in any of them
+    # highlights the same genes in the others
+    brush = alt.selection_interval(resolve="global")
+
+    tooltip = [alt.Tooltip(locus_col), alt.Tooltip(genename_col)]
+    for mutant in mutants:
+        tooltip += [
+            alt.Tooltip(f"fold_change_{mutant}", format=".2f", title=f"Fold-change (log2) {mutant}"),
+            alt.Tooltip(f"pval_{mutant}", format=".2e", title=f"P-value {mutant}"),
+        ]
+
+    base = alt.Chart().mark_circle().encode(
+        tooltip=tooltip,
+        opacity=alt.condition(brush, alt.value(0.8), alt.value(0.1)),
+        color=alt.condition(brush, alt.value("#4c78a8"), alt.value("lightgray")),
+    ).add_params(brush).properties(
+        width=volcano_width,
+        height=volcano_height,
+    )
+
+    # Volcano plot of each mutant
+    volcanoes = [
+        base.encode(
+            alt.X(f"fold_change_{mutant}:Q", title=f"Fold-change (log2) {mutant}"),
+            alt.Y(f"neg_log10_pval_{mutant}:Q", title=f"Significance (-log10(p-value)) {mutant}"),
+        ).properties(title=mutant)
+        for mutant in mutants
+    ]
+
+    # Fold change of one mutant against the other
+    fold_changes = base.encode(
+        alt.X(f"fold_change_{first}:Q", title=f"Fold-change (log2) {first}"),
+        alt.Y(f"fold_change_{second}:Q", title=f"Fold-change (log2) {second}"),
+    ).properties(title=f"{first} vs {second}")
+
+    comparison_chart = alt.hconcat(*volcanoes, fold_changes, data=plot_data
+    ).configure_view(strokeWidth=0)
+
+    return comparison_chart
+
+
 # Helper Functions
+def chart_to_spec(chart: alt.TopLevelMixin) -> dict:
+    # Convert a chart into a Vega-Lite spec which can be cached, and displayed
+    # with st.vega_lite_chart. The data is kept as DataFrames in the top level
+    # datasets (one per distinct data object) rather than serialized to JSON.
+    # The data transformer and theme are global to the process, so neither is
+    # switched here: the transformer enabled above collects the data into the
+    # datasets of the calling thread, and the chart is converted as a nested
+    # chart (to which no theme is applied).
+    _collected.datasets = {}
+    try:
+        spec = chart.to_dict(context={"top_level": False, "pre_transform": False})
+        spec["$schema"] = alt.SCHEMA_URL
+        spec["datasets"] = _collected.datasets
+    finally:
+        _collected.datasets = None
+    return spec
+
+
+def _ranked_table(
+    columns: dict[str, tuple[str, str | None]],
+    brush: alt.Parameter,
+    height: int,
+    font_size: int,
+    n_rows: int = 30,
+    column_width: int = 240,
+) -> alt.Chart:
+    # Table of the first rows within the brush, as a single text chart: the
+    # brush filter and row numbering are done once, then the columns
+    # (keyed by title, with the field and an optional number format) are
+    # folded into one column of text positioned by the column title
+    titles = list(columns)
+    # The view shares its data with the scatter plot, and calculate and
+    # window transforms write onto the shared rows, so only private fields
+    # are written (the text of each column goes into a _text_ field, and the
+    # title is looked up from the field name once folded into new rows)
+    text_fields = [f"_text_{i}" for i in range(len(titles))]
+    text_exprs = {}
+    for text_field, (field, fmt) in zip(text_fields, columns.values()):
+        value = f"datum[{field!r}]"
+        text = f"format({value}, {fmt!r})" if fmt else f"'' + {value}"
+        text_exprs[text_field] = f"isValid({value}) ? {text} : ''"
+    column_expr = (
+        f"{json.dumps(titles)}[indexof({json.dumps(text_fields)}, datum._field)]"
+    )
+    return alt.Chart().mark_text(align='center', fontSize=font_size).encode(
+        x=alt.X("_column:N", sort=titles, axis=alt.Axis(
+            orient="top", title=None, labelAngle=0, labelFontSize=30,
+            labelLimit=0, domain=False, ticks=False,
+        )),
+        y=alt.Y("_row_number:O", axis=None),
+        text=alt.Text("_value:N"),
+    ).transform_filter(
+        brush
+    ).transform_window(
+        _row_number='row_number()'
+    ).transform_filter(
+        f'datum._row_number < {n_rows}'
+    ).transform_calculate(
+        **text_exprs
+    ).transform_fold(
+        text_fields, as_=["_field", "_value"]
+    ).transform_calculate(
+        _column=column_expr
+    ).properties(
+        width=column_width * len(titles),
+        height=height,
+    )
+
+
+def _add_volcano_columns(
+    data_table: ibis.Table | pd.DataFrame, pval_col: str, foldchange_col: str
+) -> ibis.Table | pd.DataFrame:
+    if isinstance(data_table, pd.DataFrame):
+        return data_table.assign(
+            neg_log10_pval=-np.log10(data_table[pval_col]),
+            pos_fold=data_table[foldchange_col] > 0.0,
+        )
+    return data_table.mutate(
+        neg_log10_pval=data_table[pval_col].log10().negate(),
+        pos_fold=(data_table[foldchange_col] > 0.0),
+    )
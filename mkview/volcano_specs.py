@@ -0,0 +1,283 @@
+"""
+Module for building the volcano plot specs shown on the STPK and TF pages,
+with the query results and specs cached so they can be shared between
+sessions (and warmed ahead of time)
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+import functools
+from typing import Callable
+
+# External Imports
+import ibis
+
+# Local Imports
+from .catalog import get_catalog
+from .database import data_version
+from .result_cache import chart_specs, execute_cached
+from .spec_store import read_prerendered_spec, spec_name
+from .volcano_plot_functions import (
+    chart_to_spec,
+    kinase_comparison_plot,
+    kinase_volcano_plot,
+    tf_volcano_plot,
+)
+
+MUTANT_SELECTIONS = {
+    "OE": ["OE"],
+    "LOF": ["LOF"],
+    "Both": ["OE", "LOF"],
+}
+
+# Tables the volcano plot specs are built from, a change to any of them
+# invalidates pre-rendered specs
+VOLCANO_SOURCE_TABLES = [
+    "all_phosphosites",
+    "all_kinase_diff_genes",
+    "gene_info",
+    "tfoe",
+]
+
+# Mutants compared against each other in the comparison view
+COMPARISON_MUTANTS = ("OE", "LOF")
+
+# Columns used for the volcano plots of each of the kinase datasets, along
+# with the columns identifying a record of one mutant of a kinase (id_cols)
+KINASE_VOLCANO_COLUMNS = {
+    "phosphosites": {
+        "foldchange_col": "Fold-change (log2)",
+        "pval_col": "p-value",
+        "locus_col": "Rv Number",
+        "genename_col": "Gene Name",
+        "id_cols": ["Rv Number", "Site"],
+    },
+    "gene_expression": {
+        "foldchange_col": "Fold-change (log2)",
+        "pval_col": "p-value",
+        "locus_col": "DEG",
+        "genename_col": "Name",
+        "id_cols": ["DEG"],
+    },
+}
+
+
+def kinase_dataset_table(con: ibis.BaseBackend, dataset: str) -> ibis.Table:
+    catalog = get_catalog(con)
+    if dataset == "phosphosites":
+        return catalog.table("all_phosphosites")
+    elif dataset == "gene_expression":
+        # The join is built once per catalog, so reruns of a page section
+        # reuse the same expression (and its cache keys)
+        def build():
+            deg_table = catalog.table("all_kinase_diff_genes")
+            gene_info_table = catalog.table("gene_info")
+            return deg_table.left_join(
+                gene_info_table.select("gene", "Name"),
+                deg_table["DEG"] == gene_info_table["gene"],
+            )
+
+        return catalog.derived_table("kinase_gene_expression", build)
+    else:
+        raise ValueError(f"Invalid kinase dataset: {dataset}")
+
+
+def kinase_volcano_query(
+    con: ibis.BaseBackend, dataset: str, stpk: str, mutants: list[str]
+) -> ibis.Table:
+    data_table = kinase_dataset_table(con, dataset)
+    return data_table.filter(
+        (data_table["STPK"] == stpk) & (data_table["Mutant"].isin(mutants))
+    )
+
+
+def kinase_comparison_query(
+    con: ibis.BaseBackend, dataset: str, stpk: str
+) -> ibis.Table:
+    # Pivot the mutants into columns, so each gene (or site) has the fold
+    # change and p-value of both mutants in one row. Both values of a mutant
+    # come from the same record, the most significant one if a gene (or
+    # site) has several.
+    columns = KINASE_VOLCANO_COLUMNS[dataset]
+    data_table = kinase_dataset_table(con, dataset)
+    data_table = data_table.filter(
+        (data_table["STPK"] == stpk)
+        & (data_table["Mutant"].isin(COMPARISON_MUTANTS))
+    )
+    fold_change = data_table[columns["foldchange_col"]]
+    pval = data_table[columns["pval_col"]]
+    values = {}
+    for mutant in COMPARISON_MUTANTS:
+        is_mutant = (data_table["Mutant"] == mutant) & pval.notnull()
+        values[f"fold_change_{mutant}"] = fold_change.argmin(pval, where=is_mutant)
+        values[f"pval_{mutant}"] = pval.min(where=is_mutant)
+    id_cols = columns["id_cols"]
+    if columns["genename_col"] not in id_cols:
+        values[columns["genename_col"]] = data_table[columns["genename_col"]].min()
+    return data_table.group_by(id_cols).aggregate(**values)
+
+
+def tf_volcano_query(con: ibis.BaseBackend, tf: str) -> ibis.Table:
+    tfoe_table = get_catalog(con).table("tfoe")
+    return tfoe_table.filter(tfoe_table["TF"] == tf)
+
+
+def build_kinase_volcano_spec(
+    con: ibis.BaseBackend,
+    dataset: str,
+    stpk: str,
+    mutants: list[str],
+    volcano_width: int = 600,
+    volcano_height: int = 600,
+) -> dict:
+    columns = KINASE_VOLCANO_COLUMNS[dataset]
+    return chart_to_spec(
+        kinase_volcano_plot(
+            data_table=execute_cached(
+                con, kinase_volcano_query(con, dataset, stpk, mutants)
+            ),
+            volcano_width=volcano_width,
+            volcano_height=volcano_height,
+            foldchange_col=columns["foldchange_col"],
+            pval_col=columns["pval_col"],
+            locus_col=columns["locus_col"],
+            genename_col=columns["genename_col"],
+        )
+    )
+
+
+def build_kinase_comparison_spec(
+    con: ibis.BaseBackend,
+    dataset: str,
+    stpk: str,
+    volcano_width: int = 400,
+    volcano_height: int = 400,
+) -> dict:
+    columns = KINASE_VOLCANO_COLUMNS[dataset]
+    return chart_to_spec(
+        kinase_comparison_plot(
+            data_table=execute_cached(
+                con, kinase_comparison_query(con, dataset, stpk)
+            ),
+            locus_col=columns["locus_col"],
+            genename_col=columns["genename_col"],
+            mutants=COMPARISON_MUTANTS,
+            volcano_width=volcano_width,
+            volcano_height=volcano_height,
+        )
+    )
+
+
+def build_tf_volcano_spec(
+    con: ibis.BaseBackend,
+    tf: str,
+    volcano_width: int = 600,
+    volcano_height: int = 600,
+) -> dict:
+    return chart_to_spec(
+        tf_volcano_plot(
+            data_table=execute_cached(con, tf_volcano_query(con, tf)),
+            foldchange_col="fold_change",
+            pval_col="p_value",
+            gene_col="Gene",
+            volcano_width=volcano_width,
+            volcano_height=volcano_height,
+        )
+    )
+
+
+# Parameters identifying each spec, used for both the in-memory cache key
+# and the file name of the pre-rendered spec
+def _kinase_volcano_params(dataset, stpk, mutants, volcano_width, volcano_height):
+    return ("kinase_volcano", dataset, stpk, "+".join(mutants), volcano_width, volcano_height)
+
+
+def _kinase_comparison_params(dataset, stpk, volcano_width, volcano_height):
+    return ("kinase_comparison", dataset, stpk, volcano_width, volcano_height)
+
+
+def _tf_volcano_params(tf, volcano_width, volcano_height):
+    return ("tf_volcano", tf, volcano_width, volcano_height)
+
+
+def _cached_spec(
+    con: ibis.BaseBackend, params: tuple, build: Callable[[], dict]
+) -> dict:
+    # Specs are served from the in-memory cache, then from the pre-rendered
+    # specs on disk (for the default parameters), and only built live when
+    # neither has them
+    def compute():
+        spec = read_prerendered_spec(con, spec_name(*params))
+        return spec if spec is not None else build()
+
+    return chart_specs.get_or_compute((data_version(con), *params), compute)
+
+
+def kinase_volcano_spec(
+    con: ibis.BaseBackend,
+    dataset: str,
+    stpk: str,
+    mutants: list[str],
+    volcano_width: int = 600,
+    volcano_height: int = 600,
+) -> dict:
+    return _cached_spec(
+        con,
+        _kinase_volcano_params(dataset, stpk, mutants, volcano_width, volcano_height),
+        lambda: build_kinase_volcano_spec(
+            con, dataset, stpk, mutants, volcano_width, volcano_height
+        ),
+    )
+
+
+def kinase_comparison_spec(
+    con: ibis.BaseBackend,
+    dataset: str,
+    stpk: str,
+    volcano_width: int = 400,
+    volcano_height: int = 400,
+) -> dict:
+    return _cached_spec(
+        con,
+        _kinase_comparison_params(dataset, stpk, volcano_width, volcano_height),
+        lambda: build_kinase_comparison_spec(
+            con, dataset, stpk, volcano_width, volcano_height
+        ),
+    )
+
+
+def tf_volcano_spec(
+    con: ibis.BaseBackend,
+    tf: str,
+    volcano_width: int = 600,
+    volcano_height: int = 600,
+) -> dict:
+    return _cached_spec(
+        con,
+        _tf_volcano_params(tf, volcano_width, volcano_height),
+        lambda: build_tf_volcano_spec(con, tf, volcano_width, volcano_height),
+    )
+
+
+def fixed_volcano_specs(
+    con: ibis.BaseBackend, stpk_list: list[str], tf_list: list[str]
+) -> dict[str, Callable[[], dict]]:
+    # Every spec the pages can show with the default sizes, as functions
+    # building each one live, keyed by its file name
+    specs = {}
+    for dataset in KINASE_VOLCANO_COLUMNS:
+        for stpk in stpk_list:
+            for mutants in MUTANT_SELECTIONS.values():
+                name = spec_name(*_kinase_volcano_params(dataset, stpk, mutants, 600, 600))
+                specs[name] = functools.partial(
+                    build_kinase_volcano_spec, con, dataset, stpk, mutants
+                )
+            name = spec_name(*_kinase_comparison_params(dataset, stpk, 400, 400))
+            specs[name] = functools.partial(
+                build_kinase_comparison_spec, con, dataset, stpk
+            )
+    for tf in tf_list:
+        name = spec_name(*_tf_volcano_params(tf, 600, 600))
+        specs[name] = functools.partial(build_tf_volcano_spec, con, tf)
+    return specs
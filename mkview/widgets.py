@@ -0,0 +1,51 @@
+"""
+Module for input widgets shared by several pages
+"""
+
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+
+# External Imports
+import streamlit as st
+
+# Local Imports
+from .gene_search import GeneSearchIndex, MAX_RESULTS
+
+
+def gene_selector(
+    label: str,
+    index: GeneSearchIndex,
+    key: str,
+    max_results: int = MAX_RESULTS,
+) -> list[str]:
+    # Multiselect of genes whose choices are the best matches for a search
+    # (along with the genes already selected) rather than every gene, so only
+    # a few choices are sent to the browser on each run. The selection is kept
+    # in the session state under key, as the choices (and so the multiselect)
+    # change with the search.
+    if key not in st.session_state:
+        st.session_state[key] = []
+    # Genes missing from the index (after the data is updated) are dropped
+    selected = [gene for gene in st.session_state[key] if gene in index]
+    query = st.text_input(
+        "Search genes by locus tag, name or synonym:",
+        key=f"{key}_query",
+        placeholder="e.g. Rv0001 or dnaA",
+    )
+    matches = index.search(query, k=max_results)
+    options = selected + [gene for gene in matches if gene not in selected]
+    selected = st.multiselect(
+        label,
+        options,
+        default=selected,
+        format_func=index.label,
+        key=f"{key}_choices",
+        placeholder=(
+            f"Choose from the {len(matches)} best matches"
+            if query
+            else "Search above, or choose from the first genes"
+        ),
+    )
+    st.session_state[key] = selected
+    return selected
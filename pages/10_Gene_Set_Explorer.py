@@ -0,0 +1,146 @@
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+# External Imports
+import streamlit as st
+
+# Local imports
+import mkview
+
+# Setup/Data Reading
+# Streamlit setup
+st.set_page_config(layout="wide")
+# Profile the run when enabled, or when requested with ?profile=1 and
+# MKVIEW_PROFILE=request allows it (see mkview.profiling)
+mkview.profile_page_run(requested=st.query_params.get("profile") == "1")
+
+
+# Connect to database
+@st.cache_resource
+def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
+    md_token = st.secrets["MD_TOKEN"]
+    return mkview.connect(md_token=md_token)
+
+
+md_con = get_database_connection()
+mkview.refresh_replica(md_con)
+
+
+# Regulator lists from the catalog (loaded once per process), used for the
+# example expressions
+catalog = mkview.get_catalog(md_con)
+EXAMPLE_STPK = catalog.stpk_list[0] if catalog.stpk_list else "PknB"
+EXAMPLE_TF = catalog.tf_list[0] if catalog.tf_list else "Rv0081"
+
+# Start of Page
+st.title("Gene Set Explorer")
+st.markdown(
+    f"""
+    Welcome to the Gene Set Explorer! This tool combines the target sets of the transcription factors (their
+    regulons in the TF overexpression data, Rustad et al., 2014) and STPK mutants (their differentially expressed
+    genes and differentially phosphorylated proteins, Frando et al., 2023) to answer questions like "which genes
+    are regulated by both a kinase and a transcription factor?"
+
+    Each gene set is written as an expression combining named sets:
+    - Sets are named `SOURCE:REGULATOR:MUTANT`, where the source is `TF` (transcription factor regulons),
+    `DEG` (differentially expressed genes of an STPK mutant) or `PHOS` (differentially phosphorylated proteins
+    of an STPK mutant). TFs have no mutant (e.g. `TF:{EXAMPLE_TF}`), and leaving the mutant off an STPK combines
+    its OE and LOF mutants (e.g. `DEG:{EXAMPLE_STPK}`). `ALL` is every gene.
+    - `&` keeps genes in both sets, `|` keeps genes in either set, and `-` keeps genes in the first set but
+    not the second. `&` and `-` are applied before `|`, and parentheses can be used to group.
+
+    For example, `PHOS:{EXAMPLE_STPK}:OE - DEG:{EXAMPLE_STPK}` is the proteins differentially phosphorylated in
+    the {EXAMPLE_STPK} overexpression mutant whose genes aren't differentially expressed in either mutant.
+    Entering two or three gene sets shows how they overlap.
+    """
+)
+
+set_pval_cutoff = st.selectbox(
+    "p-value cutoff for the target sets", options=mkview.PVAL_CUTOFFS, index=0
+)
+set_fold_change = st.selectbox(
+    "Fold change threshold (log2) for the target sets",
+    options=(0.0, *mkview.FOLD_CHANGE_THRESHOLDS),
+    index=1,
+)
+
+store = mkview.get_gene_set_store(md_con, set_pval_cutoff, set_fold_change)
+
+with st.expander("Available gene sets"):
+    st.dataframe(
+        {
+            "Gene Set": store.names,
+            "Genes": [store.count(bits) for bits in store.bits],
+        },
+        use_container_width=True,
+        hide_index=True,
+    )
+
+expression_inputs = [
+    st.text_input("Gene set A", value=f"DEG:{EXAMPLE_STPK}:LOF"),
+    st.text_input("Gene set B", value=f"TF:{EXAMPLE_TF}"),
+    st.text_input("Gene set C (optional)", value=""),
+]
+# Repeated expressions are only shown once
+expressions = list(dict.fromkeys(e.strip() for e in expression_inputs if e.strip()))
+
+valid_expressions = []
+for expression in expressions:
+    try:
+        store.evaluate(expression)
+        valid_expressions.append(expression)
+    except ValueError as e:
+        st.error(f"Invalid gene set {expression!r}: {e}")
+
+if len(valid_expressions) == 1:
+    selected = store.select(valid_expressions[0])
+    st.header(f"{valid_expressions[0]} ({len(selected)} genes)")
+    st.dataframe({"Gene": selected}, use_container_width=True, hide_index=True)
+elif len(valid_expressions) > 1:
+    regions = store.overlap(valid_expressions)
+    st.header("Overlap")
+    venn_column, table_column = st.columns([1, 2])
+    with venn_column:
+        st.vega_lite_chart(
+            mkview.chart_to_spec(mkview.venn_diagram(regions, valid_expressions)),
+            use_container_width=False,
+        )
+    with table_column:
+        st.dataframe(
+            regions,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "n_genes": "Genes",
+                "genes": st.column_config.TextColumn(
+                    "Genes in Region", width="large"
+                ),
+            },
+        )
+        st.download_button(
+            "Download overlap csv",
+            regions.to_csv(index=False),
+            mime="text/csv",
+            file_name="gene_set_overlap.csv",
+        )
+
+st.markdown(
+    """
+    ## Sources:
+    -  [Frando A, Boradia V, Gritsenko M, Beltejar C, Day L, Sherman DR, Ma S, Jacobs JM, Grundner C. The Mycobacterium
+    tuberculosis protein O-phosphorylation landscape. Nat Microbiol. 2023 Mar;8(3):548-561. doi: 10.1038/s41564-022-01313-7.
+    Epub 2023 Jan 23. PMID: 36690861.](https://doi.org/10.1038/s41564-022-01313-7)
+    - [Rustad TR, Minch KJ, Ma S, Winkler JK, Hobbs S, Hickey M, Brabant W, Turkarslan S, Price ND, Baliga NS,
+    Sherman DR. Mapping and manipulating the Mycobacterium tuberculosis transcriptome using a transcription factor
+    overexpression-derived regulatory network. Genome Biol. 2014;15(11):502. doi: 10.1186/PREACCEPT-1701638048134699.
+    PMID: 25380655; PMCID: PMC4249609.](https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4249609/)
+    """
+)
+
+st.link_button(
+    label="Github Repository",
+    url="https://github.com/Ma-Lab-Seattle-Childrens-CGIDR/mkviewer_st",
+)
@@ -1,17 +1,20 @@
 # Imports
 # Standard Library Imports
 from __future__ import annotations
-import json
-
 # External Imports
-import ibis
 import streamlit as st
 
 # Local imports
+import mkview
 
 # Setup/Data Reading
 # Streamlit setup
 st.set_page_config(layout="wide")
+# Profile the run (and the reruns of the fragments) when enabled, or when
+# requested with ?profile=1 and MKVIEW_PROFILE=request allows it (see
+# mkview.profiling)
+PROFILE_REQUESTED = st.query_params.get("profile") == "1"
+mkview.profile_page_run(requested=PROFILE_REQUESTED)
 
 if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False
@@ -20,25 +23,43 @@ if "form_submitted" not in st.session_state:
 # Connect to database
 @st.cache_resource
 def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
     md_token = st.secrets["MD_TOKEN"]
-    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+    return mkview.connect(md_token=md_token)
 
 
 md_con = get_database_connection()
-
-
-@st.cache_data
-def get_gene_list():
-    with open("./data/gene_list.json") as f:
-        gene_list = json.load(f)
-    return gene_list
-
-
-GENE_LIST = get_gene_list()
-
-expression_table = md_con.table("gene_expression_compendia_unpivoted")
-meta_table = md_con.table("gene_expression_metadata")
-gene_info_table = md_con.table("gene_info")
+mkview.refresh_replica(md_con)
+
+
+# Tables from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+# Genes are chosen by searching an index of their locus tags, names and
+# synonyms, so the full gene list isn't sent to the browser
+GENE_INDEX = mkview.get_gene_search_index(md_con, "gene_list")
+
+expression_table = catalog.table("gene_expression_compendia_unpivoted")
+meta_table = catalog.table("gene_expression_metadata")
+gene_info_table = catalog.table("gene_info")
+
+ENRICHMENT_COLUMN_CONFIG = {
+    "source": "Target Set",
+    "regulator": "Regulator",
+    "mutant": "Mutant",
+    "set_size": "Targets",
+    "overlap": "Selected Targets",
+    "expected": st.column_config.NumberColumn("Expected", format="%.2f"),
+    "fold_enrichment": st.column_config.NumberColumn(
+        "Fold Enrichment", format="%.2f"
+    ),
+    "p_value": st.column_config.NumberColumn("p-value", format="%.2e"),
+    "q_value": st.column_config.NumberColumn(
+        "q-value (BH)", format="%.2e", help="Benjamini-Hochberg adjusted p-value"
+    ),
+    "overlap_genes": "Selected Genes in the Target Set",
+}
 
 # Start of Page
 st.title("Gene Expression Compendia Viewer")
@@ -66,7 +87,12 @@ st.markdown(
 )
 
 
-selected_genes = st.multiselect("Select genes of interest:", GENE_LIST, default=None)
+# The selected genes and bounds are shared by several sections, the rest of
+# the page is split into fragments so changing the inputs of one section only
+# reruns that section
+selected_genes = mkview.gene_selector(
+    "Select genes of interest:", GENE_INDEX, key="compendia_genes"
+)
 
 pos_bound = st.number_input(
     "Choose a positive bound (selecting conditions of interest with log2(fold-change) above this bound)",
@@ -86,14 +112,47 @@ def submit_button_clicked():
     st.session_state.form_submitted = True
 
 
-st.button("Submit", on_click=submit_button_clicked)
-
-
-def display_table(container):
-    if not selected_genes:
-        return None
+DISPLAY_COLUMNS = [
+    "Gene",
+    "sample",
+    "condition",
+    "fold_change_log2_tpm",
+    "project",
+    "ReleaseDate",
+    "reference_condition",
+    "SRAStudy",
+    "DOI",
+    "pubmed_link",
+]
+
+
+def fetch_compendia(genes, pos_bound, neg_bound):
+    # Read the rows for the selected genes from the memory-mapped matrix when
+    # one has been built, joining on the (cached) metadata and gene info
+    matrix = mkview.get_compendia_matrix(md_con)
+    if matrix is not None:
+        filtered_df = (
+            matrix.lookup(genes, pos_bound, neg_bound)
+            .merge(
+                mkview.execute_cached(md_con, meta_table),
+                how="left",
+                left_on="sample",
+                right_on="sample_id",
+            )
+            .merge(
+                mkview.execute_cached(md_con, gene_info_table),
+                how="left",
+                left_on="Gene",
+                right_on="gene",
+            )
+        )
+        yield mkview.ProgressiveResult(
+            frame=filtered_df, complete=True, n_rows=len(filtered_df)
+        )
+        return
+    # Otherwise the first rows of the query are shown while it runs
     filtered_table = (
-        expression_table.filter(expression_table["Gene"].isin(selected_genes))
+        expression_table.filter(expression_table["Gene"].isin(genes))
         .filter(
             (expression_table["fold_change_log2_tpm"] >= pos_bound)
             | (expression_table["fold_change_log2_tpm"] <= neg_bound)
@@ -101,53 +160,249 @@ def display_table(container):
         .left_join(meta_table, meta_table["sample_id"] == expression_table["sample"])
         .left_join(gene_info_table, expression_table["Gene"] == gene_info_table["gene"])
     )
-    display_table = filtered_table.select(
-        "Gene",
-        "sample",
-        "condition",
-        "fold_change_log2_tpm",
-        "project",
-        "ReleaseDate",
-        "reference_condition",
-        "SRAStudy",
-        "DOI",
-        "pubmed_link",
+    yield from mkview.fetch_progressive(md_con, filtered_table)
+
+
+def display_table(container, selected_genes, pos_bound, neg_bound):
+    if not selected_genes:
+        return None
+    # A preview (with an estimated row count) is replaced by the full table
+    # once it has loaded
+    for result in fetch_compendia(selected_genes, pos_bound, neg_bound):
+        filtered_df = result.frame
+        with container.container():
+            if not result.complete:
+                st.caption(result.progress_text())
+            st.dataframe(
+                filtered_df[DISPLAY_COLUMNS],
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "pubmed_link": st.column_config.LinkColumn(
+                        "Pubmed",
+                        help="Link to associated paper on pubmed",
+                        validate=r"^https://pubmed.ncbi.nlm.nih.gov/\d+/",
+                        max_chars=100,
+                        display_text=r"^https://pubmed.ncbi.nlm.nih.gov/(\d+)/",
+                    ),
+                    "DOI": st.column_config.LinkColumn(
+                        "DOI",
+                        help="DOI link to associated paper",
+                        validate=r"^https://dx.doi.org/.+",
+                        width="medium",
+                    ),
+                    "fold_change_log2_tpm": "Fold Change (log2(tpm))",
+                },
+            )
+            if result.complete:
+                st.download_button(
+                    "Download full csv",
+                    filtered_df.to_csv(),
+                    mime="text/csv",
+                    file_name="filtered_gene_info.csv",
+                )
+    st.session_state.form_submitted = False
+
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def table_section(selected_genes, pos_bound, neg_bound):
+    st.button("Submit", on_click=submit_button_clicked)
+
+    c = st.empty()
+
+    if st.session_state.form_submitted:
+        display_table(c, selected_genes, pos_bound, neg_bound)
+
+
+table_section(selected_genes, pos_bound, neg_bound)
+
+# Distribution section
+st.header("Fold Change Distribution")
+st.markdown(
+    """
+    See where the conditions past the bounds fall in the distribution of a selected gene's fold changes across
+    all of the samples in the compendia, optionally split by the project or condition of the samples (the
+    largest groups are shown, with the rest combined).
+    """
+)
+
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def distribution_section(selected_genes, pos_bound, neg_bound):
+    if not selected_genes:
+        st.caption("Select genes of interest above to see their distributions.")
+        return None
+    distribution_gene = st.selectbox(
+        "Gene", options=selected_genes, index=0, key="distribution_gene"
+    )
+    group_column, kind_column, bin_column = st.columns(3)
+    with group_column:
+        group_by = st.radio(
+            "Group samples by",
+            [None, *mkview.DISTRIBUTION_GROUPS],
+            format_func=lambda g: mkview.DISTRIBUTION_GROUPS.get(g, "None"),
+            key="distribution_group",
+        )
+    with kind_column:
+        kind = st.radio(
+            "Plot",
+            ["histogram", "ecdf"],
+            format_func={"histogram": "Histogram", "ecdf": "ECDF"}.get,
+            key="distribution_kind",
+        )
+    with bin_column:
+        bin_width = st.selectbox(
+            "Bin width (log2)",
+            options=mkview.BIN_WIDTHS,
+            index=1,
+            key="distribution_bin_width",
+        )
+    bins = mkview.get_fold_change_distribution(
+        md_con, distribution_gene, group_by, bin_width
+    )
+    st.vega_lite_chart(
+        mkview.chart_to_spec(
+            mkview.fold_change_distribution_plot(
+                bins, kind=kind, neg_bound=neg_bound, pos_bound=pos_bound
+            )
+        ),
+        use_container_width=True,
     )
 
-    st.dataframe(
-        display_table.to_pandas(),
+
+distribution_section(selected_genes, pos_bound, neg_bound)
+
+# Co-expression section
+st.header("Co-expression")
+st.markdown(
+    f"""
+    Find the genes whose expression is most correlated with a gene of interest across all of the conditions in
+    the compendia. If multiple genes are selected, genes are compared against the average expression profile
+    of the selected genes. Optionally, genes with strongly negative correlations can also be included.
+    Missing measurements are filled in with the average of each gene, which pulls the correlations of genes
+    sharing few samples with the query towards zero, and genes measured in fewer than
+    {mkview.coexpression.MIN_SAMPLES} samples are left out.
+    """
+)
+
+if "coexpression_submitted" not in st.session_state:
+    st.session_state.coexpression_submitted = False
+
+
+def coexpression_submit_clicked():
+    st.session_state.coexpression_submitted = True
+
+
+def display_coexpression_table(
+    container, coexpression_genes, n_neighbors, include_anticorrelated
+):
+    if not coexpression_genes:
+        return None
+    engine = mkview.get_coexpression_engine(md_con)
+    neighbors = engine.top_neighbors(
+        coexpression_genes,
+        k=int(n_neighbors),
+        absolute=include_anticorrelated,
+    )
+    gene_names = mkview.execute_cached(md_con, gene_info_table.select("gene", "Name"))
+    neighbors = neighbors.merge(
+        gene_names, how="left", left_on="Gene", right_on="gene"
+    ).drop(columns="gene")
+    container.dataframe(
+        neighbors[["Gene", "Name", "correlation", "n_samples"]],
         use_container_width=True,
         hide_index=True,
         column_config={
-            "pubmed_link": st.column_config.LinkColumn(
-                "Pubmed",
-                help="Link to associated paper on pubmed",
-                validate=r"^https://pubmed.ncbi.nlm.nih.gov/\d+/",
-                max_chars=100,
-                display_text=r"^https://pubmed.ncbi.nlm.nih.gov/(\d+)/",
-            ),
-            "DOI": st.column_config.LinkColumn(
-                "DOI",
-                help="DOI link to associated paper",
-                validate=r"^https://dx.doi.org/.+",
-                width="medium",
+            "correlation": st.column_config.NumberColumn(
+                "Correlation", format="%.3f"
             ),
-            "fold_change_log2_tpm": "Fold Change (log2(tpm))",
+            "n_samples": "Samples",
         },
     )
-    st.download_button(
-        "Download full csv",
-        filtered_table.to_pandas().to_csv(),
-        mime="text/csv",
-        file_name="filtered_gene_info.csv",
+    st.session_state.coexpression_submitted = False
+
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def coexpression_section():
+    coexpression_genes = mkview.gene_selector(
+        "Select query gene(s):", GENE_INDEX, key="coexpression_genes"
     )
-    st.session_state.form_submitted = False
 
+    n_neighbors = st.number_input(
+        "Number of co-expressed genes to show", value=25, min_value=1, max_value=500
+    )
+
+    include_anticorrelated = st.checkbox(
+        "Include anti-correlated genes (rank by absolute correlation)"
+    )
+
+    st.button(
+        "Submit", on_click=coexpression_submit_clicked, key="coexpression_submit"
+    )
+
+    coexpression_container = st.empty()
+
+    if st.session_state.coexpression_submitted:
+        display_coexpression_table(
+            coexpression_container,
+            coexpression_genes,
+            n_neighbors,
+            include_anticorrelated,
+        )
+
+
+coexpression_section()
+
+# Enrichment section
+st.header("Regulator Enrichment")
+st.markdown(
+    """
+    Test the selected genes of interest for enrichment in the targets of every transcription factor (its regulon
+    in the TF overexpression data, Rustad et al., 2014) and every STPK mutant (its differentially expressed genes
+    and differentially phosphorylated proteins, Frando et al., 2023), using hypergeometric tests. The q-values
+    are adjusted for testing every regulator with the Benjamini-Hochberg procedure.
+    """
+)
+
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def enrichment_section(selected_genes):
+    enrichment_pval_cutoff = st.selectbox(
+        "p-value cutoff for the target sets",
+        options=mkview.PVAL_CUTOFFS,
+        index=0,
+        key="enrichment_pval_cutoff",
+    )
+    enrichment_fold_change = st.selectbox(
+        "Fold change threshold (log2) for the target sets",
+        options=mkview.FOLD_CHANGE_THRESHOLDS,
+        index=0,
+        key="enrichment_fold_change",
+    )
+
+    if selected_genes:
+        enrichment = mkview.regulator_enrichment(
+            md_con,
+            selected_genes,
+            pval_cutoff=enrichment_pval_cutoff,
+            fold_change_threshold=enrichment_fold_change,
+            sources=None,
+        )
+        st.dataframe(
+            enrichment,
+            use_container_width=True,
+            hide_index=True,
+            column_config=ENRICHMENT_COLUMN_CONFIG,
+        )
+    else:
+        st.caption("Select genes of interest above to test them for enrichment.")
 
-c = st.empty()
 
-if st.session_state.form_submitted:
-    display_table(c)
+enrichment_section(selected_genes)
 
 st.markdown(
     """
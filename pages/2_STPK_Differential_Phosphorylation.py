@@ -3,7 +3,6 @@
 from __future__ import annotations
 
 # External Imports
-import ibis
 import streamlit as st
 
 # Local imports
@@ -12,33 +11,38 @@ import mkview
 # Setup/Data Reading
 # Streamlit setup
 st.set_page_config(layout="wide")
+# Profile the run (and the reruns of the fragments) when enabled, or when
+# requested with ?profile=1 and MKVIEW_PROFILE=request allows it (see
+# mkview.profiling)
+PROFILE_REQUESTED = st.query_params.get("profile") == "1"
+mkview.profile_page_run(requested=PROFILE_REQUESTED)
 
 if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False
 
 
 # Connect to database
+def create_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
+    md_token = st.secrets["MD_TOKEN"]
+    return mkview.connect(md_token=md_token)
+
+
 @st.cache_resource
 def get_database_connection():
-    md_token = st.secrets["MD_TOKEN"]
-    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+    return create_database_connection()
 
 
 md_con = get_database_connection()
-phospho_table = md_con.table("all_phosphosites")
-
-STPK_LIST = [
-    "PknB",
-    "PknD",
-    "PknE",
-    "PknF",
-    "PknG",
-    "PknH",
-    "PknI",
-    "PknJ",
-    "PknK",
-    "PknL",
-]
+mkview.refresh_replica(md_con)
+
+# Warm the volcano plot caches in the background (once per process)
+mkview.start_cache_warmer(create_database_connection)
+phospho_table = mkview.kinase_dataset_table(md_con, "phosphosites")
+
+STPK_LIST = mkview.get_catalog(md_con).stpk_list
 
 # Start of page
 st.title("Serine Threonine Protein Kinase Differential Phosphorylation")
@@ -66,54 +70,41 @@ st.markdown(
     """
 )
 
+# Each section of the page is a fragment, so changing the inputs of one
+# section only reruns that section (the volcano plot isn't redrawn when the
+# table inputs change, and the other way around)
 st.header("Volcano Plot")
 
-# Select kinase, and which type of mutant is desired
-stpk_selected = st.selectbox(
-    "Select which STPK you want to view differential phosphorylation for:",
-    options=STPK_LIST,
-    index=None,
-)
-
-# Select Mutant
-mutant_selected = st.radio(
-    "Select which mutant of the STPK you want to view differential phosphorylation for:",
-    ["OE", "LOF", "Both"],
-)
-
-mutant_selected_list = []
-if mutant_selected == "OE":
-    mutant_selected_list += ["OE"]
-elif mutant_selected == "LOF":
-    mutant_selected_list += ["LOF"]
-elif mutant_selected == "Both":
-    mutant_selected_list += ["OE", "LOF"]
-else:
-    raise ValueError("Invalid Mutant Value Selected")
-
 
 # Submit button
 def submit_button_clicked():
     st.session_state.form_submitted = True
 
 
-st.button("Submit", on_click=submit_button_clicked)
-
-
-def display_volcano_chart(container):
+def display_volcano_chart(
+    container, stpk_selected, mutant_selected_list, compare_mutants
+):
     if stpk_selected is None:
         return None
-    filtered_table = phospho_table.filter(
-        (phospho_table["STPK"] == stpk_selected)
-        & (phospho_table["Mutant"].isin(mutant_selected_list))
-    )
-    container.altair_chart(
-        mkview.kinase_volcano_plot(
-            data_table=filtered_table,
-            foldchange_col="Fold-change (log2)",
-            pval_col="p-value",
-            locus_col="Rv Number",
-            genename_col="Gene Name",
+    if compare_mutants:
+        container.vega_lite_chart(
+            mkview.kinase_comparison_spec(
+                md_con,
+                dataset="phosphosites",
+                stpk=stpk_selected,
+                volcano_width=400,
+                volcano_height=400,
+            ),
+            use_container_width=True,
+        )
+        st.session_state.form_submitted = False
+        return None
+    container.vega_lite_chart(
+        mkview.kinase_volcano_spec(
+            md_con,
+            dataset="phosphosites",
+            stpk=stpk_selected,
+            mutants=mutant_selected_list,
             volcano_width=600,
             volcano_height=600,
         ),
@@ -122,10 +113,47 @@ def display_volcano_chart(container):
     st.session_state.form_submitted = False
 
 
-c = st.empty()
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def volcano_section():
+    # Select kinase, and which type of mutant is desired
+    stpk_selected = st.selectbox(
+        "Select which STPK you want to view differential phosphorylation for:",
+        options=STPK_LIST,
+        index=None,
+    )
+
+    # Select Mutant
+    mutant_selected = st.radio(
+        "Select which mutant of the STPK you want to view differential phosphorylation for:",
+        ["OE", "LOF", "Both"],
+    )
+
+    mutant_selected_list = []
+    if mutant_selected == "OE":
+        mutant_selected_list += ["OE"]
+    elif mutant_selected == "LOF":
+        mutant_selected_list += ["LOF"]
+    elif mutant_selected == "Both":
+        mutant_selected_list += ["OE", "LOF"]
+    else:
+        raise ValueError("Invalid Mutant Value Selected")
+
+    # Comparison mode, showing both mutants side by side
+    compare_mutants = st.checkbox(
+        "Compare the OE and LOF mutants (volcano plots of each mutant, and the fold-change of OE against LOF, "
+        "selecting a region in any of the plots highlights the same genes in the others)"
+    )
+
+    st.button("Submit", on_click=submit_button_clicked)
+
+    c = st.empty()
+
+    if st.session_state.form_submitted:
+        display_volcano_chart(c, stpk_selected, mutant_selected_list, compare_mutants)
 
-if st.session_state.form_submitted:
-    display_volcano_chart(c)
+
+volcano_section()
 
 # Data table section
 st.header("Differential Phosphorylation Table")
@@ -134,70 +162,88 @@ st.header("Differential Phosphorylation Table")
 if "table_submitted" not in st.session_state:
     st.session_state.table_submitted = False
 
-stpk_table_select = st.multiselect(
-    "Choose STPKs to display data for:", STPK_LIST, default=None
-)
-
-# Select Mutant
-mutant_table_selected = st.radio(
-    "Select which mutant of the STPK you want to view differential phosphorylation for:",
-    ["OE", "LOF", "Both"],
-    key="mutant_table_selector",
-)
-
-mutant_table_selected_list = []
-if mutant_table_selected == "OE":
-    mutant_table_selected_list += ["OE"]
-elif mutant_table_selected == "LOF":
-    mutant_table_selected_list += ["LOF"]
-elif mutant_table_selected == "Both":
-    mutant_table_selected_list += ["OE", "LOF"]
-else:
-    raise ValueError("Invalid Mutant Value Selected")
-
-pval_cutoff = st.number_input("Choose a p-value cutoff", value=0.005, format="%f")
-
-pos_fold_change_bound = st.number_input(
-    "Choose a positive bound (selecting proteins with differential phosphorylation (log2(fold-change) above this bound))",
-    value=1.0,
-    format="%f",
-)
-
-neg_fold_change_bound = st.number_input(
-    "Choose a negative bound (selecting proteins with differential phosphorylation (log2(fold-change) below this bound))",
-    value=-1.0,
-    format="%f",
-)
-
 
 # Submit button
 def table_submit_clicked():
     st.session_state.table_submitted = True
 
 
-st.button("Submit", on_click=table_submit_clicked, key="table_submit")
-
-
-def display_phos_table(container):
+def display_phos_table(
+    container,
+    stpk_table_select,
+    mutant_table_selected_list,
+    pval_cutoff,
+    pos_fold_change_bound,
+    neg_fold_change_bound,
+):
     if not stpk_table_select:
         return None
-    filtered_table = (
-        phospho_table.filter(phospho_table["STPK"].isin(stpk_table_select))
-        .filter(phospho_table["p-value"] <= pval_cutoff)
-        .filter(
-            (phospho_table["Fold-change (log2)"] <= neg_fold_change_bound)
-            | (phospho_table["Fold-change (log2)"] >= pos_fold_change_bound)
-        )
-        .filter(phospho_table["Mutant"].isin(mutant_table_selected_list))
+    # Tightening an earlier filter (a lower cutoff, or fewer STPKs) is
+    # answered from the cached result of the earlier one
+    filter_spec = mkview.FilterSpec(
+        mkview.IsIn("STPK", stpk_table_select),
+        mkview.AtMost("p-value", pval_cutoff),
+        mkview.Outside("Fold-change (log2)", neg_fold_change_bound, pos_fold_change_bound),
+        mkview.IsIn("Mutant", mutant_table_selected_list),
     )
-    st.dataframe(filtered_table.to_pandas())
+    container.dataframe(mkview.execute_filtered(md_con, phospho_table, filter_spec))
     st.session_state.table_submitted = False
 
 
-table_container = st.empty()
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def table_section():
+    stpk_table_select = st.multiselect(
+        "Choose STPKs to display data for:", STPK_LIST, default=None
+    )
+
+    # Select Mutant
+    mutant_table_selected = st.radio(
+        "Select which mutant of the STPK you want to view differential phosphorylation for:",
+        ["OE", "LOF", "Both"],
+        key="mutant_table_selector",
+    )
+
+    mutant_table_selected_list = []
+    if mutant_table_selected == "OE":
+        mutant_table_selected_list += ["OE"]
+    elif mutant_table_selected == "LOF":
+        mutant_table_selected_list += ["LOF"]
+    elif mutant_table_selected == "Both":
+        mutant_table_selected_list += ["OE", "LOF"]
+    else:
+        raise ValueError("Invalid Mutant Value Selected")
+
+    pval_cutoff = st.number_input("Choose a p-value cutoff", value=0.005, format="%f")
+
+    pos_fold_change_bound = st.number_input(
+        "Choose a positive bound (selecting proteins with differential phosphorylation (log2(fold-change) above this bound))",
+        value=1.0,
+        format="%f",
+    )
+
+    neg_fold_change_bound = st.number_input(
+        "Choose a negative bound (selecting proteins with differential phosphorylation (log2(fold-change) below this bound))",
+        value=-1.0,
+        format="%f",
+    )
+
+    st.button("Submit", on_click=table_submit_clicked, key="table_submit")
+
+    table_container = st.empty()
+
+    if st.session_state.table_submitted:
+        display_phos_table(
+            table_container,
+            stpk_table_select,
+            mutant_table_selected_list,
+            pval_cutoff,
+            pos_fold_change_bound,
+            neg_fold_change_bound,
+        )
+
 
-if st.session_state.table_submitted:
-    display_phos_table(table_container)
+table_section()
 
 st.markdown(
     """
@@ -1,10 +1,7 @@
 # Imports
 # Standard Library Imports
 from __future__ import annotations
-import json
-
 # External Imports
-import ibis
 import streamlit as st
 
 # Local imports
@@ -13,31 +10,42 @@ import mkview
 # Setup/Data Reading
 # Streamlit setup
 st.set_page_config(layout="wide")
+# Profile the run (and the reruns of the fragments) when enabled, or when
+# requested with ?profile=1 and MKVIEW_PROFILE=request allows it (see
+# mkview.profiling)
+PROFILE_REQUESTED = st.query_params.get("profile") == "1"
+mkview.profile_page_run(requested=PROFILE_REQUESTED)
 
 if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False
 
 
 # Connect to database
+def create_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
+    md_token = st.secrets["MD_TOKEN"]
+    return mkview.connect(md_token=md_token)
+
+
 @st.cache_resource
 def get_database_connection():
-    md_token = st.secrets["MD_TOKEN"]
-    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+    return create_database_connection()
 
 
 md_con = get_database_connection()
+mkview.refresh_replica(md_con)
 
+# Warm the volcano plot caches in the background (once per process)
+mkview.start_cache_warmer(create_database_connection)
 
-@st.cache_data
-def get_tf_list():
-    with open("./data/tf_list.json") as f:
-        tf_list = json.load(f)
-    return tf_list
 
+# Tables and TF list from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+TF_LIST = catalog.tf_list
 
-TF_LIST = get_tf_list()
-
-tfoe_table = md_con.table("tfoe")
+tfoe_table = catalog.table("tfoe")
 
 st.title("Transcription Factor Overexpression")
 st.markdown("""
@@ -58,47 +66,49 @@ st.markdown("""
     (which shows up when you mouse is hovering over the table). 
 """)
 
+# Each section of the page is a fragment, so changing the inputs of one
+# section only reruns that section
 st.header("Volcano Plot")
 
-tf_selected = st.selectbox(
-    "Select which TF you want to view the changes in gene expression for:",
-    options=TF_LIST,
-    index=None
-)
-
 
 # submit button
 def volcano_submit_button_clicked():
     st.session_state.form_submitted = True
 
 
-st.button("Submit", on_click=volcano_submit_button_clicked)
-
-
-def display_volcano_chart(container):
+def display_volcano_chart(container, tf_selected):
     if not tf_selected:
         return None
-    filtered_table = tfoe_table.filter(
-        tfoe_table["TF"] == tf_selected
-    )
-    container.altair_chart(
-        mkview.tf_volcano_plot(
-            data_table=filtered_table,
-            foldchange_col="fold_change",
-            pval_col="p_value",
-            gene_col="Gene",
+    container.vega_lite_chart(
+        mkview.tf_volcano_spec(
+            md_con,
+            tf=tf_selected,
             volcano_width=600,
             volcano_height=600,
         ),
         use_container_width=False
     )
-    st.session_state.volcano_submit_button_clicked = False
+    st.session_state.form_submitted = False
+
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def volcano_section():
+    tf_selected = st.selectbox(
+        "Select which TF you want to view the changes in gene expression for:",
+        options=TF_LIST,
+        index=None
+    )
 
+    st.button("Submit", on_click=volcano_submit_button_clicked)
 
-c = st.empty()
+    c = st.empty()
 
-if st.session_state.form_submitted:
-    display_volcano_chart(c)
+    if st.session_state.form_submitted:
+        display_volcano_chart(c, tf_selected)
+
+
+volcano_section()
 
 # Data Table Section
 st.header("Differential Gene Expression Table")
@@ -107,52 +117,60 @@ st.header("Differential Gene Expression Table")
 if "table_submitted" not in st.session_state:
     st.session_state.table_submitted = False
 
-tf_table_select = st.multiselect(
-    "Select TFs to display data for:", TF_LIST, default=None
-)
-
-pval_cutoff = st.number_input("Choose a p-value cutoff", value=0.005, format="%f")
-
-pos_bound = st.number_input(
-    "Choose a positive bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
-    "above this level)",
-    value=1.0,
-    format="%f",
-)
-
-neg_bound = st.number_input(
-    "Choose a negative bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
-    "below this level)",
-    value=-1.0,
-    format="%f",
-)
-
 
 #  Submit button
 def table_submit_clicked():
     st.session_state.table_submitted = True
 
 
-st.button("Submit", on_click=table_submit_clicked, key="table_submit")
-
-
-def display_tf_table(container):
+def display_tf_table(container, tf_table_select, pval_cutoff, pos_bound, neg_bound):
     if not tf_table_select:
         return None
-    filtered_table = (tfoe_table
-    .filter(tfoe_table["TF"].isin(tf_table_select))
-    .filter(tfoe_table["p_value"] <= pval_cutoff)
-    .filter(
-        (tfoe_table["fold_change"] <= neg_bound) | (tfoe_table["fold_change"] >= pos_bound)
-    ))
-    container.dataframe(filtered_table.to_pandas())
+    # Tightening an earlier filter (a lower cutoff, or fewer TFs) is answered
+    # from the cached result of the earlier one
+    filter_spec = mkview.FilterSpec(
+        mkview.IsIn("TF", tf_table_select),
+        mkview.AtMost("p_value", pval_cutoff),
+        mkview.Outside("fold_change", neg_bound, pos_bound),
+    )
+    container.dataframe(mkview.execute_filtered(md_con, tfoe_table, filter_spec))
     st.session_state.table_submitted = False
 
 
-table_container = st.empty()
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def table_section():
+    tf_table_select = st.multiselect(
+        "Select TFs to display data for:", TF_LIST, default=None
+    )
+
+    pval_cutoff = st.number_input("Choose a p-value cutoff", value=0.005, format="%f")
+
+    pos_bound = st.number_input(
+        "Choose a positive bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
+        "above this level)",
+        value=1.0,
+        format="%f",
+    )
+
+    neg_bound = st.number_input(
+        "Choose a negative bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
+        "below this level)",
+        value=-1.0,
+        format="%f",
+    )
+
+    st.button("Submit", on_click=table_submit_clicked, key="table_submit")
+
+    table_container = st.empty()
+
+    if st.session_state.table_submitted:
+        display_tf_table(
+            table_container, tf_table_select, pval_cutoff, pos_bound, neg_bound
+        )
+
 
-if st.session_state.table_submitted:
-    display_tf_table(table_container)
+table_section()
 
 st.markdown(
     """
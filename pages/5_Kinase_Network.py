@@ -1,10 +1,7 @@
 # Imports
 # Standard Library Imports
 from __future__ import annotations
-import json
-
 # External Imports
-import ibis
 import streamlit as st
 import streamlit.components.v1 as components
 
@@ -14,6 +11,11 @@ import mkview
 # Setup/Data Reading
 # Streamlit setup
 st.set_page_config(layout="wide")
+# Profile the run (and the reruns of the fragments) when enabled, or when
+# requested with ?profile=1 and MKVIEW_PROFILE=request allows it (see
+# mkview.profiling)
+PROFILE_REQUESTED = st.query_params.get("profile") == "1"
+mkview.profile_page_run(requested=PROFILE_REQUESTED)
 
 if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False
@@ -22,21 +24,44 @@ if "form_submitted" not in st.session_state:
 # Connect to database
 @st.cache_resource
 def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
     md_token = st.secrets["MD_TOKEN"]
-    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+    return mkview.connect(md_token=md_token)
 
 
 md_con = get_database_connection()
-
-
-@st.cache_data
-def get_gene_list():
-    with open("./data/gene_list.json") as f:
-        gene_list = json.load(f)
-    return gene_list
-
-
-GENE_LIST = get_gene_list()
+mkview.refresh_replica(md_con)
+
+
+# Tables from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+# Genes are chosen by searching an index of their locus tags, names and
+# synonyms, so the full gene list isn't sent to the browser
+GENE_INDEX = mkview.get_gene_search_index(md_con, "gene_list")
+
+# Target sets tested for enrichment for each type of target
+ENRICHMENT_SOURCES = {
+    "Differential Gene Expression": "STPK DEG",
+    "Differential Phosphorylation": "STPK phosphosite",
+}
+ENRICHMENT_COLUMN_CONFIG = {
+    "source": "Target Set",
+    "regulator": "Regulator",
+    "mutant": "Mutant",
+    "set_size": "Targets",
+    "overlap": "Selected Targets",
+    "expected": st.column_config.NumberColumn("Expected", format="%.2f"),
+    "fold_enrichment": st.column_config.NumberColumn(
+        "Fold Enrichment", format="%.2f"
+    ),
+    "p_value": st.column_config.NumberColumn("p-value", format="%.2e"),
+    "q_value": st.column_config.NumberColumn(
+        "q-value (BH)", format="%.2e", help="Benjamini-Hochberg adjusted p-value"
+    ),
+    "overlap_genes": "Selected Genes in the Target Set",
+}
 
 # Start of Page
 st.title("Kinase Network Viewer")
@@ -53,7 +78,9 @@ st.markdown(
 )
 
 # Select genes of interest
-selected_genes = st.multiselect("Select genes of interest:", GENE_LIST, default=None)
+selected_genes = mkview.gene_selector(
+    "Select genes of interest:", GENE_INDEX, key="kinase_network_genes"
+)
 
 # Select Mutant
 mutant_selected = st.radio(
@@ -78,78 +105,163 @@ target_type_selected = st.radio(
 )
 
 
-# Select p-value cutoff
-pval_cutoff = st.number_input(
-    "Choose an upper p-value for significance", value=0.005, format="%f"
-)
-
-# Add physics?
-physics = st.checkbox("Add physics to graph?")
-
-# Kinase size
-kinase_size = st.number_input("Choose size for kinase nodes", value=20)
-
-# Gene Size
-gene_size = st.number_input("Choose size for gene nodes", value=10)
-
-# Kinase Color
-kinase_color = st.text_input(
-    "Choose Color for kinase nodes",
-    value="red",
-    help="You can select colors by name (or any html color identifier)",
-)
-
-# Gene Color
-gene_color = st.text_input(
-    "Choose Color for gene nodes",
-    value="blue",
-    help="You can select colors by name (or any html color identifier)",
-)
-
-
+# The genes, mutant and target type are shared by the network and enrichment
+# sections, the rest of the page is split into fragments so changing the
+# network options doesn't rerun the enrichment, and the other way around
 # Submit button
 def submit_button_clicked():
     st.session_state.form_submitted = True
 
 
-st.button("Submit", on_click=submit_button_clicked)
-
-
-def display_network(container):
+def display_network(
+    container,
+    pval_cutoff,
+    physics,
+    kinase_size,
+    gene_size,
+    kinase_color,
+    gene_color,
+):
     if selected_genes is None:
         return None
     if target_type_selected == "Differential Gene Expression":
-        kinase_target_table = md_con.table("all_kinase_diff_genes")
+        kinase_target_table = catalog.table("all_kinase_diff_genes")
         gene_col = "DEG"
     elif target_type_selected == "Differential Phosphorylation":
-        kinase_target_table = md_con.table("all_phosphosites")
+        kinase_target_table = catalog.table("all_phosphosites")
         gene_col = "Rv Number"
     else:
         ValueError("Invalid selection for target type")
-    kinase_network = mkview.create_kinase_network(
-        gene_list=selected_genes,
-        kinase_target_table=kinase_target_table,
-        kinase_size=kinase_size,
-        gene_size=gene_size,
-        kinase_color=kinase_color,
-        gene_color=gene_color,
-        mutant_type=mutant_selected_list,
-        pval_cutoff=pval_cutoff,
-        gene_col=gene_col,
-        pval_col="p-value",
+    def build_network_html():
+        kinase_network = mkview.create_kinase_network(
+            gene_list=selected_genes,
+            kinase_target_table=kinase_target_table,
+            kinase_size=kinase_size,
+            gene_size=gene_size,
+            kinase_color=kinase_color,
+            gene_color=gene_color,
+            mutant_type=mutant_selected_list,
+            pval_cutoff=pval_cutoff,
+            gene_col=gene_col,
+            pval_col="p-value",
+        )
+        kinase_network.toggle_physics(physics)
+        return kinase_network.generate_html()
+
+    # The generated html is cached, keyed by all of the network options
+    network_html = mkview.network_html.get_or_compute(
+        (
+            "kinase_network",
+            mkview.data_version(md_con),
+            target_type_selected,
+            tuple(selected_genes),
+            tuple(mutant_selected_list),
+            pval_cutoff,
+            kinase_size,
+            gene_size,
+            kinase_color,
+            gene_color,
+            physics,
+        ),
+        build_network_html,
     )
-    kinase_network.toggle_physics(physics)
     with container:
-        components.html(kinase_network.generate_html(), height=800, width=800)
+        components.html(network_html, height=800, width=800)
 
     # Reset form submitted button
     st.session_state.form_submitted = False
 
 
-c = st.empty()
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def network_section():
+    # Select p-value cutoff
+    pval_cutoff = st.number_input(
+        "Choose an upper p-value for significance", value=0.005, format="%f"
+    )
+
+    # Add physics?
+    physics = st.checkbox("Add physics to graph?")
+
+    # Kinase size
+    kinase_size = st.number_input("Choose size for kinase nodes", value=20)
+
+    # Gene Size
+    gene_size = st.number_input("Choose size for gene nodes", value=10)
+
+    # Kinase Color
+    kinase_color = st.text_input(
+        "Choose Color for kinase nodes",
+        value="red",
+        help="You can select colors by name (or any html color identifier)",
+    )
+
+    # Gene Color
+    gene_color = st.text_input(
+        "Choose Color for gene nodes",
+        value="blue",
+        help="You can select colors by name (or any html color identifier)",
+    )
+
+    st.button("Submit", on_click=submit_button_clicked)
+
+    c = st.empty()
+
+    if st.session_state.form_submitted:
+        display_network(
+            c,
+            pval_cutoff,
+            physics,
+            kinase_size,
+            gene_size,
+            kinase_color,
+            gene_color,
+        )
+
+
+network_section()
+
+# Enrichment section
+st.header("Kinase Target Enrichment")
+st.markdown(
+    """
+    Test the selected genes of interest for enrichment in the targets of each STPK mutant (its differentially
+    expressed genes or differentially phosphorylated proteins, whichever type of target is selected above),
+    using hypergeometric tests. The q-values are adjusted for testing every mutant with the Benjamini-Hochberg
+    procedure.
+    """
+)
+
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def enrichment_section():
+    enrichment_pval_cutoff = st.selectbox(
+        "p-value cutoff for the target sets",
+        options=mkview.PVAL_CUTOFFS,
+        index=0,
+        key="enrichment_pval_cutoff",
+    )
+
+    if selected_genes:
+        enrichment = mkview.regulator_enrichment(
+            md_con,
+            selected_genes,
+            pval_cutoff=enrichment_pval_cutoff,
+            fold_change_threshold=0.0,
+            sources=[ENRICHMENT_SOURCES[target_type_selected]],
+        )
+        st.dataframe(
+            enrichment,
+            use_container_width=True,
+            hide_index=True,
+            column_config=ENRICHMENT_COLUMN_CONFIG,
+        )
+    else:
+        st.caption("Select genes of interest above to test them for enrichment.")
+
 
-if st.session_state.form_submitted:
-    display_network(c)
+enrichment_section()
 
 st.markdown(
     """
@@ -1,10 +1,7 @@
 # Imports
 # Standard Library Imports
 from __future__ import annotations
-import json
-
 # External Imports
-import ibis
 import streamlit as st
 import streamlit.components.v1 as components
 
@@ -14,6 +11,11 @@ import mkview
 # Setup/Data Reading
 # Streamlit setup
 st.set_page_config(layout="wide")
+# Profile the run (and the reruns of the fragments) when enabled, or when
+# requested with ?profile=1 and MKVIEW_PROFILE=request allows it (see
+# mkview.profiling)
+PROFILE_REQUESTED = st.query_params.get("profile") == "1"
+mkview.profile_page_run(requested=PROFILE_REQUESTED)
 
 if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False
@@ -22,20 +24,40 @@ if "form_submitted" not in st.session_state:
 # Connect to database
 @st.cache_resource
 def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
     md_token = st.secrets["MD_TOKEN"]
-    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+    return mkview.connect(md_token=md_token)
 
 
 md_con = get_database_connection()
-
-
-@st.cache_data
-def get_gene_list():
-    with open("./data/tf_gene_list.json") as f:
-        gene_list = json.load(f)
-    return gene_list
-
-GENE_LIST = get_gene_list()
+mkview.refresh_replica(md_con)
+
+
+# Tables from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+# Genes are chosen by searching an index of their locus tags, names and
+# synonyms, so the full gene list isn't sent to the browser
+GENE_INDEX = mkview.get_gene_search_index(md_con, "tf_gene_list")
+
+ENRICHMENT_COLUMN_CONFIG = {
+    "regulator": "Regulator",
+    "set_size": "Targets",
+    "overlap": "Selected Targets",
+    "expected": st.column_config.NumberColumn("Expected", format="%.2f"),
+    "fold_enrichment": st.column_config.NumberColumn(
+        "Fold Enrichment", format="%.2f"
+    ),
+    "p_value": st.column_config.NumberColumn("p-value", format="%.2e"),
+    "q_value": st.column_config.NumberColumn(
+        "q-value (BH)", format="%.2e", help="Benjamini-Hochberg adjusted p-value"
+    ),
+    "overlap_genes": "Selected Genes in the Target Set",
+    # Only TF regulons are tested on this page
+    "source": None,
+    "mutant": None,
+}
 
 # Start of Page
 st.title("Transcription Factor Network Viewer")
@@ -53,85 +75,182 @@ st.markdown(
 )
 
 # Select genes of interest
-selected_genes = st.multiselect("Select genes of interest:", GENE_LIST, default=None)
-
-# Select p-value cutoff
-pval_cutoff = st.number_input(
-    "Choose an upper p-value for significance", value=0.005, format="%f"
-)
-
-pos_bound = st.number_input(
-    "Choose a positive bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
-    "above this level)",
-    value=1.0,
-    format="%f",
-)
-
-neg_bound = st.number_input(
-    "Choose a negative bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
-    "below this level)",
-    value=-1.0,
-    format="%f",
-)
-
-# Add physics?
-physics = st.checkbox("Add physics to graph?")
-
-# TF size
-tf_size = st.number_input("Choose size for TF nodes", value=20)
-
-# Gene Size
-gene_size = st.number_input("Choose size for gene nodes", value=10)
-
-# TF Color
-tf_color = st.text_input(
-    "Choose Color for TF nodes",
-    value="red",
-    help="You can select colors by name (or any html color identifier)",
-)
-
-# Gene Color
-gene_color = st.text_input(
-    "Choose Color for gene nodes",
-    value="blue",
-    help="You can select colors by name (or any html color identifier)",
+selected_genes = mkview.gene_selector(
+    "Select genes of interest:", GENE_INDEX, key="tf_network_genes"
 )
 
+# The selected genes are shared by the network and enrichment sections, the
+# rest of the page is split into fragments so changing the network options
+# doesn't rerun the enrichment, and the other way around
 # Submit button
 def submit_button_clicked():
     st.session_state.form_submitted = True
 
 
-st.button("Submit", on_click=submit_button_clicked)
-
-def display_network(container):
+def display_network(
+    container,
+    pval_cutoff,
+    pos_bound,
+    neg_bound,
+    physics,
+    tf_size,
+    gene_size,
+    tf_color,
+    gene_color,
+):
     if selected_genes is None:
         return None
-    tf_network = mkview.create_tf_network(
-        gene_list=selected_genes,
-        tf_target_table=md_con.table("tfoe"),
-        tf_size=tf_size,
-        gene_size=gene_size,
-        tf_color=tf_color,
-        gene_color=gene_color,
-        pval_cutoff=pval_cutoff,
-        neg_bound = neg_bound,
-        pos_bound=pos_bound,
-        gene_col="Gene",
-        pval_col="p_value",
+    def build_network_html():
+        tf_network = mkview.create_tf_network(
+            gene_list=selected_genes,
+            tf_target_table=catalog.table("tfoe"),
+            tf_size=tf_size,
+            gene_size=gene_size,
+            tf_color=tf_color,
+            gene_color=gene_color,
+            pval_cutoff=pval_cutoff,
+            neg_bound=neg_bound,
+            pos_bound=pos_bound,
+            gene_col="Gene",
+            pval_col="p_value",
+        )
+        tf_network.toggle_physics(physics)
+        return tf_network.generate_html()
+
+    # The generated html is cached, keyed by all of the network options
+    network_html = mkview.network_html.get_or_compute(
+        (
+            "tf_network",
+            mkview.data_version(md_con),
+            tuple(selected_genes),
+            pval_cutoff,
+            neg_bound,
+            pos_bound,
+            tf_size,
+            gene_size,
+            tf_color,
+            gene_color,
+            physics,
+        ),
+        build_network_html,
     )
-    tf_network.toggle_physics(physics)
     with container:
-        components.html(tf_network.generate_html(), height=800, width=800)
+        components.html(network_html, height=800, width=800)
 
     # Reset form submitted button
     st.session_state.form_submitted = False
 
 
-c = st.empty()
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def network_section():
+    # Select p-value cutoff
+    pval_cutoff = st.number_input(
+        "Choose an upper p-value for significance", value=0.005, format="%f"
+    )
+
+    pos_bound = st.number_input(
+        "Choose a positive bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
+        "above this level)",
+        value=1.0,
+        format="%f",
+    )
+
+    neg_bound = st.number_input(
+        "Choose a negative bound (including TF-gene interactions where the TF overexpression induces a (log2) fold change"
+        "below this level)",
+        value=-1.0,
+        format="%f",
+    )
+
+    # Add physics?
+    physics = st.checkbox("Add physics to graph?")
+
+    # TF size
+    tf_size = st.number_input("Choose size for TF nodes", value=20)
+
+    # Gene Size
+    gene_size = st.number_input("Choose size for gene nodes", value=10)
+
+    # TF Color
+    tf_color = st.text_input(
+        "Choose Color for TF nodes",
+        value="red",
+        help="You can select colors by name (or any html color identifier)",
+    )
+
+    # Gene Color
+    gene_color = st.text_input(
+        "Choose Color for gene nodes",
+        value="blue",
+        help="You can select colors by name (or any html color identifier)",
+    )
+
+    st.button("Submit", on_click=submit_button_clicked)
+
+    c = st.empty()
+
+    if st.session_state.form_submitted:
+        display_network(
+            c,
+            pval_cutoff,
+            pos_bound,
+            neg_bound,
+            physics,
+            tf_size,
+            gene_size,
+            tf_color,
+            gene_color,
+        )
+
+
+network_section()
+
+# Enrichment section
+st.header("Transcription Factor Regulon Enrichment")
+st.markdown(
+    """
+    Test the selected genes of interest for enrichment in the regulon of each transcription factor, using
+    hypergeometric tests. The q-values are adjusted for testing every transcription factor with the
+    Benjamini-Hochberg procedure.
+    """
+)
+
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def enrichment_section():
+    enrichment_pval_cutoff = st.selectbox(
+        "p-value cutoff for the target sets",
+        options=mkview.PVAL_CUTOFFS,
+        index=0,
+        key="enrichment_pval_cutoff",
+    )
+    enrichment_fold_change = st.selectbox(
+        "Fold change threshold (log2) for the target sets",
+        options=mkview.FOLD_CHANGE_THRESHOLDS,
+        index=0,
+        key="enrichment_fold_change",
+    )
 
-if st.session_state.form_submitted:
-    display_network(c)
+    if selected_genes:
+        enrichment = mkview.regulator_enrichment(
+            md_con,
+            selected_genes,
+            pval_cutoff=enrichment_pval_cutoff,
+            fold_change_threshold=enrichment_fold_change,
+            sources=["TF regulon"],
+        )
+        st.dataframe(
+            enrichment,
+            use_container_width=True,
+            hide_index=True,
+            column_config=ENRICHMENT_COLUMN_CONFIG,
+        )
+    else:
+        st.caption("Select genes of interest above to test them for enrichment.")
+
+
+enrichment_section()
 
 st.markdown(
     """
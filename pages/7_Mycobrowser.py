@@ -1,17 +1,21 @@
 # Imports
 # Standard Library Imports
 from __future__ import annotations
-import json
 
 # External Imports
-import ibis
 import streamlit as st
 
 # Local imports
+import mkview
 
 # Setup/Data Reading
 # Streamlit setup
 st.set_page_config(layout="wide")
+# Profile the run (and the reruns of the fragments) when enabled, or when
+# requested with ?profile=1 and MKVIEW_PROFILE=request allows it (see
+# mkview.profiling)
+PROFILE_REQUESTED = st.query_params.get("profile") == "1"
+mkview.profile_page_run(requested=PROFILE_REQUESTED)
 
 if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False
@@ -20,19 +24,25 @@ if "form_submitted" not in st.session_state:
 # Connect to database
 @st.cache_resource
 def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
     md_token = st.secrets["MD_TOKEN"]
-    return ibis.duckdb.connect(f"md:mkviewer?motherduck_token={md_token}")
+    return mkview.connect(md_token=md_token)
 
 
 # Get database connection
 md_con = get_database_connection()
+mkview.refresh_replica(md_con)
 
-mycobrowser_table = md_con.table("mycobrowser")
+# Table and species list from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+mycobrowser_table = catalog.table("mycobrowser")
 possible_columns = mycobrowser_table.columns
+# Columns containing text, which can be searched
+string_columns = set(mkview.string_columns(mycobrowser_table))
 
-# Get list of possible species
-with open("./data/mycobrowser_species_list.json", "r") as f:
-    possible_species_list = json.load(f)
+possible_species_list = catalog.species_list
 
 # Start of page
 st.title("Mycobrowser")
@@ -53,37 +63,13 @@ st.markdown(
     """
 )
 
-search_str = st.text_input(
-    "Search term",
-    value="",
-    help="Will search for a match in the columns selected below, case insensitive",
-)
-
-case_insensitive = st.checkbox("Case Insensitive Search", value=True)
-
-columns_selected = st.multiselect(
-    "Select columns of interest (leave blank to include all)",
-    possible_columns,
-    default=None,
-)
-
-species_selected = st.multiselect(
-    "Select species of interest (leave blank to include all)",
-    possible_species_list,
-    default=None,
-)
-
-
 # Submit button
 def submit_button_clicked():
     st.session_state.form_submitted = True
 
 
-st.button("Submit", on_click=submit_button_clicked)
-
-
 def display_mycobrowser_table(
-    container, search_str, species_selected, columns_selected
+    container, search_str, case_insensitive, species_selected, columns_selected
 ):
     if search_str == "":
         return None
@@ -91,47 +77,84 @@ def display_mycobrowser_table(
         species_selected = possible_species_list
     if not columns_selected:
         columns_selected = possible_columns
-    if case_insensitive:
-        search_str = "(?i)" + search_str
-    # Create a list of searchable columns (those that contain strings)
-    search_columns = [
-        col
-        for col in columns_selected
-        if isinstance(mycobrowser_table.schema()[col], ibis.expr.datatypes.core.String)
-    ]
-    filtered_table = mycobrowser_table.filter(
-        mycobrowser_table["species"].isin(species_selected)
-    )
-    search_filter = filtered_table[search_columns.pop()].re_search(search_str)
-    for col in search_columns:
-        search_filter |= filtered_table[col].re_search(search_str)
-    filtered_table = filtered_table.filter(search_filter)
-
-    # Display dataframe
-    st.dataframe(
-        filtered_table.select(columns_selected).to_pandas(),
-        use_container_width=True,
-        hide_index=True,
-    )
-    st.download_button(
-        "Download Full csv",
-        filtered_table.to_pandas().to_csv(),
-        mime="text/csv",
-        file_name="filtered_mycobrowser.csv",
+    # Search the selected columns which contain strings
+    search_columns = [col for col in columns_selected if col in string_columns]
+    if not search_columns:
+        container.warning("None of the selected columns can be searched")
+        return None
+    # The full table is needed for the download, so the displayed table is
+    # selected from the same result rather than queried separately
+    filtered_table = mkview.search_table(
+        mycobrowser_table,
+        search_str,
+        search_columns,
+        case_insensitive=case_insensitive,
+        predicates=[mycobrowser_table["species"].isin(species_selected)],
     )
+
+    # Display dataframe, broad searches first show a preview (with an
+    # estimated row count) which is replaced by the full table once loaded
+    for result in mkview.fetch_progressive(md_con, filtered_table):
+        filtered_df = result.frame
+        with container.container():
+            if not result.complete:
+                st.caption(result.progress_text("matching rows"))
+            st.dataframe(
+                filtered_df[list(columns_selected)],
+                use_container_width=True,
+                hide_index=True,
+            )
+            if result.complete:
+                st.download_button(
+                    "Download Full csv",
+                    filtered_df.to_csv(),
+                    mime="text/csv",
+                    file_name="filtered_mycobrowser.csv",
+                )
     st.session_state.form_submitted = False
 
 
-c = st.empty()
+# The search is a fragment, so changing its inputs (or downloading the
+# results) doesn't rerun the rest of the page
+@st.fragment
+@mkview.profile_fragment(requested=PROFILE_REQUESTED)
+def search_section():
+    search_str = st.text_input(
+        "Search term",
+        value="",
+        help="Will search for a match in the columns selected below, case insensitive",
+    )
+
+    case_insensitive = st.checkbox("Case Insensitive Search", value=True)
+
+    columns_selected = st.multiselect(
+        "Select columns of interest (leave blank to include all)",
+        possible_columns,
+        default=None,
+    )
 
-if st.session_state.form_submitted:
-    display_mycobrowser_table(
-        c,
-        search_str=search_str,
-        species_selected=species_selected,
-        columns_selected=columns_selected,
+    species_selected = st.multiselect(
+        "Select species of interest (leave blank to include all)",
+        possible_species_list,
+        default=None,
     )
 
+    st.button("Submit", on_click=submit_button_clicked)
+
+    c = st.empty()
+
+    if st.session_state.form_submitted:
+        display_mycobrowser_table(
+            c,
+            search_str=search_str,
+            case_insensitive=case_insensitive,
+            species_selected=species_selected,
+            columns_selected=columns_selected,
+        )
+
+
+search_section()
+
 st.markdown(
     """
     ## Sources:
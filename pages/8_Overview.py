@@ -0,0 +1,180 @@
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+# External Imports
+import streamlit as st
+
+# Local imports
+import mkview
+
+# Setup/Data Reading
+# Streamlit setup
+st.set_page_config(layout="wide")
+# Profile the run when enabled, or when requested with ?profile=1 and
+# MKVIEW_PROFILE=request allows it (see mkview.profiling)
+mkview.profile_page_run(requested=st.query_params.get("profile") == "1")
+
+
+# Connect to database
+@st.cache_resource
+def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
+    md_token = st.secrets["MD_TOKEN"]
+    return mkview.connect(md_token=md_token)
+
+
+md_con = get_database_connection()
+mkview.refresh_replica(md_con)
+
+
+# Gene list from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+
+
+# The summary tables are small, so they are read in full once and
+# then filtered in memory (the data version is included so a sync
+# invalidates them)
+@st.cache_data
+def get_summary_table(table_name: str, data_version: str):
+    return mkview.pooled_to_pyarrow(catalog.table(table_name)).to_pandas()
+
+
+GENE_LIST = catalog.gene_list
+
+compendia_summary = get_summary_table(
+    mkview.COMPENDIA_SUMMARY_TABLE, mkview.data_version(md_con)
+)
+kinase_summary = get_summary_table(
+    mkview.KINASE_SUMMARY_TABLE, mkview.data_version(md_con)
+)
+tf_summary = get_summary_table(
+    mkview.TF_SUMMARY_TABLE, mkview.data_version(md_con)
+)
+
+# Start of Page
+st.title("Overview")
+st.markdown(
+    """
+    Welcome to the Overview! This page gives quick summary statistics across all of the data sets, using
+    counts which are precomputed at a set of standard cutoffs. For the full tables (or for custom cutoffs)
+    use the individual viewers.
+
+    The first section shows, for a gene of interest, how many conditions in the gene expression compendia
+    (Yoo et al., 2022) change the expression of that gene past each of the standard log2(fold-change)
+    thresholds. The second section shows the number of differentially phosphorylated sites, or differentially
+    expressed genes, for each of the STPK mutants (Frando et al., 2023). The third section shows the size of
+    the regulon of each transcription factor (Rustad et al., 2014).
+    """
+)
+
+# Compendia Section
+st.header("Gene Expression Compendia")
+
+overview_gene = st.selectbox(
+    "Select a gene to summarize:", options=GENE_LIST, index=None
+)
+
+if overview_gene is not None:
+    gene_counts = compendia_summary[compendia_summary["Gene"] == overview_gene]
+    st.dataframe(
+        gene_counts.sort_values("fold_change_threshold"),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "fold_change_threshold": "Fold Change Threshold (log2)",
+            "n_up": "Conditions Above Threshold",
+            "n_down": "Conditions Below Negative Threshold",
+            "n_conditions": "Total Conditions",
+        },
+    )
+
+# STPK Section
+st.header("STPK Differential Phosphorylation and Gene Expression")
+
+kinase_dataset = st.radio(
+    "Select which data set to summarize:",
+    ["Differential Phosphorylation", "Differential Gene Expression"],
+)
+kinase_pval_cutoff = st.selectbox(
+    "Choose a p-value cutoff", options=mkview.PVAL_CUTOFFS, index=2
+)
+
+dataset_name = (
+    "phosphosites"
+    if kinase_dataset == "Differential Phosphorylation"
+    else "gene_expression"
+)
+kinase_counts = kinase_summary[
+    (kinase_summary["dataset"] == dataset_name)
+    & (kinase_summary["pval_cutoff"] == kinase_pval_cutoff)
+]
+st.dataframe(
+    kinase_counts.pivot(index="STPK", columns="Mutant", values="n_hits")
+    .fillna(0)
+    .astype(int),
+    use_container_width=True,
+)
+with st.expander("Counts split by direction of change"):
+    st.dataframe(
+        kinase_counts.drop(columns=["dataset", "pval_cutoff"]).sort_values(
+            ["STPK", "Mutant"]
+        ),
+        use_container_width=True,
+        hide_index=True,
+    )
+
+# TF Section
+st.header("Transcription Factor Regulons")
+
+tf_pval_cutoff = st.selectbox(
+    "Choose a p-value cutoff",
+    options=mkview.PVAL_CUTOFFS,
+    index=2,
+    key="tf_pval_cutoff",
+)
+tf_fold_change_threshold = st.selectbox(
+    "Choose a fold change threshold (log2)",
+    options=mkview.FOLD_CHANGE_THRESHOLDS,
+    index=0,
+)
+
+tf_counts = tf_summary[
+    (tf_summary["pval_cutoff"] == tf_pval_cutoff)
+    & (tf_summary["fold_change_threshold"] == tf_fold_change_threshold)
+]
+st.dataframe(
+    tf_counts.drop(columns=["pval_cutoff", "fold_change_threshold"]).sort_values(
+        "n_targets", ascending=False
+    ),
+    use_container_width=True,
+    hide_index=True,
+    column_config={
+        "n_targets": "Regulon Size",
+        "n_induced": "Induced Genes",
+        "n_repressed": "Repressed Genes",
+    },
+)
+
+st.markdown(
+    """
+    ## Sources:
+    -  [Frando A, Boradia V, Gritsenko M, Beltejar C, Day L, Sherman DR, Ma S, Jacobs JM, Grundner C. The Mycobacterium
+    tuberculosis protein O-phosphorylation landscape. Nat Microbiol. 2023 Mar;8(3):548-561. doi: 10.1038/s41564-022-01313-7.
+    Epub 2023 Jan 23. PMID: 36690861.](https://doi.org/10.1038/s41564-022-01313-7)
+    - [Rustad TR, Minch KJ, Ma S, Winkler JK, Hobbs S, Hickey M, Brabant W, Turkarslan S, Price ND, Baliga NS,
+    Sherman DR. Mapping and manipulating the Mycobacterium tuberculosis transcriptome using a transcription factor
+    overexpression-derived regulatory network. Genome Biol. 2014;15(11):502. doi: 10.1186/PREACCEPT-1701638048134699.
+    PMID: 25380655; PMCID: PMC4249609.](https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4249609/)
+     - [Yoo R, Rychel K, Poudel S, Al-Bulushi T, Yuan Y, Chauhan S, Lamoureux C, Palsson BO, Sastry A. Machine Learning of
+    All Mycobacterium tuberculosis H37Rv RNA-seq Data Reveals a Structured Interplay between Metabolism, Stress Response,
+    and Infection. mSphere. 2022 Apr 27;7(2)\:e0003322. doi: 10.1128/msphere.00033-22. Epub 2022 Mar 21. PMID: 35306876;
+    PMCID: PMC9044949.](https://www.ncbi.nlm.nih.gov/pmc/articles/PMC9044949/)
+    """
+)
+
+st.link_button(
+    label="Github Repository",
+    url="https://github.com/Ma-Lab-Seattle-Childrens-CGIDR/mkviewer_st",
+)
@@ -0,0 +1,127 @@
+# Imports
+# Standard Library Imports
+from __future__ import annotations
+# External Imports
+import streamlit as st
+
+# Local imports
+import mkview
+
+# Setup/Data Reading
+# Streamlit setup
+st.set_page_config(layout="wide")
+# Profile the run when enabled, or when requested with ?profile=1 and
+# MKVIEW_PROFILE=request allows it (see mkview.profiling)
+mkview.profile_page_run(requested=st.query_params.get("profile") == "1")
+
+
+# Connect to database
+@st.cache_resource
+def get_database_connection():
+    # Use the local replica when one has been synced
+    if mkview.replica_path() is not None:
+        return mkview.connect()
+    md_token = st.secrets["MD_TOKEN"]
+    return mkview.connect(md_token=md_token)
+
+
+md_con = get_database_connection()
+mkview.refresh_replica(md_con)
+
+
+# Gene list from the catalog (loaded once per process)
+catalog = mkview.get_catalog(md_con)
+GENE_LIST = catalog.gene_list
+
+SECTION_COLUMN_CONFIG = {
+    "compendia": {
+        "pubmed_link": st.column_config.LinkColumn(
+            "Pubmed",
+            help="Link to associated paper on pubmed",
+            validate=r"^https://pubmed.ncbi.nlm.nih.gov/\d+/",
+            max_chars=100,
+            display_text=r"^https://pubmed.ncbi.nlm.nih.gov/(\d+)/",
+        ),
+        "fold_change_log2_tpm": "Fold Change (log2(tpm))",
+    },
+    "tf_regulators": {"fold_change": "Fold Change (log2)", "p_value": "p-value"},
+    "tf_targets": {"fold_change": "Fold Change (log2)", "p_value": "p-value"},
+}
+
+# Start of Page
+st.title("Gene Profile")
+st.markdown(
+    """
+    Welcome to the Gene Profile! Select a gene (by its locus tag) to see everything about it across all of
+    the data sets on one page: the conditions in the gene expression compendia (Yoo et al., 2022) which
+    change its expression the most, its differentially phosphorylated sites and differential expression in the
+    STPK mutants (Frando et al., 2023), the transcription factors which regulate it and (if it is a
+    transcription factor) the genes it regulates (Rustad et al., 2014), and its Mycobrowser annotations in
+    every species where a gene with the same name is found.
+
+    All of the sections are loaded at the same time, and each one is shown as soon as it is ready.
+    The gene can also be given in the address of the page (e.g. `?gene=Rv0001`), so profiles can be shared.
+    """
+)
+
+# A gene given in the page address is selected to begin with
+linked_gene = st.query_params.get("gene")
+profile_gene = st.selectbox(
+    "Select a gene:",
+    options=GENE_LIST,
+    index=GENE_LIST.index(linked_gene) if linked_gene in GENE_LIST else None,
+)
+
+if profile_gene is not None:
+    st.query_params["gene"] = profile_gene
+    # A placeholder is made for every section up front so the layout doesn't
+    # shift as the sections finish in whatever order
+    placeholders = {}
+    for section, title in mkview.PROFILE_SECTIONS.items():
+        st.header(title)
+        placeholders[section] = st.empty()
+        placeholders[section].caption("Loading...")
+    shown = set()
+    for result in mkview.fetch_gene_profile(md_con, profile_gene):
+        shown.add(result.section)
+        container = placeholders[result.section].container()
+        if result.error is not None:
+            container.error(f"Failed to load this section: {result.error}")
+        elif result.frame.empty:
+            container.caption("No entries for this gene.")
+        else:
+            container.dataframe(
+                result.frame,
+                use_container_width=True,
+                hide_index=True,
+                column_config=SECTION_COLUMN_CONFIG.get(result.section),
+            )
+            container.caption(f"Loaded in {result.seconds:.2f} s")
+    # Sections whose tables aren't in the database
+    for section in placeholders.keys() - shown:
+        placeholders[section].caption("Not available.")
+
+st.markdown(
+    """
+    ## Sources:
+    -  [Frando A, Boradia V, Gritsenko M, Beltejar C, Day L, Sherman DR, Ma S, Jacobs JM, Grundner C. The Mycobacterium
+    tuberculosis protein O-phosphorylation landscape. Nat Microbiol. 2023 Mar;8(3):548-561. doi: 10.1038/s41564-022-01313-7.
+    Epub 2023 Jan 23. PMID: 36690861.](https://doi.org/10.1038/s41564-022-01313-7)
+    -  [Kapopoulou A, Lew JM, Cole ST. The MycoBrowser portal: a comprehensive and manually annotated
+    resource for mycobacterial genomes. Tuberculosis (Edinb). 2011 Jan;91(1):8-13. doi: 10.1016/j.tube.2010.09.006.
+    Epub 2010 Oct 25. PMID: 20980200.](https://www.sciencedirect.com/science/article/abs/pii/S1472979210001095?via%3Dihub)
+    - [Rustad TR, Minch KJ, Ma S, Winkler JK, Hobbs S, Hickey M, Brabant W, Turkarslan S, Price ND, Baliga NS,
+    Sherman DR. Mapping and manipulating the Mycobacterium tuberculosis transcriptome using a transcription factor
+    overexpression-derived regulatory network. Genome Biol. 2014;15(11):502. doi: 10.1186/PREACCEPT-1701638048134699.
+    PMID: 25380655; PMCID: PMC4249609.](https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4249609/)
+     - [Yoo R, Rychel K, Poudel S, Al-Bulushi T, Yuan Y, Chauhan S, Lamoureux C, Palsson BO, Sastry A. Machine Learning of
+    All Mycobacterium tuberculosis H37Rv RNA-seq Data Reveals a Structured Interplay between Metabolism, Stress Response,
+    and Infection. mSphere. 2022 Apr 27;7(2)\\:e0003322. doi: 10.1128/msphere.00033-22. Epub 2022 Mar 21. PMID: 35306876;
+    PMCID: PMC9044949.](https://www.ncbi.nlm.nih.gov/pmc/articles/PMC9044949/)
+    """
+)
+
+st.link_button(
+    label="Github Repository",
+    url="https://github.com/Ma-Lab-Seattle-Childrens-CGIDR/mkviewer_st",
+)